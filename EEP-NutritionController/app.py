@@ -4,6 +4,7 @@ from fastapi.middleware.cors import CORSMiddleware
 from fastapi import FastAPI, File, UploadFile, Form, Depends, HTTPException, status, Request
 from fastapi.responses import JSONResponse
 import requests
+import asyncio
 import os
 import sys
 from pydantic import BaseModel
@@ -14,6 +15,9 @@ from typing import Optional
 # Add Database directory to the path so we can import the db module
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), 'Database')))
 from Database.db import user_signup, user_signin, save_bacteria_data, save_clinical_data, save_meal_data, get_user_clinical_data, get_user_microbiome_data
+from feature_store import open_feature_store, presence_vector, split_csv
+from stage_metrics import StageMetrics
+from tracing import Tracing
 
 # Schemas for user authentication
 class UserSignup(BaseModel):
@@ -33,6 +37,28 @@ from prometheus_client import make_asgi_app, Counter, Summary, Gauge
 REQUEST_COUNT = Counter("request_count", "Total number of requests")
 REQUEST_LATENCY = Summary("request_latency_seconds", "Request latency")
 PREDICTION_VALUE = Gauge("last_prediction_value", "Last predicted value")
+# Spans for requests and stages, continued across services via traceparent (see tracing.py)
+tracing = Tracing("nutrition-controller")
+# Latency histograms by endpoint and by pipeline stage: downstream calls (food, nutrition,
+# glucose, gut_health), db_read, db_write, feature_store_write and parse
+stage_metrics = StageMetrics("nutrition_controller", tracing)
+
+def timed(stage, fn):
+    """`fn` with each call recorded as `stage` of the current endpoint."""
+    def wrapper(*args, **kwargs):
+        with stage_metrics.stage(stage):
+            return fn(*args, **kwargs)
+    return wrapper
+
+# === Database Calls (timed as db_read / db_write) ===
+get_user_clinical_data = timed("db_read", get_user_clinical_data)
+get_user_microbiome_data = timed("db_read", get_user_microbiome_data)
+user_signin = timed("db_read", user_signin)
+user_signup = timed("db_write", user_signup)
+save_bacteria_data = timed("db_write", save_bacteria_data)
+save_clinical_data = timed("db_write", save_clinical_data)
+save_meal_data = timed("db_write", save_meal_data)
+split_csv = timed("parse", split_csv)
 
 # === Setup App ===
 app = FastAPI()
@@ -54,17 +80,271 @@ app.mount("/metrics", metrics_app)
 @app.middleware("http")
 async def prometheus_middleware(request: Request, call_next):
     REQUEST_COUNT.inc()
+    endpoint = stage_metrics.begin(request)
     start_time = time.time()
     response = await call_next(request)
-    REQUEST_LATENCY.observe(time.time() - start_time)
+    elapsed = time.time() - start_time
+    REQUEST_LATENCY.observe(elapsed)
+    stage_metrics.observe_request(endpoint, request.method, response.status_code, elapsed)
     return response
 
+# Declared after prometheus_middleware so the request span wraps it and the stages
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    with tracing.server_span(request) as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+        return response
+
+@app.on_event("shutdown")
+def close_tracing():
+    tracing.shutdown()
+
 # Get service URLs
 FOOD_ANALYZER_URL = os.environ.get('FOOD_ANALYZER_URL', 'http://localhost:8001')
 NUTRITION_PREDICTOR_URL = os.environ.get('NUTRITION_PREDICTOR_URL', 'http://localhost:8002')
 MICROBIOM_ANALYZER_URL = os.environ.get('MICROBIOM_ANALYZER_URL', 'http://localhost:8003')
 GLUCOSE_MONITOR_URL = os.environ.get('GLUCOSE_MONITOR_URL', 'http://localhost:8004')
 
+def post_service(stage, url, headers=None, **kwargs):
+    """POST to a downstream service, timed and traced as `stage` of the current endpoint.
+
+    The stage span's context goes along as `traceparent`, so the service's
+    own spans join the same trace.
+    """
+    with stage_metrics.stage(stage):
+        return requests.post(url, headers=tracing.inject(headers), **kwargs)
+
+# Shared microbiome feature store (FEATURE_STORE_PATH): profiles are parsed once here
+# and the IEPs receive a (user_id, version) reference instead of the CSV
+feature_store = open_feature_store()
+
+def bacteria_string_from_cells(cells):
+    """0/1 string of a microbiome row as stored by save_bacteria_data."""
+    return ''.join([val.strip() for val in cells])
+
+def store_microbiome_profile(user_id, parsed):
+    """Store an upload parsed by split_csv; returns its version, or None if unavailable."""
+    if feature_store is None or not user_id:
+        return None
+    header, columns, cells = parsed
+    try:
+        with stage_metrics.stage("feature_store_write"):
+            return feature_store.put_profile(user_id, header, presence_vector(columns, cells))
+    except Exception as e:
+        print(f"Warning: Failed to store microbiome profile: {str(e)}")
+        return None
+
+# === Shared Pipeline Steps ===
+
+def saved_bio_csv(user_id):
+    """One-row bio CSV rebuilt from the user's saved clinical data (None if there is none)."""
+    clinical_data = get_user_clinical_data(user_id)
+    if not clinical_data:
+        return None
+
+    # 1. Build a single-row DataFrame, including user_id
+    df = pd.DataFrame(
+        [{ **{"user_id": user_id}, **clinical_data }]
+    )
+
+    # 2. Rename to exact headers your glucose-monitor expects
+    df.rename(columns={
+        "user_id":                   "user_id",            # space, lowercase
+        "clinical_age":              "clinical_Age",       # underscore + capital A
+        "clinical_weight":           "clinical_Weight",
+        "clinical_height":           "clinical_Height",
+        "clinical_bmi":              "clinical_BMI",
+        "clinical_fasting_glucose":  "clinical_fasting_glucose",
+        "clinical_fasting_insulin":  "clinical_fasting_insulin",
+        "clinical_hba1c":            "clinical_HbA1c",
+        "clinical_homa_ir":          "clinical_HOMA_IR",
+        "clinical_gender":           "clinical_Gender",
+    }, inplace=True)
+
+    # 3. Now serialize
+    csv_buffer = io.BytesIO()
+    df.to_csv(csv_buffer, index=False)
+    return csv_buffer.getvalue()
+
+def request_gut_health(csv_bytes, content_type, user_id=None, profile_version=None):
+    """Gut-health prediction for one profile, by feature-store reference when stored."""
+    if profile_version is not None:
+        gut_response = post_service(
+            "gut_health", f"{MICROBIOM_ANALYZER_URL}/predict-gut-health-file",
+            data={"profile_user_id": user_id, "profile_version": profile_version}
+        )
+    else:
+        gut_response = post_service(
+            "gut_health", f"{MICROBIOM_ANALYZER_URL}/predict-gut-health-file",
+            files={"file": ("subject.csv", csv_bytes, content_type)}
+        )
+
+    if gut_response.status_code != 200:
+        return {"error": "Gut health prediction failed", "details": gut_response.text}
+    return gut_response.json()
+
+def predict_meal_glucose(image_bytes, content_type, description, meal_category,
+                         bio_bytes, micro_bytes, user_id=None, profile_version=None):
+    """Caption the meal image, predict its nutrition and the user's glucose response.
+
+    Returns (nutrition, glucose, error); `error` is a response dict when a step fails.
+    The microbiome goes to the glucose monitor as a feature-store reference when
+    `profile_version` is set, otherwise as the `micro_bytes` CSV.
+    """
+    # === STEP 1: Analyze Meal ===
+    # Send to food analyzer service
+    caption_response = post_service(
+        "food", f"{FOOD_ANALYZER_URL}/generate-labels",
+        files={"image": ("meal.jpg", image_bytes, content_type)}
+    )
+
+    if caption_response.status_code != 200:
+        return None, None, {"error": "Caption failed", "details": caption_response.text}
+
+    # Process labels
+    labels = [
+        label for label in caption_response.json().get("labels", [])
+        if label.get("confidence", 0) >= 20
+    ]
+
+    # Handle case where no labels detected
+    if not labels and (not description or description.strip().lower() == "none"):
+        return None, None, {
+            "error": "Image not clear",
+            "message": "No ingredients were confidently detected from the image. Please provide a description of the meal to improve prediction."
+        }
+
+    # Build caption
+    ingredient_caption = "A dish containing " + ", ".join([
+        f"{label['name']} ({round(label['confidence'], 1)}%)"
+        for label in labels
+    ]) if labels else ""
+
+    if description and description.strip().lower() != "none":
+        full_caption = f"{ingredient_caption}. Additional description: {description.strip()}" if ingredient_caption else description.strip()
+    else:
+        full_caption = ingredient_caption
+
+    # Get nutrition prediction
+    nutrition_response = post_service(
+        "nutrition", f"{NUTRITION_PREDICTOR_URL}/predict-nutrition",
+        json={"caption": full_caption}
+    )
+
+    if nutrition_response.status_code != 200:
+        return None, None, {"error": "Nutrition failed", "details": nutrition_response.text}
+
+    # The predictor reports failures as {"error": ...}; never feed a missing estimate to the glucose model
+    nutrition = nutrition_response.json().get("nutrition")
+    if not nutrition:
+        return None, None, {"error": "Nutrition failed", "details": nutrition_response.json().get("error")}
+
+    glucose_data = {
+        "protein_pct": nutrition.get("protein_pct", 0),
+        "fat_pct": nutrition.get("fat_pct", 0),
+        "carbs_pct": nutrition.get("carbs_pct", 0),
+        "sugar_risk": nutrition.get("sugar_risk", 0),
+        "refined_carb": nutrition.get("refined_carb", 0),
+        "meal_category": meal_category
+    }
+    glucose_files = {"bio_file": ("bio.csv", bio_bytes, "text/csv")}
+    # Microbiome by feature-store reference when stored, otherwise as a CSV upload
+    if profile_version is not None:
+        glucose_data.update({"profile_user_id": user_id, "profile_version": profile_version})
+    else:
+        glucose_files["micro_file"] = ("micro.csv", micro_bytes, "text/csv")
+    glucose_response = post_service(
+        "glucose", f"{GLUCOSE_MONITOR_URL}/predict-glucose",
+        data=glucose_data,
+        files=glucose_files
+    )
+
+    if glucose_response.status_code != 200:
+        return nutrition, None, {"error": "glucose prediction failed", "details": glucose_response.text}
+
+    glucose = glucose_response.json()
+
+    return nutrition, glucose, None
+
+def save_bio_upload(user_id, bio_bytes):
+    """Save the clinical values of an uploaded bio CSV; returns database_info fields."""
+    # 1) Read the uploaded bio CSV into a DataFrame
+    with stage_metrics.stage("parse"):
+        bio_df = pd.read_csv(io.BytesIO(bio_bytes))
+
+    if len(bio_df) >= 1:
+        # 2) Extract headers and values from the first (and only) row
+        raw_headers = bio_df.columns.tolist()
+        values      = bio_df.iloc[0].tolist()
+
+        # 3) Prepare an empty clinical_data dict
+        clinical_data = {
+            'clinical_age': None,
+            'clinical_weight': None,
+            'clinical_height': None,
+            'clinical_bmi': None,
+            'clinical_fasting_glucose': None,
+            'clinical_fasting_insulin': None,
+            'clinical_hba1c': None,
+            'clinical_homa_ir': None,
+            'clinical_gender': None
+        }
+
+        # 4) Normalize headers for matching
+        clean_headers = [
+            h.strip().lower()
+            .replace(' ', '_')
+            .replace('-', '_')
+            .replace('%', '')
+            for h in raw_headers
+        ]
+
+        # 5) Define mapping patterns → target fields
+        field_mapping = {
+            'age':                     'clinical_age',
+            'weight':                  'clinical_weight',
+            'height':                  'clinical_height',
+            'bmi':                     'clinical_bmi',
+            'fasting_glucose':         'clinical_fasting_glucose',
+            'fasting_insulin':         'clinical_fasting_insulin',
+            'hba1c':                   'clinical_hba1c',
+            'homa_ir':                 'clinical_homa_ir',
+            'gender':                  'clinical_gender',
+        }
+
+        # 6) Fill clinical_data by pattern-matching normalized headers
+        for i, norm in enumerate(clean_headers):
+            for pattern, field in field_mapping.items():
+                if pattern in norm:
+                    clinical_data[field] = values[i]
+
+        # 7) Cast any numpy types to native Python types
+        for key, val in clinical_data.items():
+            if hasattr(val, 'item'):
+                clinical_data[key] = val.item()
+
+        # 8) Save to database
+        success, msg = save_clinical_data(user_id, clinical_data)
+        return {"bio_saved": success, "bio_message": msg}
+    return {}
+
+def save_meal_prediction(user_id, nutrition, meal_category, glucose):
+    """Save the meal's nutrition and glucose prediction; returns database_info fields."""
+    meal_data = {
+        'protein_pct': nutrition.get('protein_pct'),
+        'carbs_pct': nutrition.get('carbs_pct'),
+        'fat_pct': nutrition.get('fat_pct'),
+        'sugar_risk': nutrition.get('sugar_risk'),
+        'refined_carb': bool(nutrition.get('refined_carb', False)),  # CAST TO BOOLEAN
+        'meal_category': meal_category,
+        'glucose_spike_30min': glucose.get('glucose_spike_30min'),
+        'glucose_spike_60min': glucose.get('glucose_spike_60min')
+    }
+
+    meal_id, msg = save_meal_data(user_id, meal_data)
+    return {"meal_saved": meal_id is not None, "meal_message": msg, "meal_id": meal_id}
+
 # Authentication routes
 @app.post("/signup")
 async def signup(user_data: UserSignup):
@@ -110,8 +390,8 @@ async def analyze_meal(
 ):
     image_bytes = await image.read()
 
-    caption_response = requests.post(
-        f"{FOOD_ANALYZER_URL}/generate-labels",
+    caption_response = post_service(
+        "food", f"{FOOD_ANALYZER_URL}/generate-labels",
         files={"image": ("filename.jpg", image_bytes, image.content_type)}
     )
     if caption_response.status_code != 200:
@@ -139,14 +419,16 @@ async def analyze_meal(
 
     caption = full_caption
 
-    nutrition_response = requests.post(
-        f"{NUTRITION_PREDICTOR_URL}/predict-nutrition",
+    nutrition_response = post_service(
+        "nutrition", f"{NUTRITION_PREDICTOR_URL}/predict-nutrition",
         json={"caption": caption}
     )
     if nutrition_response.status_code != 200:
         return {"error": "Nutrition failed", "details": nutrition_response.text}
 
     nutrition = nutrition_response.json()
+    if "error" in nutrition:
+        return {"error": "Nutrition failed", "details": nutrition["error"]}
 
     # === Set Prometheus Metric ===
     if "sugar_risk" in nutrition:
@@ -165,48 +447,27 @@ def predict_gut_health(file: UploadFile = File(...), user_id: int = Form(None)):
         # Extract bacteria data from CSV (if user_id is provided)
         bacteria_saved = False
         bact_id = None
+        profile_version = None
         
         if user_id:
-            # Parse the CSV content
-            import pandas as pd
-            import io
+            # Parse the header and first row once; the same row feeds the database
+            # record and the feature-store profile
+            parsed = split_csv(csv_bytes)
+            bacteria_string = bacteria_string_from_cells(parsed[2])
             
-            # Reset file pointer to beginning to read the content
-            file.file.seek(0)
-            csv_content = io.StringIO(csv_bytes.decode('utf-8'))
-            df = pd.read_csv(csv_content)
+            # Save to database
+            bact_id, message = save_bacteria_data(user_id, bacteria_string)
             
-            # Extract bacteria presence data (assuming second row contains the 0s and 1s)
-            if len(df) >= 1:  # At least one row of data after header
-                # Get the first row (index 0) which contains the 0s and 1s values
-                bacteria_values = df.iloc[0].astype(str).values
-                # Remove any spaces and join into a single string
-                bacteria_string = ''.join([val.strip() for val in bacteria_values])
-                
-                # Save to database
-                from Database.db import save_bacteria_data
-                bact_id, message = save_bacteria_data(user_id, bacteria_string)
-                
-                if bact_id:
-                    bacteria_saved = True
-                else:
-                    print(f"Warning: Failed to save bacteria data: {message}")
-            
-            # Reset file pointer for sending to microbiome analyzer
-            file.file.seek(0)
-            csv_bytes = file.file.read()
+            if bact_id:
+                bacteria_saved = True
+            else:
+                print(f"Warning: Failed to save bacteria data: {message}")
+            profile_version = store_microbiome_profile(user_id, parsed)
         
-        # Forward to microbiome analyzer service
-        gut_response = requests.post(
-            f"{MICROBIOM_ANALYZER_URL}/predict-gut-health-file",
-            files={"file": ("subject.csv", csv_bytes, file.content_type)}
-        )
-        
-        if gut_response.status_code != 200:
-            return {"error": "Gut health prediction failed", "details": gut_response.text}
-        
-        # Get the analysis results
-        result = gut_response.json()
+        # Forward to microbiome analyzer service, by feature-store reference when possible
+        result = request_gut_health(csv_bytes, file.content_type, user_id, profile_version)
+        if "error" in result:
+            return result
         
         # Add bacteria save status if applicable
         if user_id and bacteria_saved:
@@ -242,44 +503,29 @@ async def predict_glucose_from_all(
             bio_bytes = await bio_file.read()
        # --- Handle Bio Data ---
         elif user_id:
-            clinical_data = get_user_clinical_data(user_id)
-            if not clinical_data:
+            bio_bytes = saved_bio_csv(user_id)
+            if bio_bytes is None:
                 return {"error": "No saved bio/clinical data found for this user"}
-
-            # 1. Build a single-row DataFrame, including user_id
-            df = pd.DataFrame(
-                [{ **{"user_id": user_id}, **clinical_data }]
-            )
-
-            # 2. Rename to exact headers your glucose-monitor expects
-            df.rename(columns={
-                "user_id":                   "user_id",            # space, lowercase
-                "clinical_age":              "clinical_Age",       # underscore + capital A
-                "clinical_weight":           "clinical_Weight",
-                "clinical_height":           "clinical_Height",
-                "clinical_bmi":              "clinical_BMI",
-                "clinical_fasting_glucose":  "clinical_fasting_glucose",
-                "clinical_fasting_insulin":  "clinical_fasting_insulin",
-                "clinical_hba1c":            "clinical_HbA1c",
-                "clinical_homa_ir":          "clinical_HOMA_IR",
-                "clinical_gender":           "clinical_Gender",
-            }, inplace=True)
-
-            # 3. Now serialize
-            csv_buffer = io.BytesIO()
-            df.to_csv(csv_buffer, index=False)
-            bio_bytes = csv_buffer.getvalue()
         else:
             return {"error": "No bio file provided and no user_id to fetch saved data"}
 
 
         # === Handle Microbiome Data ===
+        micro_parsed = None
+        profile_version = None
         if micro_file:
-            # 1) Client provided a CSV
+            # 1) Client provided a CSV: parse it once and store it in the feature store
             micro_bytes = await micro_file.read()
+            if user_id:
+                micro_parsed = split_csv(micro_bytes)
+                profile_version = store_microbiome_profile(user_id, micro_parsed)
+
+        elif user_id and feature_store is not None and feature_store.latest_version(user_id) is not None:
+            # 2) No upload → reference the latest profile stored for this user_id
+            profile_version = feature_store.latest_version(user_id)
 
         elif user_id:
-            # 2) No upload → automatically fetch saved data for this user_id
+            # 2b) No feature-store profile → fetch saved data for this user_id
             bact_id, bacteria_string = get_user_microbiome_data(user_id)
             if not bacteria_string:
                 return {"error": "No saved microbiome data found for this user"}
@@ -294,74 +540,13 @@ async def predict_glucose_from_all(
             # 4) Neither a file nor a user_id → error
             return {"error": "Microbiome file is required or user_id must be provided"}
 
-        # === STEP 1: Analyze Meal ===
-        # Reset image file pointer if needed (just in case)
-        image.file.seek(0)
-        image_bytes = await image.read()
-        
-        # Send to food analyzer service
-        caption_response = requests.post(
-            f"{FOOD_ANALYZER_URL}/generate-labels",
-            files={"image": ("meal.jpg", image_bytes, image.content_type)}
+        # === Analyze Meal and Predict Glucose ===
+        nutrition, glucose, error = predict_meal_glucose(
+            image_bytes, image.content_type, description, meal_category,
+            bio_bytes, micro_bytes, user_id, profile_version
         )
-        
-        if caption_response.status_code != 200:
-            return {"error": "Caption failed", "details": caption_response.text}
-        
-        # Process labels
-        labels = [
-            label for label in caption_response.json().get("labels", [])
-            if label.get("confidence", 0) >= 20
-        ]
-        
-        # Handle case where no labels detected
-        if not labels and (not description or description.strip().lower() == "none"):
-            return {
-                "error": "Image not clear",
-                "message": "No ingredients were confidently detected from the image. Please provide a description of the meal to improve prediction."
-            }
-        
-        # Build caption
-        ingredient_caption = "A dish containing " + ", ".join([
-            f"{label['name']} ({round(label['confidence'], 1)}%)"
-            for label in labels
-        ]) if labels else ""
-        
-        if description and description.strip().lower() != "none":
-            full_caption = f"{ingredient_caption}. Additional description: {description.strip()}" if ingredient_caption else description.strip()
-        else:
-            full_caption = ingredient_caption
-
-        # Get nutrition prediction
-        nutrition_response = requests.post(
-            f"{NUTRITION_PREDICTOR_URL}/predict-nutrition",
-            json={"caption": full_caption}
-        )
-        
-        if nutrition_response.status_code != 200:
-            return {"error": "Nutrition failed", "details": nutrition_response.text}
-
-        nutrition = nutrition_response.json().get("nutrition", {})
-        glucose_response = requests.post(
-            f"{GLUCOSE_MONITOR_URL}/predict-glucose",
-            data={
-                "protein_pct": nutrition.get("protein_pct", 0),
-                "fat_pct": nutrition.get("fat_pct", 0),
-                "carbs_pct": nutrition.get("carbs_pct", 0),
-                "sugar_risk": nutrition.get("sugar_risk", 0),
-                "refined_carb": nutrition.get("refined_carb", 0),
-                "meal_category": meal_category
-            },
-            files={
-                "bio_file": ("bio.csv", bio_bytes, "text/csv"),
-                "micro_file": ("micro.csv", micro_bytes, "text/csv")
-            }
-        )
-
-        if glucose_response.status_code != 200:
-            return {"error": "glucose prediction failed", "details": glucose_response.text}
-
-        glucose = glucose_response.json()
+        if error:
+            return error
 
         # === Set Prometheus Metric ===
         if "glucose_spike_60min" in glucose:
@@ -372,99 +557,23 @@ async def predict_glucose_from_all(
         if user_id:
             # Save bio data if provided and not using saved data
             if bio_file and not use_saved_bio:
-                # 1) Read the uploaded bio CSV into a DataFrame
-                bio_file.file.seek(0)
-                bio_df = pd.read_csv(io.BytesIO(bio_bytes))
-                
-                if len(bio_df) >= 1:
-                    # 2) Extract headers and values from the first (and only) row
-                    raw_headers = bio_df.columns.tolist()
-                    values      = bio_df.iloc[0].tolist()
-
-                    # 3) Prepare an empty clinical_data dict
-                    clinical_data = {
-                        'clinical_age': None,
-                        'clinical_weight': None,
-                        'clinical_height': None,
-                        'clinical_bmi': None,
-                        'clinical_fasting_glucose': None,
-                        'clinical_fasting_insulin': None,
-                        'clinical_hba1c': None,
-                        'clinical_homa_ir': None,
-                        'clinical_gender': None
-                    }
-
-                    # 4) Normalize headers for matching
-                    clean_headers = [
-                        h.strip().lower()
-                        .replace(' ', '_')
-                        .replace('-', '_')
-                        .replace('%', '')
-                        for h in raw_headers
-                    ]
-
-                    # 5) Define mapping patterns → target fields
-                    field_mapping = {
-                        'age':                     'clinical_age',
-                        'weight':                  'clinical_weight',
-                        'height':                  'clinical_height',
-                        'bmi':                     'clinical_bmi',
-                        'fasting_glucose':         'clinical_fasting_glucose',
-                        'fasting_insulin':         'clinical_fasting_insulin',
-                        'hba1c':                   'clinical_hba1c',
-                        'homa_ir':                 'clinical_homa_ir',
-                        'gender':                  'clinical_gender',
-                    }
-
-                    # 6) Fill clinical_data by pattern-matching normalized headers
-                    for i, norm in enumerate(clean_headers):
-                        for pattern, field in field_mapping.items():
-                            if pattern in norm:
-                                clinical_data[field] = values[i]
-
-                    # 7) Cast any numpy types to native Python types
-                    for key, val in clinical_data.items():
-                        if hasattr(val, 'item'):
-                            clinical_data[key] = val.item()
-
-                    # 8) Save to database
-                    success, msg = save_clinical_data(user_id, clinical_data)
-                    database_info["bio_saved"]   = success
-                    database_info["bio_message"] = msg
+                database_info.update(save_bio_upload(user_id, bio_bytes))
 
             # Save microbiome data if provided and not using saved data
             if micro_file and not use_saved_micro:
-                # Parse the microbiome file to extract bacteria data
-                micro_file.file.seek(0)  # Reset file pointer
-                micro_df = pd.read_csv(io.BytesIO(micro_bytes))
+                # Reuse the row parsed above as a string of 0s and 1s
+                bacteria_string = bacteria_string_from_cells(micro_parsed[2])
                 
-                if len(micro_df) >= 1:
-                    # Get first row values and convert to string of 0s and 1s
-                    bacteria_values = micro_df.iloc[0].astype(str).values
-                    bacteria_string = ''.join([val.strip() for val in bacteria_values])
-                    
-                    # Save to database
-                    bact_id, msg = save_bacteria_data(user_id, bacteria_string)
-                    database_info["microbiome_saved"] = (bact_id is not None)
-                    database_info["microbiome_message"] = msg
-                    database_info["bact_id"] = bact_id
+                # Save to database
+                bact_id, msg = save_bacteria_data(user_id, bacteria_string)
+                database_info["microbiome_saved"] = (bact_id is not None)
+                database_info["microbiome_message"] = msg
+                database_info["bact_id"] = bact_id
+            if profile_version is not None:
+                database_info["profile_version"] = profile_version
 
             # Save meal and glucose prediction data
-            meal_data = {
-                'protein_pct': nutrition.get('protein_pct'),
-                'carbs_pct': nutrition.get('carbs_pct'),
-                'fat_pct': nutrition.get('fat_pct'),
-                'sugar_risk': nutrition.get('sugar_risk'),
-                'refined_carb': bool(nutrition.get('refined_carb', False)),  # CAST TO BOOLEAN
-                'meal_category': meal_category,
-                'glucose_spike_30min': glucose.get('glucose_spike_30min'),
-                'glucose_spike_60min': glucose.get('glucose_spike_60min')
-            }
-            
-            meal_id, msg = save_meal_data(user_id, meal_data)
-            database_info["meal_saved"] = (meal_id is not None)
-            database_info["meal_message"] = msg
-            database_info["meal_id"] = meal_id
+            database_info.update(save_meal_prediction(user_id, nutrition, meal_category, glucose))
 
         # Return combined results
         result = {
@@ -476,4 +585,83 @@ async def predict_glucose_from_all(
         return result
 
     except Exception as e:
-        return {"error": f"Internal server error: {str(e)}"}
\ No newline at end of file
+        return {"error": f"Internal server error: {str(e)}"}
+
+@app.post("/predict-gut-health-and-glucose")
+async def predict_gut_health_and_glucose(
+    image: UploadFile = File(...),
+    micro_file: UploadFile = File(...),
+    bio_file: Optional[UploadFile] = File(None),
+    meal_category: str = Form(...),
+    user_id: Optional[int] = Form(None),
+    description: Optional[str] = Form(None)
+):
+    """Gut health and the meal's glucose response from a single microbiome upload.
+
+    The microbiome CSV is read and parsed once and persisted once (one bacteria
+    record and one feature-store profile). The microbiome analyzer and the
+    caption -> nutrition -> glucose pipeline then run concurrently on worker
+    threads, both receiving the same profile.
+    """
+    try:
+        image_bytes = await image.read()
+        micro_bytes = await micro_file.read()
+
+        # === Handle Bio Data ===
+        if bio_file:
+            bio_bytes = await bio_file.read()
+        elif user_id:
+            bio_bytes = saved_bio_csv(user_id)
+            if bio_bytes is None:
+                return {"error": "No saved bio/clinical data found for this user"}
+        else:
+            return {"error": "No bio file provided and no user_id to fetch saved data"}
+
+        # === Persist the Microbiome Once ===
+        database_info = {}
+        profile_version = None
+        if user_id:
+            micro_parsed = split_csv(micro_bytes)
+            bact_id, msg = save_bacteria_data(user_id, bacteria_string_from_cells(micro_parsed[2]))
+            database_info["microbiome_saved"] = (bact_id is not None)
+            database_info["microbiome_message"] = msg
+            database_info["bact_id"] = bact_id
+            profile_version = store_microbiome_profile(user_id, micro_parsed)
+            if profile_version is not None:
+                database_info["profile_version"] = profile_version
+
+        # === Gut Health and Glucose Pipelines in Parallel ===
+        gut_health, (nutrition, glucose, error) = await asyncio.gather(
+            asyncio.to_thread(request_gut_health, micro_bytes, micro_file.content_type, user_id, profile_version),
+            asyncio.to_thread(
+                predict_meal_glucose, image_bytes, image.content_type, description, meal_category,
+                bio_bytes, micro_bytes, user_id, profile_version
+            )
+        )
+
+        if error:
+            return {
+                "gut_health": gut_health,
+                "nutrition": nutrition,
+                "glucose_prediction": error,
+                "database_info": database_info if user_id else None
+            }
+
+        # === Set Prometheus Metric ===
+        if "glucose_spike_60min" in glucose:
+            PREDICTION_VALUE.set(glucose.get("glucose_spike_60min", 0))
+
+        if user_id:
+            if bio_file:
+                database_info.update(save_bio_upload(user_id, bio_bytes))
+            database_info.update(save_meal_prediction(user_id, nutrition, meal_category, glucose))
+
+        return {
+            "gut_health": gut_health,
+            "nutrition": nutrition,
+            "glucose_prediction": glucose,
+            "database_info": database_info if user_id else None
+        }
+
+    except Exception as e:
+        return {"error": f"Internal server error: {str(e)}"}
@@ -0,0 +1,159 @@
+import pytest
+from httpx import AsyncClient, ASGITransport
+import sys, os, threading
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from app import app
+from feature_store import FeatureStore
+
+BIO_CSV = b"Age,BMI,Fasting GLU - PDL (Lab),Insulin ,A1c PDL (Lab),Gender\n45,27.5,98,12.1,5.6,1\n"
+MICRO_CSV = b"Bacteroides fragilis ,Prevotella copri ,Akkermansia muciniphila \n1,0,1\n"
+
+class FakeResponse:
+    def __init__(self, status_code, body):
+        self.status_code = status_code
+        self._body = body
+        self.text = str(body)
+
+    def json(self):
+        return self._body
+
+class FakeServices:
+    """Stands in for requests.post to the four IEPs, recording every call.
+
+    The gut-health and food-analyzer stubs meet at a barrier, so a request
+    only completes when both branches are in flight at the same time.
+    """
+
+    ANSWERS = {
+        "/predict-gut-health-file": {"prediction": "Healthy", "probability": 0.83},
+        "/generate-labels": {"labels": [{"name": "rice", "confidence": 91.0}, {"name": "chicken", "confidence": 64.0}]},
+        "/predict-nutrition": {"nutrition": {"protein_pct": 30, "fat_pct": 20, "carbs_pct": 50,
+                                             "sugar_risk": 0, "refined_carb": 1}, "source": "local"},
+        "/predict-glucose": {"glucose_spike_30min": 21.5, "glucose_spike_60min": 34.2, "message": "ok"},
+    }
+
+    def __init__(self):
+        self.calls = []
+        self.failing = set()
+        self.together = threading.Barrier(2, timeout=5)
+        self._lock = threading.Lock()
+
+    def post(self, url, headers=None, **kwargs):
+        path = "/" + url.rsplit("/", 1)[1]
+        with self._lock:
+            self.calls.append((path, kwargs))
+        if path in ("/predict-gut-health-file", "/generate-labels"):
+            self.together.wait()
+        if path in self.failing:
+            return FakeResponse(500, {"detail": "boom"})
+        return FakeResponse(200, self.ANSWERS[path])
+
+    def sent(self, path):
+        return [kwargs for called, kwargs in self.calls if called == path]
+
+@pytest.fixture
+def services(monkeypatch):
+    fake = FakeServices()
+    monkeypatch.setattr(sys.modules["app"].requests, "post", fake.post)
+    return fake
+
+@pytest.fixture
+def database(monkeypatch, tmp_path):
+    """Record database writes and use a throwaway feature store."""
+    controller = sys.modules["app"]
+    saved = {"bacteria": [], "clinical": [], "meals": []}
+
+    def save_bacteria(user_id, bacteria):
+        saved["bacteria"].append((user_id, bacteria))
+        return 7, "Microbiome data saved"
+
+    def save_clinical(user_id, clinical_data):
+        saved["clinical"].append((user_id, clinical_data))
+        return True, "Clinical data saved"
+
+    def save_meal(user_id, meal_data):
+        saved["meals"].append((user_id, meal_data))
+        return 11, "Meal saved"
+
+    monkeypatch.setattr(controller, "save_bacteria_data", save_bacteria)
+    monkeypatch.setattr(controller, "save_clinical_data", save_clinical)
+    monkeypatch.setattr(controller, "save_meal_data", save_meal)
+    store = FeatureStore(str(tmp_path / "features.db"))
+    monkeypatch.setattr(controller, "feature_store", store)
+    saved["store"] = store
+    return saved
+
+async def post_combined(user_id=None):
+    data = {"meal_category": "Lunch"}
+    if user_id is not None:
+        data["user_id"] = str(user_id)
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        return await ac.post("/predict-gut-health-and-glucose", data=data, files={
+            "image": ("meal.jpg", b"\xff\xd8 not really a jpeg", "image/jpeg"),
+            "micro_file": ("micro.csv", MICRO_CSV, "text/csv"),
+            "bio_file": ("bio.csv", BIO_CSV, "text/csv"),
+        })
+
+@pytest.mark.asyncio
+async def test_gut_health_and_glucose_combined(services, database):
+    response = await post_combined(user_id=5)
+
+    assert response.status_code == 200
+    result = response.json()
+    assert result["gut_health"] == FakeServices.ANSWERS["/predict-gut-health-file"]
+    assert result["nutrition"] == FakeServices.ANSWERS["/predict-nutrition"]["nutrition"]
+    assert result["glucose_prediction"] == FakeServices.ANSWERS["/predict-glucose"]
+
+    # The microbiome is saved once: one bacteria record and one stored profile version
+    assert database["bacteria"] == [(5, "101")]
+    assert database["store"].latest_version(5) == 1
+    assert result["database_info"]["bact_id"] == 7
+    assert result["database_info"]["profile_version"] == 1
+    assert result["database_info"]["meal_saved"] is True
+    assert len(database["clinical"]) == 1 and len(database["meals"]) == 1
+
+    # Both IEPs get the stored profile by reference instead of the CSV
+    [gut_call] = services.sent("/predict-gut-health-file")
+    assert gut_call["data"] == {"profile_user_id": 5, "profile_version": 1}
+    [glucose_call] = services.sent("/predict-glucose")
+    assert glucose_call["data"]["profile_version"] == 1
+    assert "micro_file" not in glucose_call["files"]
+
+@pytest.mark.asyncio
+async def test_gut_health_and_glucose_without_user(services, database):
+    response = await post_combined()
+
+    result = response.json()
+    assert result["glucose_prediction"]["glucose_spike_60min"] == 34.2
+    assert result["database_info"] is None
+    assert database["bacteria"] == [] and database["meals"] == []
+    # Without a stored profile both IEPs receive the uploaded CSV
+    assert services.sent("/predict-gut-health-file")[0]["files"]["file"][1] == MICRO_CSV
+    assert services.sent("/predict-glucose")[0]["files"]["micro_file"][1] == MICRO_CSV
+
+@pytest.mark.asyncio
+async def test_gut_health_failure_keeps_glucose(services, database):
+    services.failing.add("/predict-gut-health-file")
+    response = await post_combined(user_id=5)
+
+    result = response.json()
+    assert result["gut_health"]["error"] == "Gut health prediction failed"
+    assert result["glucose_prediction"]["glucose_spike_60min"] == 34.2
+    assert len(database["meals"]) == 1
+
+@pytest.mark.asyncio
+async def test_glucose_failure_keeps_gut_health(services, database):
+    services.failing.add("/generate-labels")
+    response = await post_combined(user_id=5)
+
+    result = response.json()
+    assert result["gut_health"]["prediction"] == "Healthy"
+    assert result["glucose_prediction"]["error"] == "Caption failed"
+    assert result["nutrition"] is None
+    assert services.sent("/predict-glucose") == []
+    # The microbiome was still saved exactly once, but no meal is recorded
+    assert len(database["bacteria"]) == 1
+    assert database["store"].latest_version(5) == 1
+    assert database["meals"] == []
@@ -0,0 +1,125 @@
+# Distributed tracing with OpenTelemetry. The same module is copied into every
+# service; the W3C `traceparent` header carries the trace across services.
+
+import json
+import os
+import threading
+
+from opentelemetry import trace
+from opentelemetry.sdk.resources import Resource
+from opentelemetry.sdk.trace import TracerProvider
+from opentelemetry.sdk.trace.export import (
+    BatchSpanProcessor,
+    ConsoleSpanExporter,
+    SimpleSpanProcessor,
+    SpanExporter,
+    SpanExportResult,
+)
+from opentelemetry.sdk.trace.export.in_memory_span_exporter import InMemorySpanExporter
+from opentelemetry.sdk.trace.sampling import ParentBased, TraceIdRatioBased
+from opentelemetry.trace.propagation.tracecontext import TraceContextTextMapPropagator
+
+# Where finished spans go: none, console, file, memory or otlp (needs
+# opentelemetry-exporter-otlp-proto-http; endpoint from OTEL_EXPORTER_OTLP_ENDPOINT)
+TRACING_EXPORTER = os.getenv("TRACING_EXPORTER", "none")
+# Share of new traces recorded; calls from an upstream service follow its decision
+TRACING_SAMPLE_RATIO = float(os.getenv("TRACING_SAMPLE_RATIO", 0.1))
+# JSON-lines file used by the file exporter
+TRACING_FILE_PATH = os.getenv("TRACING_FILE_PATH", "traces.jsonl")
+
+EXPORTERS = ("none", "console", "file", "memory", "otlp")
+
+propagator = TraceContextTextMapPropagator()
+
+class JsonLinesSpanExporter(SpanExporter):
+    """Appends each finished span to `path` as one JSON object per line."""
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def export(self, spans):
+        lines = "".join(json.dumps(json.loads(span.to_json())) + "\n" for span in spans)
+        try:
+            with self._lock, open(self.path, "a", encoding="utf-8") as f:
+                f.write(lines)
+        except OSError as e:
+            print(f"Warning: could not write spans to {self.path}: {str(e)}")
+            return SpanExportResult.FAILURE
+        return SpanExportResult.SUCCESS
+
+def make_exporter(name, file_path=TRACING_FILE_PATH):
+    """Span exporter for one of EXPORTERS (None for "none")."""
+    if name == "none":
+        return None
+    if name == "console":
+        return ConsoleSpanExporter()
+    if name == "file":
+        return JsonLinesSpanExporter(file_path)
+    if name == "memory":
+        return InMemorySpanExporter()
+    if name == "otlp":
+        try:
+            from opentelemetry.exporter.otlp.proto.http.trace_exporter import OTLPSpanExporter
+        except ImportError:
+            raise RuntimeError("TRACING_EXPORTER=otlp needs the opentelemetry-exporter-otlp-proto-http package")
+        return OTLPSpanExporter()
+    raise ValueError(f"Unknown tracing exporter {name!r}, expected one of {', '.join(EXPORTERS)}")
+
+class Tracing:
+    """Tracer of one service plus the helpers to continue and propagate traces.
+
+    With the "none" exporter nothing is recorded, but an incoming
+    `traceparent` is still passed on to downstream calls, so a trace is not
+    broken by a service that does not export. Otherwise a new trace is
+    sampled with probability `sample_ratio` and every service follows the
+    caller's sampling decision (parent-based). The memory exporter keeps
+    spans in `exporter.get_finished_spans()` for tests and local debugging.
+    """
+
+    def __init__(self, service_name, exporter=TRACING_EXPORTER, sample_ratio=TRACING_SAMPLE_RATIO,
+                 file_path=TRACING_FILE_PATH):
+        self.service_name = service_name
+        self.provider = None
+        self.configure(exporter, sample_ratio, file_path)
+
+    def configure(self, exporter, sample_ratio=TRACING_SAMPLE_RATIO, file_path=TRACING_FILE_PATH):
+        """(Re)build the tracer with another exporter and sampling ratio."""
+        self.shutdown()
+        self.exporter = make_exporter(exporter, file_path)
+        if self.exporter is None:
+            self.provider = None
+            self.tracer = trace.NoOpTracer()
+            return
+        self.provider = TracerProvider(
+            resource=Resource.create({"service.name": self.service_name}),
+            sampler=ParentBased(TraceIdRatioBased(sample_ratio))
+        )
+        # Spans are exported off the request path, except in memory where tests read them at once
+        processor = SimpleSpanProcessor if exporter == "memory" else BatchSpanProcessor
+        self.provider.add_span_processor(processor(self.exporter))
+        self.tracer = self.provider.get_tracer(self.service_name)
+
+    def shutdown(self):
+        """Flush and stop the exporter."""
+        if self.provider is not None:
+            self.provider.shutdown()
+
+    def span(self, name, **attributes):
+        """Context manager for a child span of the current span."""
+        return self.tracer.start_as_current_span(name, attributes=attributes)
+
+    def server_span(self, request):
+        """Span for an incoming request, continuing the caller's trace if it sent one."""
+        return self.tracer.start_as_current_span(
+            f"{request.method} {request.url.path}",
+            context=propagator.extract(request.headers),
+            kind=trace.SpanKind.SERVER,
+            attributes={"http.method": request.method, "http.target": request.url.path}
+        )
+
+    def inject(self, headers=None):
+        """Copy of `headers` with the current trace context (`traceparent`) added."""
+        headers = dict(headers or {})
+        propagator.inject(headers)
+        return headers
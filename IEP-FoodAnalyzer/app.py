@@ -1,21 +1,51 @@
 # RUN: uvicorn app:app --reload --port 8001
 
 import os
-import base64
-from tempfile import NamedTemporaryFile
-import requests
+import asyncio
 from dotenv import load_dotenv
 from fastapi import FastAPI, UploadFile, File, HTTPException, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
 import time
 
-from prometheus_client import make_asgi_app, Counter, Summary, Gauge
+from batcher import ClarifaiBatcher
+from clarifai_client import ClarifaiClient, ClarifaiError
+from image_cache import ImageCache, phash
+from image_processing import prepare_image
+from prometheus_client import make_asgi_app, Counter, Summary, Gauge, Histogram
+from stage_metrics import StageMetrics
+from tracing import Tracing
 
 # === Monitoring Metrics ===
 REQUEST_COUNT = Counter("food_analyzer_request_count", "Total number of requests to Food Analyzer")
 REQUEST_LATENCY = Summary("food_analyzer_request_latency_seconds", "Request latency in seconds")
 LAST_LABEL_CONFIDENCE = Gauge("food_analyzer_last_label_confidence", "Confidence score of the last label predicted")
+IMAGE_BYTES = Histogram(
+    "food_analyzer_image_bytes",
+    "Image size in bytes as uploaded by the client (original) and as sent to Clarifai (sent)",
+    ["stage"],
+    buckets=(10e3, 50e3, 100e3, 250e3, 500e3, 1e6, 2e6, 4e6, 8e6, 16e6)
+)
+IMAGE_PREPARE_LATENCY = Histogram(
+    "food_analyzer_image_prepare_seconds",
+    "Time spent decoding, downscaling and re-encoding an upload",
+    buckets=(0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+IMAGE_CACHE_LOOKUPS = Counter(
+    "food_analyzer_image_cache_lookups_total",
+    "Near-duplicate cache lookups by result",
+    ["result"]
+)
+IMAGE_CACHE_ENTRIES = Gauge("food_analyzer_image_cache_entries", "Images in the near-duplicate label cache")
+IMAGE_CACHE_LOOKUP_LATENCY = Histogram(
+    "food_analyzer_image_cache_lookup_seconds",
+    "Time spent hashing an upload and searching the near-duplicate cache",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+# Spans for requests and stages, continued across services via traceparent (see tracing.py)
+tracing = Tracing("food-analyzer")
+# Latency by endpoint and by stage: parse (upload read), cache_lookup, preprocess, upstream (Clarifai)
+stage_metrics = StageMetrics("food_analyzer", tracing)
 
 # === Load Environment Variables ===
 load_dotenv()  
@@ -32,11 +62,44 @@ if not CLARIFAI_PAT or not CLARIFAI_USER_ID or not CLARIFAI_APP_ID:
 # === Clarifai Model Configuration ===
 MODEL_ID         = "food-item-recognition"
 MODEL_VERSION_ID = "1d5fd481e0cf4826aa72ec3ff049e044"
-API_URL = (
+API_URL = os.getenv("CLARIFAI_API_URL") or (
     f"https://api.clarifai.com/v2/models/{MODEL_ID}"
     f"/versions/{MODEL_VERSION_ID}/outputs"
 )
 
+# Outbound call limits: concurrent requests, per-request timeout (seconds), retries on 429/503
+CLARIFAI_MAX_CONCURRENCY = int(os.getenv("CLARIFAI_MAX_CONCURRENCY", 8))
+CLARIFAI_TIMEOUT         = float(os.getenv("CLARIFAI_TIMEOUT", 15))
+CLARIFAI_MAX_RETRIES     = int(os.getenv("CLARIFAI_MAX_RETRIES", 3))
+
+clarifai = ClarifaiClient(
+    API_URL, CLARIFAI_PAT, CLARIFAI_USER_ID, CLARIFAI_APP_ID,
+    max_concurrency=CLARIFAI_MAX_CONCURRENCY,
+    timeout=CLARIFAI_TIMEOUT,
+    max_retries=CLARIFAI_MAX_RETRIES
+)
+
+# Micro-batching: images per multi-input Clarifai call (1 disables) and how long
+# the first image of a batch waits for others (milliseconds)
+CLARIFAI_BATCH_SIZE    = int(os.getenv("CLARIFAI_BATCH_SIZE", 8))
+CLARIFAI_BATCH_WAIT_MS = float(os.getenv("CLARIFAI_BATCH_WAIT_MS", 10))
+
+batcher = ClarifaiBatcher(clarifai, max_batch_size=CLARIFAI_BATCH_SIZE, max_wait=CLARIFAI_BATCH_WAIT_MS / 1000)
+
+# === Image Preparation ===
+# Longest image side sent to Clarifai (0 disables downscaling) and JPEG quality
+MAX_IMAGE_DIM = int(os.getenv("MAX_IMAGE_DIM", 1024))
+IMAGE_QUALITY = int(os.getenv("IMAGE_QUALITY", 85))
+
+# === Near-Duplicate Label Cache ===
+# Cached images (0 disables), largest Hamming distance between perceptual hashes
+# counted as the same photo, and an optional file the cache is kept in across restarts
+IMAGE_CACHE_SIZE         = int(os.getenv("IMAGE_CACHE_SIZE", 10000))
+IMAGE_CACHE_MAX_DISTANCE = int(os.getenv("IMAGE_CACHE_MAX_DISTANCE", 6))
+IMAGE_CACHE_PATH         = os.getenv("IMAGE_CACHE_PATH")
+
+image_cache = ImageCache(max_entries=IMAGE_CACHE_SIZE, max_distance=IMAGE_CACHE_MAX_DISTANCE)
+
 # === FastAPI App Setup ===
 app = FastAPI(title="IEP-FoodAnalyzer")
 
@@ -56,11 +119,44 @@ app.mount("/metrics", metrics_app)
 @app.middleware("http")
 async def prometheus_middleware(request: Request, call_next):
     REQUEST_COUNT.inc()
+    endpoint = stage_metrics.begin(request)
     start_time = time.time()
     response = await call_next(request)
-    REQUEST_LATENCY.observe(time.time() - start_time)
+    elapsed = time.time() - start_time
+    REQUEST_LATENCY.observe(elapsed)
+    stage_metrics.observe_request(endpoint, request.method, response.status_code, elapsed)
     return response
 
+# Declared after prometheus_middleware so the request span wraps it and the stages
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    with tracing.server_span(request) as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+        return response
+
+@app.on_event("shutdown")
+def close_tracing():
+    tracing.shutdown()
+
+@app.on_event("startup")
+async def load_image_cache():
+    if IMAGE_CACHE_PATH and IMAGE_CACHE_SIZE > 0 and os.path.exists(IMAGE_CACHE_PATH):
+        try:
+            image_cache.load(IMAGE_CACHE_PATH)
+        except (OSError, ValueError, KeyError) as e:
+            print(f"Warning: could not load image cache from {IMAGE_CACHE_PATH}: {str(e)}")
+        IMAGE_CACHE_ENTRIES.set(len(image_cache))
+
+@app.on_event("shutdown")
+async def close_clarifai_client():
+    await clarifai.aclose()
+
+@app.on_event("shutdown")
+async def save_image_cache():
+    if IMAGE_CACHE_PATH and IMAGE_CACHE_SIZE > 0:
+        image_cache.save(IMAGE_CACHE_PATH)
+
 # === API Endpoints ===
 
 @app.post("/generate-labels")
@@ -69,54 +165,56 @@ async def generate_labels(image: UploadFile = File(...)):
     if not image.content_type.startswith("image/"):
         raise HTTPException(status_code=400, detail="Uploaded file must be an image")
 
-    with NamedTemporaryFile(delete=False, suffix=".jpg") as tmp:
-        tmp.write(await image.read())
-        tmp_path = tmp.name
+    with stage_metrics.stage("parse"):
+        original = await image.read()
+    IMAGE_BYTES.labels("original").observe(len(original))
+
+    # Labels of a near-identical earlier upload, if any
+    image_hash = None
+    if IMAGE_CACHE_SIZE > 0:
+        start_time = time.perf_counter()
+        with stage_metrics.stage("cache_lookup"):
+            try:
+                image_hash = await asyncio.to_thread(phash, original)
+            except ValueError as e:
+                raise HTTPException(status_code=400, detail=str(e))
+            cached = image_cache.get(image_hash)
+        IMAGE_CACHE_LOOKUP_LATENCY.observe(time.perf_counter() - start_time)
+        IMAGE_CACHE_LOOKUPS.labels("hit" if cached is not None else "miss").inc()
+        if cached is not None:
+            return {"labels": cached}
+
+    # Downscale and re-encode in memory before upload
+    start_time = time.perf_counter()
+    with stage_metrics.stage("preprocess"):
+        try:
+            image_bytes = await asyncio.to_thread(prepare_image, original, MAX_IMAGE_DIM, IMAGE_QUALITY)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    IMAGE_PREPARE_LATENCY.observe(time.perf_counter() - start_time)
+    IMAGE_BYTES.labels("sent").observe(len(image_bytes))
 
     try:
-        with open(tmp_path, "rb") as f:
-            b64_data = base64.b64encode(f.read()).decode()
-
-        payload = {
-            "user_app_id": {
-                "user_id": CLARIFAI_USER_ID,
-                "app_id":  CLARIFAI_APP_ID
-            },
-            "inputs": [
-                { "data": { "image": { "base64": b64_data } } }
-            ]
-        }
-        headers = {
-            "Authorization": f"Key {CLARIFAI_PAT}",
-            "Content-Type":  "application/json"
-        }
-
-        resp = requests.post(API_URL, headers=headers, json=payload)
-        resp.raise_for_status()
-
-        outputs  = resp.json().get("outputs", [])
-        if not outputs:
-            return JSONResponse(status_code=502, content={"error": "No output from Clarifai"})
-
-        concepts = outputs[0]["data"].get("concepts", [])
-        labels = [
-            {"name": c["name"], "confidence": round(c["value"] * 100, 2)}
-            for c in concepts
-        ]
-
-        # === Monitor last label confidence ===
-        if labels:
-            LAST_LABEL_CONFIDENCE.set(labels[0]["confidence"])
-
-        return {"labels": labels}
-
-    except requests.HTTPError as http_err:
-        return JSONResponse(status_code=http_err.response.status_code, content=http_err.response.json())
-    finally:
-        try:
-            os.remove(tmp_path)
-        except OSError:
-            pass
+        with stage_metrics.stage("upstream"):
+            output = await batcher.predict(image_bytes)
+    except ClarifaiError as e:
+        return JSONResponse(status_code=e.status_code, content=e.body)
+
+    concepts = output["data"].get("concepts", [])
+    labels = [
+        {"name": c["name"], "confidence": round(c["value"] * 100, 2)}
+        for c in concepts
+    ]
+
+    # === Monitor last label confidence ===
+    if labels:
+        LAST_LABEL_CONFIDENCE.set(labels[0]["confidence"])
+
+    if image_hash is not None:
+        image_cache.put(image_hash, labels)
+        IMAGE_CACHE_ENTRIES.set(len(image_cache))
+
+    return {"labels": labels}
 
 @app.get("/health")
 def health_check():
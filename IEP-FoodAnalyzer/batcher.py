@@ -0,0 +1,101 @@
+# Micro-batching of Clarifai predictions: concurrent uploads arriving within a
+# short window are sent as one multi-input request and the outputs are handed
+# back to the individual callers.
+
+import asyncio
+import time
+
+from prometheus_client import Histogram
+
+from clarifai_client import ClarifaiError
+
+# === Monitoring Metrics ===
+# _sum / _count is the number of images per outbound call (1.0 without batching)
+CLARIFAI_BATCH_SIZE = Histogram(
+    "food_analyzer_clarifai_batch_images",
+    "Images sent per outbound Clarifai call",
+    buckets=(1, 2, 4, 8, 16, 32, 64, 128)
+)
+CLARIFAI_BATCH_WAIT = Histogram(
+    "food_analyzer_clarifai_batch_wait_seconds",
+    "Time an image waited for its batch to be sent",
+    buckets=(0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25)
+)
+
+# Clarifai status code of a successful output
+CLARIFAI_SUCCESS = 10000
+
+class ClarifaiBatcher:
+    """Coalesces concurrent `predict` calls into multi-input Clarifai requests.
+
+    The first image of a batch starts a `max_wait` second timer; the batch is
+    sent when the timer fires or `max_batch_size` images are queued, whichever
+    comes first. Clarifai returns outputs in input order, so output i goes to
+    caller i. A failed call fails every caller of that batch; an output with an
+    error status fails only its own caller. `max_batch_size <= 1` sends every
+    image on its own with no wait.
+    """
+
+    def __init__(self, client, max_batch_size=8, max_wait=0.01):
+        self.client = client
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait
+        self._pending = []
+        self._timer = None
+        self._tasks = set()
+
+    async def predict(self, image):
+        """Clarifai output for one image byte string."""
+        if self.max_batch_size <= 1:
+            CLARIFAI_BATCH_SIZE.observe(1)
+            return (await self.client.predict([image]))[0]
+
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((image, future, time.perf_counter()))
+        if len(self._pending) >= self.max_batch_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch = self._pending[:self.max_batch_size]
+        self._pending = self._pending[self.max_batch_size:]
+        if self._pending:
+            self._timer = asyncio.get_running_loop().call_later(self.max_wait, self._flush)
+
+        # Callers that were cancelled while waiting are dropped from the batch
+        batch = [item for item in batch if not item[1].done()]
+        if not batch:
+            return
+        task = asyncio.ensure_future(self._send(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _send(self, batch):
+        now = time.perf_counter()
+        for _, _, queued_at in batch:
+            CLARIFAI_BATCH_WAIT.observe(now - queued_at)
+        CLARIFAI_BATCH_SIZE.observe(len(batch))
+
+        try:
+            outputs = await self.client.predict([image for image, _, _ in batch])
+        except Exception as e:
+            for _, future, _ in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future, _), output in zip(batch, outputs):
+            if future.done():
+                continue
+            status = output.get("status", {})
+            if status.get("code", CLARIFAI_SUCCESS) != CLARIFAI_SUCCESS:
+                future.set_exception(ClarifaiError(502, {"error": status.get("description", "Clarifai output failed"),
+                                                         "status": status}))
+            else:
+                future.set_result(output)
@@ -0,0 +1,78 @@
+# Lookup time of the near-duplicate image cache (multi-index hashing) against a
+# linear Hamming scan, at up to 1 million cached hashes.
+# RUN: python benchmarks/bench_image_cache.py [--entries 1000000] [--distance 6] [--json results.json]
+
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from image_cache import ImageCache
+
+N_QUERIES = 200
+
+def near(h, n_bits, rng):
+    for bit in rng.sample(range(64), n_bits):
+        h ^= 1 << bit
+    return h
+
+def linear_scan(hashes, query, max_distance):
+    """Baseline: Hamming distance to every cached hash (numpy popcount over uint64)."""
+    distances = np.bitwise_count(hashes ^ np.uint64(query))
+    best = int(distances.argmin())
+    return best if distances[best] <= max_distance else None
+
+def time_queries(fn, queries):
+    start = time.perf_counter()
+    for q in queries:
+        fn(q)
+    return (time.perf_counter() - start) / len(queries)
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark near-duplicate image cache lookups")
+    parser.add_argument("--entries", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+    parser.add_argument("--distance", type=int, default=6, help="Largest Hamming distance counted as a match")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    rng = random.Random(0)
+    results = []
+    print(f"{'entries':>9s} {'build s':>8s} {'queries':>8s} {'index us':>9s} {'scan us':>9s} {'hit rate':>9s}")
+    for n_entries in args.entries:
+        hashes = [rng.getrandbits(64) for _ in range(n_entries)]
+        cache = ImageCache(max_entries=n_entries, max_distance=args.distance)
+        start = time.perf_counter()
+        for i, h in enumerate(hashes):
+            cache.put(h, i)
+        build = time.perf_counter() - start
+        array = np.array(hashes, dtype=np.uint64)
+
+        cases = {
+            "near": [near(rng.choice(hashes), rng.randint(0, args.distance), rng) for _ in range(N_QUERIES)],
+            "miss": [rng.getrandbits(64) for _ in range(N_QUERIES)],
+        }
+        for name, queries in cases.items():
+            found = [cache.get(q) for q in queries]
+            # Same answer as the exhaustive scan (up to ties between equally close hashes)
+            for q, f in zip(queries, found):
+                expected = linear_scan(array, q, args.distance)
+                assert (f is None) == (expected is None)
+                assert f is None or (hashes[f] ^ q).bit_count() == (hashes[expected] ^ q).bit_count()
+            index_s = time_queries(cache.get, queries)
+            scan_s = time_queries(lambda q: linear_scan(array, q, args.distance), queries)
+            hit_rate = sum(f is not None for f in found) / len(found)
+            results.append({"entries": n_entries, "queries": name, "build_seconds": build,
+                            "index_seconds": index_s, "scan_seconds": scan_s, "hit_rate": hit_rate})
+            print(f"{n_entries:9d} {build:8.2f} {name:>8s} {index_s * 1e6:9.1f} {scan_s * 1e6:9.1f} {hit_rate:9.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
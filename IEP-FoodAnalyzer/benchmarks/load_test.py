@@ -0,0 +1,134 @@
+# Throughput of /generate-labels under concurrent load against a local fake Clarifai
+# with configurable latency. Compares the previous blocking requests.post call
+# (which serialises every request on the event loop), the shared async client
+# sending one image per call, and the async client behind the micro-batcher.
+# RUN: python benchmarks/load_test.py [--requests 200] [--concurrency 1 8 32] [--latency 0.2] [--json results.json]
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import statistics
+import sys
+import time
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SERVICE_DIR)
+sys.path.append(os.path.join(SERVICE_DIR, "tests"))
+for name in ("CLARIFAI_PAT", "CLARIFAI_USER_ID", "CLARIFAI_APP_ID"):
+    os.environ.setdefault(name, "bench")
+
+import numpy as np
+import requests
+from httpx import ASGITransport, AsyncClient
+from PIL import Image
+
+import app as service
+from batcher import ClarifaiBatcher
+from clarifai_client import ClarifaiClient, ClarifaiError
+from fake_clarifai import FakeClarifai
+
+class BlockingClient(ClarifaiClient):
+    """The pre-async behaviour: a new connection per call, blocking the event loop."""
+
+    async def predict(self, images):
+        resp = requests.post(self.url, headers={"Authorization": f"Key {self.pat}"}, json=self._payload(images))
+        if resp.status_code != 200:
+            raise ClarifaiError(resp.status_code, resp.json())
+        return resp.json()["outputs"]
+
+def make_photo(width=640, height=480):
+    rng = np.random.default_rng(0)
+    pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+    return buffer.getvalue()
+
+async def run_load(client, batcher, n_requests, concurrency, photo):
+    """Send `n_requests` uploads with `concurrency` workers; return throughput and latencies."""
+    service.clarifai = client
+    service.batcher = batcher
+    latencies = []
+    failures = 0
+    queue = asyncio.Queue()
+    for _ in range(n_requests):
+        queue.put_nowait(None)
+
+    transport = ASGITransport(app=service.app)
+    async with AsyncClient(transport=transport, base_url="http://test", timeout=None) as ac:
+        async def worker():
+            nonlocal failures
+            while not queue.empty():
+                queue.get_nowait()
+                start = time.perf_counter()
+                response = await ac.post("/generate-labels", files={"image": ("meal.jpg", photo, "image/jpeg")})
+                latencies.append(time.perf_counter() - start)
+                if response.status_code != 200:
+                    failures += 1
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        elapsed = time.perf_counter() - start
+    await client.aclose()
+
+    latencies.sort()
+    return {
+        "requests": n_requests,
+        "failures": failures,
+        "seconds": elapsed,
+        "throughput_rps": n_requests / elapsed,
+        "p50_ms": statistics.median(latencies) * 1e3,
+        "p95_ms": latencies[int(0.95 * (len(latencies) - 1))] * 1e3,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test /generate-labels against a fake Clarifai")
+    parser.add_argument("--requests", type=int, default=200, help="Requests per run")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32], help="Concurrent callers")
+    parser.add_argument("--latency", type=float, default=0.2, help="Fake Clarifai latency in seconds")
+    parser.add_argument("--max-outbound", type=int, default=service.CLARIFAI_MAX_CONCURRENCY,
+                        help="Cap on concurrent Clarifai requests for the async client")
+    parser.add_argument("--batch-size", type=int, default=service.CLARIFAI_BATCH_SIZE,
+                        help="Images per Clarifai call for the batched client")
+    parser.add_argument("--batch-wait-ms", type=float, default=service.CLARIFAI_BATCH_WAIT_MS,
+                        help="Batch window of the batched client")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    fake = FakeClarifai(latency=args.latency).start()
+    photo = make_photo()
+    results = []
+    print(f"fake Clarifai latency {args.latency * 1e3:.0f} ms, async cap {args.max_outbound} outbound requests")
+    print(f"batched client: up to {args.batch_size} images per call, {args.batch_wait_ms:.0f} ms window")
+    print(f"{'client':10s} {'callers':>8s} {'req/s':>9s} {'p50 ms':>9s} {'p95 ms':>9s} {'calls/img':>10s} {'failed':>7s}")
+    clients = (
+        ("blocking", BlockingClient, 1),
+        ("async", ClarifaiClient, 1),
+        ("batched", ClarifaiClient, args.batch_size),
+    )
+    try:
+        for concurrency in args.concurrency:
+            for name, cls, batch_size in clients:
+                client = cls(fake.url, "bench", "bench", "bench", max_concurrency=args.max_outbound)
+                batcher = ClarifaiBatcher(client, max_batch_size=batch_size, max_wait=args.batch_wait_ms / 1000)
+                # The blocking client gains nothing from extra callers; keep its runs short
+                n_requests = min(args.requests, 40) if name == "blocking" else args.requests
+                calls_before = len(fake.requests)
+                result = asyncio.run(run_load(client, batcher, n_requests, concurrency, photo))
+                result.update({
+                    "client": name, "concurrency": concurrency, "latency": args.latency,
+                    "calls_per_image": (len(fake.requests) - calls_before) / n_requests,
+                })
+                results.append(result)
+                print(f"{name:10s} {concurrency:8d} {result['throughput_rps']:9.1f} {result['p50_ms']:9.1f} "
+                      f"{result['p95_ms']:9.1f} {result['calls_per_image']:10.2f} {result['failures']:7d}")
+    finally:
+        fake.stop()
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,149 @@
+# Shared async client for the Clarifai outputs API: keep-alive connections,
+# a cap on concurrent outbound calls, per-request timeouts and 429 backoff.
+
+import asyncio
+import base64
+import random
+import time
+
+import httpx
+from prometheus_client import Counter, Gauge, Histogram
+
+# === Monitoring Metrics ===
+CLARIFAI_REQUEST_LATENCY = Histogram(
+    "food_analyzer_clarifai_request_seconds",
+    "Round-trip time of one Clarifai HTTP request, including the image upload",
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 30.0)
+)
+CLARIFAI_QUEUE_WAIT = Histogram(
+    "food_analyzer_clarifai_queue_wait_seconds",
+    "Time a request waited for a free Clarifai concurrency slot",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+)
+CLARIFAI_INFLIGHT = Gauge(
+    "food_analyzer_clarifai_inflight_requests",
+    "Clarifai requests currently in flight"
+)
+CLARIFAI_RETRIES = Counter(
+    "food_analyzer_clarifai_retries_total",
+    "Clarifai requests retried after a throttling or unavailable response",
+    ["status"]
+)
+
+# Statuses worth retrying after a pause; anything else is returned to the caller
+RETRY_STATUSES = (429, 503)
+
+class ClarifaiError(Exception):
+    """Clarifai call that did not produce outputs; carries the HTTP status and body to return."""
+
+    def __init__(self, status_code, body):
+        super().__init__(f"Clarifai request failed with status {status_code}")
+        self.status_code = status_code
+        self.body = body
+
+class ClarifaiClient:
+    """Async Clarifai client shared by all requests of the service.
+
+    One `httpx.AsyncClient` per event loop keeps connections (and their TLS
+    sessions) alive between calls. At most `max_concurrency` requests are in
+    flight; callers beyond that wait for a slot. Throttled (429) or
+    unavailable (503) answers are retried up to `max_retries` times, honouring
+    `Retry-After` when present and otherwise using exponential backoff with
+    full jitter. A slot is not held while backing off.
+    """
+
+    def __init__(self, url, pat, user_id, app_id, max_concurrency=8, timeout=15.0,
+                 max_retries=3, backoff_base=0.5, backoff_max=8.0):
+        self.url = url
+        self.pat = pat
+        self.user_id = user_id
+        self.app_id = app_id
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+
+    def _bind(self):
+        """Client and semaphore for the running event loop (created on first use)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                ),
+                headers={"Authorization": f"Key {self.pat}"}
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client, self._semaphore
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+    def _payload(self, images):
+        return {
+            "user_app_id": {
+                "user_id": self.user_id,
+                "app_id":  self.app_id
+            },
+            "inputs": [
+                { "data": { "image": { "base64": base64.b64encode(image).decode() } } }
+                for image in images
+            ]
+        }
+
+    def _backoff(self, attempt, response):
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def predict(self, images):
+        """Clarifai `outputs` for a list of image byte strings (one output per image)."""
+        client, semaphore = self._bind()
+        payload = self._payload(images)
+        for attempt in range(self.max_retries + 1):
+            wait_start = time.perf_counter()
+            async with semaphore:
+                CLARIFAI_QUEUE_WAIT.observe(time.perf_counter() - wait_start)
+                CLARIFAI_INFLIGHT.inc()
+                start = time.perf_counter()
+                try:
+                    response = await client.post(self.url, json=payload)
+                except httpx.TimeoutException:
+                    raise ClarifaiError(504, {"error": f"Clarifai request timed out after {self.timeout}s"})
+                except httpx.HTTPError as e:
+                    raise ClarifaiError(502, {"error": f"Clarifai request failed: {str(e)}"})
+                finally:
+                    CLARIFAI_INFLIGHT.dec()
+                    CLARIFAI_REQUEST_LATENCY.observe(time.perf_counter() - start)
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                CLARIFAI_RETRIES.labels(str(response.status_code)).inc()
+                await asyncio.sleep(self._backoff(attempt, response))
+                continue
+            break
+
+        if response.status_code != 200:
+            try:
+                body = response.json()
+            except ValueError:
+                body = {"error": response.text}
+            raise ClarifaiError(response.status_code, body)
+
+        outputs = response.json().get("outputs", [])
+        if len(outputs) != len(images):
+            raise ClarifaiError(502, {"error": "No output from Clarifai"})
+        return outputs
@@ -0,0 +1,147 @@
+# Near-duplicate label cache: uploads are keyed by a 64-bit perceptual hash and
+# looked up by Hamming distance, so a re-photographed or re-compressed plate
+# reuses the labels of an earlier upload instead of calling Clarifai again.
+
+import io
+import json
+import os
+from collections import OrderedDict
+
+import numpy as np
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+# === Perceptual Hash ===
+HASH_BITS = 64
+DCT_SIZE = 32   # image is reduced to DCT_SIZE x DCT_SIZE grey pixels
+LOW_FREQ = 8    # LOW_FREQ x LOW_FREQ lowest frequencies give the 64 hash bits
+
+def _dct_matrix(n):
+    """Orthonormal DCT-II matrix: C @ x is the DCT of column vector x."""
+    k = np.arange(n)[:, None]
+    i = np.arange(n)[None, :]
+    matrix = np.sqrt(2.0 / n) * np.cos(np.pi * (2 * i + 1) * k / (2 * n))
+    matrix[0] /= np.sqrt(2.0)
+    return matrix
+
+_DCT = _dct_matrix(DCT_SIZE)
+
+def phash(data):
+    """64-bit DCT perceptual hash of encoded image bytes.
+
+    The image is upright-rotated, reduced to 32x32 grey pixels and
+    transformed with a 2-D DCT; each bit says whether one of the 8x8 lowest
+    frequencies is above their median (DC excluded). Re-encoding, resizing and
+    mild colour changes flip few bits. Raises ValueError for data Pillow
+    cannot decode.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        if image.format == "JPEG":
+            image.draft("L", (DCT_SIZE * 2, DCT_SIZE * 2))
+        image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError(f"Could not decode image: {str(e)}")
+    image = ImageOps.exif_transpose(image).convert("L").resize((DCT_SIZE, DCT_SIZE), Image.LANCZOS)
+    pixels = np.asarray(image, dtype=np.float64)
+    low = (_DCT @ pixels @ _DCT.T)[:LOW_FREQ, :LOW_FREQ].ravel()
+    bits = low > np.median(low[1:])
+    return int.from_bytes(np.packbits(bits).tobytes(), "big")
+
+# === Multi-Index Hash Table ===
+class ImageCache:
+    """LRU cache of labels keyed by perceptual hash, searched by Hamming distance.
+
+    Multi-index hashing: each hash is split into `n_chunks` chunks, with one
+    exact-match table per chunk. If two hashes differ in at most
+    `max_distance` bits, at least one chunk differs in at most
+    `max_distance // n_chunks` bits (pigeonhole). A lookup therefore probes
+    every value within that radius of each query chunk and checks the full
+    distance of the candidates only. The closest entry within `max_distance`
+    wins. Beyond `max_entries`, the least recently used entry is evicted.
+    """
+
+    def __init__(self, max_entries=10000, max_distance=6, n_chunks=4):
+        if HASH_BITS % n_chunks:
+            raise ValueError(f"n_chunks must divide {HASH_BITS}")
+        self.max_entries = max_entries
+        self.max_distance = max_distance
+        self.n_chunks = n_chunks
+        self.chunk_bits = HASH_BITS // n_chunks
+        self._chunk_mask = (1 << self.chunk_bits) - 1
+        self._entries = OrderedDict()   # hash -> labels, least recently used first
+        self._tables = [{} for _ in range(n_chunks)]
+        self._probes = self._flip_masks(self.chunk_bits, max_distance // n_chunks)
+
+    @staticmethod
+    def _flip_masks(bits, radius):
+        """Every `bits`-bit mask with at most `radius` bits set."""
+        masks = [0]
+        frontier = [0]
+        for _ in range(radius):
+            frontier = sorted({m | (1 << b) for m in frontier for b in range(bits) if not m >> b & 1})
+            masks.extend(frontier)
+        return masks
+
+    def _chunks(self, h):
+        return [(h >> (i * self.chunk_bits)) & self._chunk_mask for i in range(self.n_chunks)]
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, h):
+        """Labels of the closest cached hash within `max_distance` of `h`, or None."""
+        best, best_distance = None, self.max_distance + 1
+        if h in self._entries:
+            best, best_distance = h, 0
+        else:
+            seen = set()
+            for table, chunk in zip(self._tables, self._chunks(h)):
+                for mask in self._probes:
+                    for candidate in table.get(chunk ^ mask, ()):
+                        if candidate in seen:
+                            continue
+                        seen.add(candidate)
+                        distance = (candidate ^ h).bit_count()
+                        if distance < best_distance:
+                            best, best_distance = candidate, distance
+        if best is None:
+            return None
+        self._entries.move_to_end(best)
+        return self._entries[best]
+
+    def put(self, h, labels):
+        if self.max_entries <= 0:
+            return
+        if h in self._entries:
+            self._entries[h] = labels
+            self._entries.move_to_end(h)
+            return
+        self._entries[h] = labels
+        for table, chunk in zip(self._tables, self._chunks(h)):
+            table.setdefault(chunk, []).append(h)
+        while len(self._entries) > self.max_entries:
+            self._evict()
+
+    def _evict(self):
+        h, _ = self._entries.popitem(last=False)
+        for table, chunk in zip(self._tables, self._chunks(h)):
+            bucket = table[chunk]
+            bucket.remove(h)
+            if not bucket:
+                del table[chunk]
+
+    # === Persistence ===
+    def save(self, path):
+        """Write all entries (least recently used first) to a JSON file, atomically."""
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"entries": [[format(h, "016x"), labels] for h, labels in self._entries.items()]}, f)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Add the entries of a file written by `save`; returns how many were read."""
+        with open(path) as f:
+            entries = json.load(f)["entries"]
+        for h, labels in entries:
+            self.put(int(h, 16), labels)
+        return len(entries)
@@ -0,0 +1,37 @@
+# In-memory image preparation: decode, downscale and re-encode uploads before
+# they are sent to Clarifai. Nothing is written to disk.
+
+import io
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+def prepare_image(data, max_dim=1024, quality=85):
+    """Return JPEG bytes of `data` with its longest side at most `max_dim` pixels.
+
+    EXIF orientation is applied before resizing so rotated phone photos stay
+    upright once the metadata is dropped. Images that need no resizing are
+    re-encoded only if that makes them smaller; `max_dim <= 0` disables
+    downscaling. Raises ValueError for data Pillow cannot decode.
+    """
+    try:
+        image = Image.open(io.BytesIO(data))
+        resized = max_dim > 0 and max(image.size) > max_dim
+        if resized and image.format == "JPEG":
+            # Let the JPEG decoder scale down by 1/2, 1/4 or 1/8 while decoding
+            image.draft("RGB", (max_dim, max_dim))
+        image.load()
+    except (UnidentifiedImageError, OSError) as e:
+        raise ValueError(f"Could not decode image: {str(e)}")
+
+    image = ImageOps.exif_transpose(image)
+    if resized:
+        image.thumbnail((max_dim, max_dim), Image.LANCZOS)
+    if image.mode != "RGB":
+        image = image.convert("RGB")
+
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=quality, optimize=True)
+    encoded = buffer.getvalue()
+    if not resized and len(encoded) >= len(data):
+        return data
+    return encoded
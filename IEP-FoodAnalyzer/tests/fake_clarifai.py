@@ -0,0 +1,90 @@
+# Local stand-in for the Clarifai model outputs endpoint, used by the tests
+# instead of the real API.
+
+import base64
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_CONCEPTS = [
+    {"name": "rice", "value": 0.91},
+    {"name": "chicken", "value": 0.64},
+    {"name": "broccoli", "value": 0.12},
+]
+
+class FakeClarifai:
+    """Threaded HTTP server that answers Clarifai `outputs` requests.
+
+    Every request is recorded (JSON payload plus decoded image bytes) and
+    answered with one output per input after `latency` seconds; `concepts`
+    is either a fixed list or a function of the decoded image bytes. Statuses
+    queued with `fail_next` are returned (with an optional `Retry-After`)
+    before normal answers resume.
+    """
+
+    def __init__(self, concepts=None, latency=0.0):
+        self.concepts = DEFAULT_CONCEPTS if concepts is None else concepts
+        self.latency = latency
+        self.requests = []
+        self.images = []
+        self._failures = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/v2/models/food-item-recognition/outputs"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def fail_next(self, status, times=1, retry_after=None):
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * times)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with fake._lock:
+                    fake.requests.append(payload)
+                    fake.images.extend(
+                        base64.b64decode(i["data"]["image"]["base64"]) for i in payload.get("inputs", [])
+                    )
+                    status, retry_after = fake._failures.pop(0) if fake._failures else (200, None)
+                time.sleep(fake.latency)
+                if status != 200:
+                    body = {"status": {"code": status, "description": "Injected failure"}}
+                else:
+                    images = [base64.b64decode(i["data"]["image"]["base64"]) for i in payload.get("inputs", [])]
+                    body = {"outputs": [
+                        {"id": str(i), "data": {"concepts": fake.concepts(image) if callable(fake.concepts) else fake.concepts}}
+                        for i, image in enumerate(images)
+                    ]}
+                data = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    if retry_after is not None:
+                        self.send_header("Retry-After", str(retry_after))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client gave up (timeout test)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
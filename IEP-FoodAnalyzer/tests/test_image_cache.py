@@ -0,0 +1,67 @@
+import os
+import random
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from image_cache import ImageCache, phash
+
+TEST_IMAGE_PATH = os.path.join(os.path.dirname(__file__), "test.jpg")
+
+def _flip(h, n_bits, rng):
+    for bit in rng.sample(range(64), n_bits):
+        h ^= 1 << bit
+    return h
+
+def test_lookup_matches_brute_force():
+    rng = random.Random(0)
+    cache = ImageCache(max_entries=5000, max_distance=6)
+    hashes = [rng.getrandbits(64) for _ in range(2000)]
+    for i, h in enumerate(hashes):
+        cache.put(h, i)
+
+    for n_bits in range(0, 10):
+        for _ in range(20):
+            query = _flip(rng.choice(hashes), n_bits, rng)
+            distances = [(h ^ query).bit_count() for h in hashes]
+            best = min(distances)
+            found = cache.get(query)
+            if best <= cache.max_distance:
+                assert distances[found] == best
+            else:
+                assert found is None
+
+def test_lru_eviction():
+    cache = ImageCache(max_entries=2, max_distance=0)
+    cache.put(1, "a")
+    cache.put(2, "b")
+    assert cache.get(1) == "a"   # 2 is now least recently used
+    cache.put(3, "c")
+    assert len(cache) == 2
+    assert cache.get(2) is None
+    assert cache.get(1) == "a" and cache.get(3) == "c"
+
+def test_save_and_load(tmp_path):
+    path = str(tmp_path / "image_cache.json")
+    cache = ImageCache()
+    cache.put(0xFFFF0000FFFF0000, [{"name": "rice", "confidence": 91.0}])
+    cache.put(7, [])
+    cache.save(path)
+
+    restored = ImageCache()
+    assert restored.load(path) == 2
+    assert restored.get(0xFFFF0000FFFF0001) == [{"name": "rice", "confidence": 91.0}]
+    assert restored.get(7) == []
+
+def test_phash_is_stable_under_recompression():
+    import io
+    from PIL import Image
+
+    if not os.path.exists(TEST_IMAGE_PATH):
+        pytest.skip("tests/test.jpg fixture is not available")
+    with open(TEST_IMAGE_PATH, "rb") as f:
+        original = f.read()
+    buffer = io.BytesIO()
+    Image.open(io.BytesIO(original)).convert("RGB").save(buffer, format="PNG")
+    assert (phash(original) ^ phash(buffer.getvalue())).bit_count() <= 2
@@ -1,6 +1,7 @@
 # RUN: uvicorn app:app --host 0.0.0.0 --port 8004
 
-from fastapi import FastAPI, File, UploadFile, Form, Request
+from fastapi import FastAPI, File, UploadFile, Form, Request, HTTPException
+from typing import Optional
 import pandas as pd
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
@@ -8,14 +9,26 @@ import joblib
 import os
 import boto3
 from io import StringIO
+import json
+import math
 import time
 
+from flat_model import FlatModel
+from registry import ModelRegistry
+from feature_store import open_feature_store
+from microbiome_io import HeaderCache, header_line, read_first_row, sparse_microbiome_row
 from prometheus_client import make_asgi_app, Counter, Summary, Gauge
+from stage_metrics import StageMetrics
+from tracing import Tracing
 
 # === Monitoring Metrics ===
 REQUEST_COUNT = Counter("glucose_monitor_request_count", "Total number of prediction requests to Glucose Monitor")
 REQUEST_LATENCY = Summary("glucose_monitor_request_latency_seconds", "Prediction request latency in seconds")
 LAST_PREDICTED_GLUCOSE = Gauge("glucose_monitor_last_predicted_spike", "Last glucose spike prediction")
+# Spans for requests and stages, continued across services via traceparent (see tracing.py)
+tracing = Tracing("glucose-monitor")
+# Latency by endpoint and by stage: parse, feature_store_read, preprocess (feature building), inference
+stage_metrics = StageMetrics("glucose_monitor", tracing)
 
 # === FastAPI App Setup ===
 app = FastAPI()
@@ -28,11 +41,26 @@ app.mount("/metrics", metrics_app)
 @app.middleware("http")
 async def prometheus_middleware(request: Request, call_next):
     REQUEST_COUNT.inc()
+    endpoint = stage_metrics.begin(request)
     start_time = time.time()
     response = await call_next(request)
-    REQUEST_LATENCY.observe(time.time() - start_time)
+    elapsed = time.time() - start_time
+    REQUEST_LATENCY.observe(elapsed)
+    stage_metrics.observe_request(endpoint, request.method, response.status_code, elapsed)
     return response
 
+# Declared after prometheus_middleware so the request span wraps it and the stages
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    with tracing.server_span(request) as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+        return response
+
+@app.on_event("shutdown")
+def close_tracing():
+    tracing.shutdown()
+
 # === Functions ===
 
 def load_data_from_s3(bucket_name, file_key):
@@ -73,78 +101,213 @@ except Exception as e:
     else:
         top_bacteria = []  # Fallback to empty list
 
-# === Load trained model ===
-model = joblib.load("glucose_predictor_local.pkl")
+# Upload headers resolved to top-bacteria positions
+header_cache = HeaderCache(top_bacteria)
 
-# === API Endpoints ===
+# Profiles stored by the controller, fetched by (user_id, version) instead of re-uploaded
+feature_store = open_feature_store()
 
-@app.post("/predict-glucose")
-async def predict_glucose(
-    bio_file: UploadFile = File(...),
-    micro_file: UploadFile = File(...),
-    protein_pct: float = Form(...),
-    fat_pct: float = Form(...),
-    carbs_pct: float = Form(...),
-    sugar_risk: int = Form(...),
-    refined_carb: int = Form(...),
-    meal_category: str = Form(...)
-):
-    """Predict glucose spike from clinical, microbiome, and nutrition data."""
-    # Load and process clinical file
-    bio_df = pd.read_csv(bio_file.file)
-    bio_df = bio_df.rename(columns={
-        'Age': 'clinical_Age',
-        'BMI': 'clinical_BMI',
-        'Fasting GLU - PDL (Lab)': 'clinical_fasting_glucose',
-        'Insulin ': 'clinical_fasting_insulin',
-        'A1c PDL (Lab)': 'clinical_HbA1c',
-        'Gender': 'clinical_Gender'
-    })
+# === Load trained models ===
+# Every .pkl pipeline / .npz flat model in GLUCOSE_MODEL_DIR is preloaded as a
+# version named after its file stem. Without that directory the bundled model
+# is served as "local" (and its compiled tables, if present, as "local-flat").
+MODEL_DIR = os.environ.get("GLUCOSE_MODEL_DIR", "models")
+registry = ModelRegistry()
+if os.path.isdir(MODEL_DIR):
+    registry.load_dir(MODEL_DIR)
+if not registry.versions():
+    registry.register("local", joblib.load("glucose_predictor_local.pkl"))
+    flat_path = os.environ.get("GLUCOSE_FLAT_MODEL_PATH", "glucose_predictor_flat.npz")
+    if os.path.exists(flat_path):
+        registry.register("local-flat", FlatModel.load(flat_path))
+
+# GLUCOSE_MODEL_ENGINE=flat serves the compiled tree tables (see flat_model.py)
+# instead of the sklearn pipeline; predictions match to float tolerance.
+default_version = "local-flat" if os.environ.get("GLUCOSE_MODEL_ENGINE") == "flat" else registry.versions()[0]
+if default_version not in registry.versions():
+    default_version = registry.versions()[0]
+registry.activate(os.environ.get("GLUCOSE_ACTIVE_VERSION", default_version))
+registry.set_shadow(os.environ.get("GLUCOSE_SHADOW_VERSION") or None)
+
+# === Feature Builders ===
+
+CLINICAL_RENAME = {
+    'Age': 'clinical_Age',
+    'BMI': 'clinical_BMI',
+    'Fasting GLU - PDL (Lab)': 'clinical_fasting_glucose',
+    'Insulin ': 'clinical_fasting_insulin',
+    'A1c PDL (Lab)': 'clinical_HbA1c',
+    'Gender': 'clinical_Gender'
+}
+
+CLINICAL_COLS = [
+    "clinical_Age", "clinical_BMI", "clinical_fasting_glucose",
+    "clinical_fasting_insulin", "clinical_HbA1c", "clinical_HOMA_IR", "clinical_Gender"
+]
+
+MEAL_COLS = ["protein_pct", "fat_pct", "carbs_pct", "sugar_risk", "refined_carb", "meal_category"]
+
+# Upper bound on candidates scored by /plan-meals in a single request
+MAX_PLAN_CANDIDATES = int(os.environ.get("MAX_PLAN_CANDIDATES", 50000))
+
+def build_clinical_features(bio_df):
+    """Rename, derive HOMA-IR and scale the clinical columns of the first row."""
+    bio_df = bio_df.rename(columns=CLINICAL_RENAME)
 
     bio_df["clinical_HOMA_IR"] = (
         bio_df["clinical_fasting_glucose"] * bio_df["clinical_fasting_insulin"]
     ) / 405
 
-    clinical_cols = [
-        "clinical_Age", "clinical_BMI", "clinical_fasting_glucose", 
-        "clinical_fasting_insulin", "clinical_HbA1c", "clinical_HOMA_IR", "clinical_Gender"
-    ]
-    clinical_row = bio_df[clinical_cols].iloc[0].to_dict()
+    clinical_row = bio_df[CLINICAL_COLS].iloc[0].to_dict()
 
     numerical_cols = [k for k in clinical_row if k.startswith("clinical_") and k != "clinical_Gender"]
     scaler = MinMaxScaler()
     scaled = scaler.fit_transform(pd.DataFrame([clinical_row])[numerical_cols])
     for i, col in enumerate(numerical_cols):
         clinical_row[col] = scaled[0][i]
+    return clinical_row
 
-    # Load and process microbiome file
-    micro_df = pd.read_csv(micro_file.file).drop(columns=["subject"], errors="ignore")
-    for col in top_bacteria:
-        if col not in micro_df.columns:
-            micro_df[col] = 0
-    micro_row = micro_df[top_bacteria].iloc[0].to_dict()
+def build_microbiome_features(contents):
+    """Align the first row of a microbiome CSV upload to the model's top bacteria.
 
-    # Combine all features
-    input_row = {
-        "protein_pct": protein_pct,
-        "fat_pct": fat_pct,
-        "carbs_pct": carbs_pct,
-        "sugar_risk": sugar_risk,
-        "refined_carb": refined_carb,
-        "meal_category": meal_category.lower(),
-        **clinical_row,
-        **micro_row
-    }
+    Column positions come from the header cache and only those columns of
+    the first row are parsed; bacteria absent from the file are treated as
+    not present.
+    """
+    layout = header_cache.resolve(header_line(contents))
+    return dict(zip(top_bacteria, read_first_row(contents, layout).tolist()))
+
+def load_microbiome_row(micro_file, micro_taxa, taxonomy_version, profile_user_id=None, profile_version=None):
+    """Microbiome features from a dense CSV upload, a sparse list of present taxa
+    or a profile stored in the feature store."""
+    if profile_user_id is not None:
+        if feature_store is None:
+            raise HTTPException(status_code=400, detail="Feature store is not configured (FEATURE_STORE_PATH)")
+        try:
+            with stage_metrics.stage("feature_store_read"):
+                profile = feature_store.get_profile(profile_user_id, profile_version)
+        except KeyError as e:
+            raise HTTPException(status_code=404, detail=e.args[0])
+        layout = header_cache.resolve(profile.header)
+        return dict(zip(top_bacteria, profile.project(layout).tolist()))
+    if micro_taxa is not None:
+        try:
+            with stage_metrics.stage("parse"):
+                return sparse_microbiome_row(micro_taxa, taxonomy_version, top_bacteria)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if micro_file is None:
+        raise HTTPException(status_code=400, detail="Provide micro_file, micro_taxa or profile_user_id")
+    with stage_metrics.stage("parse"):
+        return build_microbiome_features(micro_file.file.read())
+
+def load_clinical_row(bio_file):
+    """Scaled clinical features of an uploaded bio CSV."""
+    with stage_metrics.stage("parse"):
+        bio_df = pd.read_csv(bio_file.file)
+    with stage_metrics.stage("preprocess"):
+        return build_clinical_features(bio_df)
+
+def build_model_input(profile_row, meals):
+    """Broadcast one user profile across a table of meals."""
+    n_rows = len(meals["meal_category"])
+    input_df = pd.DataFrame(profile_row, index=pd.RangeIndex(n_rows))
+    for col in MEAL_COLS:
+        input_df[col] = meals[col]
+    input_df["meal_category"] = input_df["meal_category"].str.lower()
+    return input_df
+
+def meal_columns(columns):
+    """Numpy candidate columns from raw per-column value lists, checked so the
+    model never sees a non-string category or a non-numeric macro value."""
+    meals = {}
+    for col, values in columns.items():
+        if col == "meal_category":
+            if not all(isinstance(v, str) for v in values):
+                raise ValueError("meal_category values must be strings")
+        elif not all(isinstance(v, (int, float)) for v in values):
+            raise ValueError(f"{col} values must be numbers")
+        meals[col] = np.asarray(values)
+    return meals
+
+def expand_meal_grid(grid, max_candidates=None):
+    """Expand a grid of macro options into candidate columns (cartesian product).
+
+    `carbs_pct` may be omitted, in which case it is derived as the remainder
+    of protein and fat and combinations that exceed 100% are dropped. The
+    product size is checked against `max_candidates` before it is built.
+    """
+    grid = {"sugar_risk": [0], "refined_carb": [0], **grid}
+    missing = [col for col in MEAL_COLS if col not in grid and col != "carbs_pct"]
+    if missing:
+        raise ValueError(f"Grid is missing values for: {missing}")
+    axes = [col for col in MEAL_COLS if col in grid]
+    values = list(meal_columns({col: grid[col] for col in axes}).values())
+    n_candidates = math.prod(len(v) for v in values)
+    if max_candidates is not None and n_candidates > max_candidates:
+        raise ValueError(f"Too many candidates ({n_candidates}), limit is {max_candidates}")
+    mesh = np.meshgrid(*[np.arange(len(v)) for v in values], indexing="ij")
+    meals = {col: v[idx.ravel()] for col, v, idx in zip(axes, values, mesh)}
+    if "carbs_pct" not in meals:
+        meals["carbs_pct"] = 100 - meals["protein_pct"] - meals["fat_pct"]
+        keep = meals["carbs_pct"] >= 0
+        meals = {col: v[keep] for col, v in meals.items()}
+    return meals
+
+def parse_meal_candidates(candidates, max_candidates=None):
+    """Turn a list of candidate meal dicts into candidate columns."""
+    if max_candidates is not None and len(candidates) > max_candidates:
+        raise ValueError(f"Too many candidates ({len(candidates)}), limit is {max_candidates}")
+    missing = [col for col in MEAL_COLS if any(col not in c for c in candidates)]
+    if missing:
+        raise ValueError(f"Candidates are missing values for: {missing}")
+    return meal_columns({col: [c[col] for c in candidates] for col in MEAL_COLS})
+
+# === API Endpoints ===
 
-    input_df = pd.DataFrame([input_row])
+@app.post("/predict-glucose")
+async def predict_glucose(
+    bio_file: UploadFile = File(...),
+    micro_file: Optional[UploadFile] = File(None),
+    protein_pct: float = Form(...),
+    fat_pct: float = Form(...),
+    carbs_pct: float = Form(...),
+    sugar_risk: int = Form(...),
+    refined_carb: int = Form(...),
+    meal_category: str = Form(...),
+    micro_taxa: Optional[str] = Form(None),
+    taxonomy_version: str = Form("v1"),
+    profile_user_id: Optional[int] = Form(None),
+    profile_version: Optional[int] = Form(None)
+):
+    """Predict glucose spike from clinical, microbiome, and nutrition data.
 
-    for col in model.feature_names_in_:
-        if col not in input_df.columns:
-            input_df[col] = 0
-    input_aligned = input_df[model.feature_names_in_]
+    The microbiome can be sent as a dense CSV (`micro_file`), as a JSON list
+    of present taxa names/indices (`micro_taxa`) in the given taxonomy version,
+    or by reference to a feature-store profile (`profile_user_id`, optional
+    `profile_version`, latest by default).
+    """
+    # Load and process clinical file
+    clinical_row = load_clinical_row(bio_file)
+
+    # Load and process microbiome data
+    micro_row = load_microbiome_row(micro_file, micro_taxa, taxonomy_version, profile_user_id, profile_version)
+
+    # Combine all features
+    meal = {
+        "protein_pct": [protein_pct],
+        "fat_pct": [fat_pct],
+        "carbs_pct": [carbs_pct],
+        "sugar_risk": [sugar_risk],
+        "refined_carb": [refined_carb],
+        "meal_category": [meal_category]
+    }
+    with stage_metrics.stage("preprocess"):
+        input_df = build_model_input({**clinical_row, **micro_row}, meal)
 
     # Predict
-    prediction = model.predict(input_aligned)[0]
+    with stage_metrics.stage("inference"):
+        prediction = registry.predict(input_df)[0]
     spike_60 = round(float(prediction), 2)
 
     # === Update Prometheus Metric ===
@@ -158,6 +321,91 @@ async def predict_glucose(
         "message": message
     }
 
+@app.post("/plan-meals")
+async def plan_meals(
+    bio_file: UploadFile = File(...),
+    micro_file: Optional[UploadFile] = File(None),
+    candidates: Optional[str] = Form(None),
+    grid: Optional[str] = Form(None),
+    top_k: int = Form(10),
+    micro_taxa: Optional[str] = Form(None),
+    taxonomy_version: str = Form("v1"),
+    profile_user_id: Optional[int] = Form(None),
+    profile_version: Optional[int] = Form(None)
+):
+    """Rank candidate meals for one user by predicted 60-minute glucose spike.
+
+    Candidates are given either as a JSON list of meals (`candidates`) or as a
+    JSON object of per-column options (`grid`). The user profile is built once
+    and broadcast across every candidate, which are scored in one model call.
+    """
+    try:
+        if candidates:
+            meals = parse_meal_candidates(json.loads(candidates), MAX_PLAN_CANDIDATES)
+        elif grid:
+            meals = expand_meal_grid(json.loads(grid), MAX_PLAN_CANDIDATES)
+        else:
+            raise ValueError("Provide either `candidates` or `grid`")
+    except (ValueError, TypeError, AttributeError) as e:
+        raise HTTPException(status_code=400, detail=f"Invalid meal candidates: {str(e)}")
+
+    n_candidates = len(meals["meal_category"])
+    if n_candidates == 0:
+        raise HTTPException(status_code=400, detail="No meal candidates to score")
+
+    # Profile features are computed once for all candidates
+    clinical_row = load_clinical_row(bio_file)
+    micro_row = load_microbiome_row(micro_file, micro_taxa, taxonomy_version, profile_user_id, profile_version)
+    with stage_metrics.stage("preprocess"):
+        input_df = build_model_input({**clinical_row, **micro_row}, meals)
+
+    with stage_metrics.stage("inference"):
+        spikes = registry.predict(input_df)
+    order = np.argsort(spikes, kind="stable")
+    if top_k > 0:
+        order = order[:top_k]
+
+    ranked = []
+    for rank, i in enumerate(order, start=1):
+        meal = {col: meals[col][i].item() for col in MEAL_COLS}
+        ranked.append({"rank": rank, **meal, "glucose_spike_60min": round(float(spikes[i]), 2)})
+
+    return {
+        "n_candidates": n_candidates,
+        "ranked": ranked
+    }
+
+@app.get("/models")
+def list_models():
+    """Loaded model versions and the current active / shadow selection."""
+    return registry.status()
+
+@app.post("/models/activate")
+def activate_model(version: str = Form(...)):
+    """Hot-swap the version that answers prediction requests."""
+    try:
+        registry.activate(version)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return registry.status()
+
+@app.post("/models/shadow")
+def set_shadow_model(version: Optional[str] = Form(None)):
+    """Shadow-score live traffic with `version`; omit it to stop shadowing."""
+    try:
+        registry.set_shadow(version or None)
+    except KeyError as e:
+        raise HTTPException(status_code=404, detail=str(e.args[0]))
+    return registry.status()
+
+@app.post("/models/reload")
+def reload_models():
+    """Pick up new or updated artifacts from the model directory without a restart."""
+    if not os.path.isdir(MODEL_DIR):
+        raise HTTPException(status_code=404, detail=f"Model directory not found: {MODEL_DIR}")
+    registry.load_dir(MODEL_DIR)
+    return registry.status()
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
\ No newline at end of file
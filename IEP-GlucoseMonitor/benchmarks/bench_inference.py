@@ -0,0 +1,104 @@
+# CPU microbenchmarks of the /predict-glucose hot path, without any network:
+# bio CSV parse, clinical scaling, bacteria alignment, model input and predict
+# per model version, on the tests/*.csv fixtures and synthetic wide inputs at
+# several batch sizes. Fails (exit 1) on regressions against the local baseline
+# (written by the first run).
+# RUN: python benchmarks/bench_inference.py [--quick] [--only predict] [--update-baseline]
+
+import io
+import os
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(SERVICE_DIR)
+sys.path.append(BENCH_DIR)
+os.chdir(SERVICE_DIR)
+# The service falls back to its bundled data when S3 is unreachable; do not wait on it
+os.environ.setdefault("AWS_EC2_METADATA_DISABLED", "true")
+
+import joblib
+import numpy as np
+import pandas as pd
+
+import app as service
+from microbench import Suite, main
+from microbiome_io import HeaderCache
+
+BIO_CSV = os.path.join(SERVICE_DIR, "tests", "test_bio.csv")
+MICRO_CSV = os.path.join(SERVICE_DIR, "tests", "test_microbe.csv")
+BASELINE = os.path.join(BENCH_DIR, "baseline_inference.json")
+
+BATCH_SIZES = (1, 10, 100, 1000)
+# Columns of the synthetic wide upload (model bacteria plus unrelated taxa)
+WIDE_TAXA = 5000
+
+def model_bacteria():
+    """Bacteria columns the bundled model was trained on."""
+    features = joblib.load(os.path.join(SERVICE_DIR, "glucose_predictor_local.pkl")).feature_names_in_
+    skip = set(service.CLINICAL_COLS) | set(service.MEAL_COLS)
+    return [f for f in features if f not in skip]
+
+def wide_upload(bacteria, n_taxa=WIDE_TAXA, seed=0):
+    """One-row 0/1 microbiome CSV with `n_taxa` columns, the model's bacteria among them."""
+    rng = np.random.default_rng(seed)
+    extra = [f"Taxon {i} " for i in range(n_taxa - len(bacteria))]
+    columns = list(bacteria) + extra
+    rng.shuffle(columns)
+    values = (rng.random(len(columns)) < 0.1).astype(int)
+    header = ",".join(["subject"] + [c.replace(",", "") for c in columns])
+    row = ",".join(["s0"] + [str(v) for v in values])
+    return f"{header}\n{row}\n".encode("utf-8")
+
+def meal_batch(n_rows, seed=0):
+    rng = np.random.default_rng(seed)
+    protein = rng.integers(5, 40, n_rows)
+    fat = rng.integers(5, 40, n_rows)
+    return {
+        "protein_pct": protein,
+        "fat_pct": fat,
+        "carbs_pct": 100 - protein - fat,
+        "sugar_risk": rng.integers(0, 2, n_rows),
+        "refined_carb": rng.integers(0, 2, n_rows),
+        "meal_category": np.array(["Breakfast", "Lunch", "Dinner", "Snack"])[rng.integers(0, 4, n_rows)],
+    }
+
+def build_suite():
+    suite = Suite("glucose-monitor inference")
+    with open(BIO_CSV, "rb") as f:
+        bio = f.read()
+    with open(MICRO_CSV, "rb") as f:
+        micro = f.read()
+
+    # Align against the model's own bacteria so the fixture and wide inputs exercise real matches
+    bacteria = model_bacteria()
+    service.top_bacteria = bacteria
+    service.header_cache = HeaderCache(bacteria)
+    wide = wide_upload(bacteria)
+
+    suite.add("csv_parse/bio_fixture", lambda: pd.read_csv(io.BytesIO(bio)))
+    bio_df = pd.read_csv(io.BytesIO(bio))
+    suite.add("clinical_scaling/bio_fixture", lambda: service.build_clinical_features(bio_df))
+
+    suite.add("bacteria_alignment/fixture", lambda: service.build_microbiome_features(micro))
+    suite.add("bacteria_alignment/wide_cached_header", lambda: service.build_microbiome_features(wide))
+
+    def align_uncached():
+        service.header_cache = HeaderCache(bacteria)
+        return service.build_microbiome_features(wide)
+    suite.add("bacteria_alignment/wide_new_header", align_uncached)
+
+    profile = {**service.build_clinical_features(bio_df), **service.build_microbiome_features(micro)}
+    for n_rows in BATCH_SIZES:
+        meals = meal_batch(n_rows)
+        suite.add(f"model_input/batch={n_rows}", lambda meals=meals: service.build_model_input(profile, meals))
+        input_df = service.build_model_input(profile, meals)
+        for version in service.registry.versions():
+            def predict(version=version, input_df=input_df):
+                service.registry.activate(version)
+                return service.registry.predict(input_df)
+            suite.add(f"predict/{version}/batch={n_rows}", predict, repeat=5 if n_rows >= 1000 else 7)
+    return suite
+
+if __name__ == "__main__":
+    sys.exit(main(build_suite(), BASELINE))
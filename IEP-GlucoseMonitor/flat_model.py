@@ -0,0 +1,220 @@
+# Compile the trained glucose pipeline into flat array-backed tree tables.
+# RUN: python flat_model.py glucose_predictor_local.pkl glucose_predictor_flat.npz --check
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from tree_tables import evaluate_trees, prepare_forest, stack_tables, tree_table
+
+# === Tree Tables ===
+
+def _sklearn_tree_table(tree, scale):
+    """Table for a fitted sklearn `Tree` (RandomForest member)."""
+    missing_left = getattr(tree, "missing_go_to_left", np.zeros(tree.node_count, dtype=np.uint8))
+    return tree_table(
+        tree.node_count, tree.feature, tree.threshold,
+        tree.children_left, tree.children_right,
+        missing_left, tree.value[:, 0, 0] * scale
+    )
+
+def _hgb_tree_table(predictor):
+    """Table for a fitted HistGradientBoosting `TreePredictor`."""
+    nodes = predictor.nodes
+    if nodes["is_categorical"].any():
+        raise NotImplementedError("Categorical splits are not supported")
+    leaf = nodes["is_leaf"].astype(bool)
+    return tree_table(
+        len(nodes), nodes["feature_idx"], nodes["num_threshold"],
+        np.where(leaf, -1, nodes["left"].astype(np.int64)),
+        np.where(leaf, -1, nodes["right"].astype(np.int64)),
+        nodes["missing_go_to_left"], nodes["value"]
+    )
+
+# === Pipeline Compilation ===
+
+def _compile_preprocessor(preprocessor):
+    """Describe a fitted ColumnTransformer as one-hot and numeric segments."""
+    segments, means, scales = [], [], []
+    for name, transformer, columns in preprocessor.transformers_:
+        if transformer == "drop" or len(columns) == 0:
+            continue
+        columns = list(preprocessor.feature_names_in_[columns]) \
+            if np.asarray(columns).dtype.kind in "iub" else list(columns)
+        kind = transformer.__class__.__name__ if transformer != "passthrough" else "passthrough"
+        if kind == "OneHotEncoder":
+            if transformer.drop is not None:
+                raise NotImplementedError("OneHotEncoder with `drop` is not supported")
+            for col, cats in zip(columns, transformer.categories_):
+                segments.append({"kind": "onehot", "column": col, "categories": [str(c) for c in cats]})
+        elif kind in ("StandardScaler", "passthrough"):
+            mean = getattr(transformer, "mean_", None)
+            scale = getattr(transformer, "scale_", None)
+            means.append(np.zeros(len(columns)) if mean is None else mean)
+            scales.append(np.ones(len(columns)) if scale is None else scale)
+            segments.append({"kind": "numeric", "columns": columns})
+        else:
+            raise NotImplementedError(f"Unsupported transformer: {kind}")
+    return segments, np.concatenate(means), np.concatenate(scales)
+
+def compile_pipeline(pipeline):
+    """Compile a fitted preprocessor + VotingRegressor pipeline into flat arrays."""
+    preprocessor = pipeline.named_steps["preprocessor"]
+    ensemble = pipeline.named_steps["model"]
+    segments, num_mean, num_scale = _compile_preprocessor(preprocessor)
+
+    weights = np.ones(len(ensemble.estimators_)) if ensemble.weights is None \
+        else np.asarray(ensemble.weights, dtype=float)
+    weights = weights / weights.sum()
+
+    arrays = {"num_mean": num_mean, "num_scale": num_scale}
+    members = []
+    for (name, _), estimator, weight in zip(ensemble.estimators, ensemble.estimators_, weights):
+        kind = estimator.__class__.__name__
+        if kind in ("ElasticNet", "LinearRegression", "Ridge", "Lasso"):
+            arrays[f"{name}.coef"] = np.ravel(estimator.coef_).astype(np.float64)
+            arrays[f"{name}.intercept"] = np.float64(estimator.intercept_)
+            members.append({"name": name, "kind": "linear", "weight": weight})
+        elif kind == "RandomForestRegressor":
+            trees = estimator.estimators_
+            tables = [_sklearn_tree_table(t.tree_, 1.0 / len(trees)) for t in trees]
+            depth = max(t.tree_.max_depth for t in trees)
+            arrays.update({f"{name}.{k}": v for k, v in stack_tables(tables, depth).items()})
+            # sklearn trees compare float32 inputs against float64 thresholds
+            members.append({"name": name, "kind": "forest", "float32": True, "weight": weight})
+        elif kind == "HistGradientBoostingRegressor":
+            if estimator._loss.__class__.__name__ != "HalfSquaredError":
+                raise NotImplementedError("Only squared-error HistGradientBoosting is supported")
+            tables = [_hgb_tree_table(p[0]) for p in estimator._predictors]
+            depth = max(int(p[0].nodes["depth"].max()) for p in estimator._predictors)
+            arrays.update({f"{name}.{k}": v for k, v in stack_tables(tables, depth).items()})
+            arrays[f"{name}.baseline"] = np.float64(np.ravel(estimator._baseline_prediction)[0])
+            members.append({"name": name, "kind": "forest", "float32": False, "weight": weight})
+        else:
+            raise NotImplementedError(f"Unsupported estimator: {kind}")
+
+    meta = {
+        "feature_names_in": [str(c) for c in pipeline.feature_names_in_],
+        "segments": segments,
+        "members": members,
+    }
+    return FlatModel(meta, arrays)
+
+# === Evaluator ===
+
+class FlatModel:
+    """Numpy-only evaluator for a compiled glucose pipeline.
+
+    Exposes `feature_names_in_` and `predict` so it can stand in for the
+    sklearn pipeline inside the service.
+    """
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.arrays = arrays
+        self.feature_names_in_ = np.asarray(meta["feature_names_in"], dtype=object)
+        self._members = []
+        for member in meta["members"]:
+            prefix = member["name"] + "."
+            params = {k[len(prefix):]: v for k, v in arrays.items() if k.startswith(prefix)}
+            if member["kind"] == "forest":
+                params = {**prepare_forest(params), "baseline": params.get("baseline", 0.0)}
+            self._members.append((member, params))
+
+    def transform(self, X):
+        """Apply the compiled ColumnTransformer to a DataFrame."""
+        blocks = []
+        offset = 0
+        for segment in self.meta["segments"]:
+            if segment["kind"] == "onehot":
+                values = X[segment["column"]].to_numpy(dtype=object).astype(str)
+                blocks.append(values[:, None] == np.asarray(segment["categories"])[None, :])
+            else:
+                cols = segment["columns"]
+                values = X[cols].to_numpy(dtype=np.float64)
+                mean = self.arrays["num_mean"][offset:offset + len(cols)]
+                scale = self.arrays["num_scale"][offset:offset + len(cols)]
+                blocks.append((values - mean) / scale)
+                offset += len(cols)
+        return np.hstack([b.astype(np.float64) for b in blocks])
+
+    def predict(self, X):
+        Xt = self.transform(X)
+        Xt32 = Xt.astype(np.float32).astype(np.float64)
+        pred = np.zeros(Xt.shape[0])
+        for member, params in self._members:
+            if member["kind"] == "linear":
+                out = Xt @ params["coef"] + params["intercept"]
+            else:
+                out = evaluate_trees(Xt32 if member["float32"] else Xt, params)[0] + params["baseline"]
+            pred += member["weight"] * out
+        return pred
+
+    def save(self, path):
+        np.savez_compressed(path, meta=np.asarray(json.dumps(self.meta)), **self.arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            arrays = {k: data[k] for k in data.files if k != "meta"}
+        return cls(meta, arrays)
+
+def export_flat_model(pipeline, path):
+    """Compile a fitted pipeline and write the flat artifact to `path`."""
+    flat = compile_pipeline(pipeline)
+    flat.save(path)
+    return flat
+
+# === CLI ===
+
+def _random_inputs(flat, n_rows, seed=0):
+    """Synthetic model inputs covering every categorical level."""
+    import pandas as pd
+
+    rng = np.random.default_rng(seed)
+    X = pd.DataFrame(
+        rng.normal(size=(n_rows, len(flat.feature_names_in_))),
+        columns=flat.feature_names_in_
+    )
+    for segment in flat.meta["segments"]:
+        if segment["kind"] == "onehot":
+            X[segment["column"]] = rng.choice(segment["categories"], size=n_rows)
+    return X
+
+def _time_per_call(fn, X, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(X)
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the glucose pipeline to a flat artifact")
+    parser.add_argument("model", nargs="?", default="glucose_predictor_local.pkl")
+    parser.add_argument("output", nargs="?", default="glucose_predictor_flat.npz")
+    parser.add_argument("--check", action="store_true", help="Verify parity and report latency")
+    args = parser.parse_args()
+
+    import joblib
+
+    pipeline = joblib.load(args.model)
+    flat = export_flat_model(pipeline, args.output)
+    flat = FlatModel.load(args.output)
+    print(f"[✓] Exported {args.output} "
+          f"({os.path.getsize(args.output) / 1024:.0f} KB vs {os.path.getsize(args.model) / 1024:.0f} KB pickle)")
+
+    if args.check:
+        X = _random_inputs(flat, 2000)
+        max_err = np.abs(pipeline.predict(X) - flat.predict(X)).max()
+        print(f"Max abs difference on {len(X)} rows: {max_err:.2e}")
+        for n_rows, repeat in ((1, 50), (1000, 5)):
+            batch = X.iloc[:n_rows]
+            t_sk = _time_per_call(pipeline.predict, batch, repeat)
+            t_flat = _time_per_call(flat.predict, batch, repeat)
+            print(f"rows={n_rows:5d} sklearn={t_sk * 1e3:8.2f} ms  flat={t_flat * 1e3:8.2f} ms")
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,18 @@
+# RUN: python model.py            (logs to the MLflow server at localhost:5000)
+#      python model.py --local    (logs to a local ./mlruns file store)
+
+import argparse
+import hashlib
+import json
+import os
+import time
+import joblib
 import pandas as pd
 import numpy as np
 import mlflow
 import mlflow.sklearn
+from joblib import Parallel, delayed
+from sklearn.base import clone
 from sklearn.model_selection import train_test_split
 from sklearn.pipeline import Pipeline
 from sklearn.compose import ColumnTransformer
@@ -9,65 +20,143 @@ from sklearn.preprocessing import OneHotEncoder, StandardScaler
 from sklearn.linear_model import ElasticNet
 from sklearn.ensemble import RandomForestRegressor, HistGradientBoostingRegressor, VotingRegressor
 from sklearn.metrics import r2_score, mean_squared_error
+from flat_model import export_flat_model
 
-mlflow.set_tracking_uri("http://localhost:5000")
-
-# === Load Data ===
-results = pd.read_csv("../Data-Processing/Dataset/user_model_results.csv")
-top_subjects = results.sort_values(by="r2_30min", ascending=False).head(10)["subject"].tolist()
-df = pd.read_csv("../Data-Processing/Dataset/combined_features_glucose.csv")
-df = df[df["subject"].isin(top_subjects)]
+TRACKING_URI = "http://localhost:5000"
+DATA_DIR = "../Data-Processing/Dataset"
+CACHE_DIR = ".cache"
+MODEL_DIR = "models"
 
-X = df.drop(columns=["glucose_spike_30min", "glucose_spike_60min", "subject"])
-y = df["glucose_spike_60min"]
-
-categorical_cols = ["clinical_Gender", "meal_category"]
-preprocessor = ColumnTransformer(
-    transformers=[
-        ("cat", OneHotEncoder(handle_unknown="ignore"), categorical_cols),
-        ("scale", StandardScaler(), X.select_dtypes(include="number").columns.tolist())
-    ],
-    remainder="passthrough"
-)
+# Row selection and train/test split; part of the preprocessing cache key
+SPLIT_PARAMS = {
+    "top_subjects": 10,         # best-modelled subjects by r2_30min
+    "target": "glucose_spike_60min",
+    "test_size": 0.25,
+    "random_state": 42,
+}
 
 # === Model Versions ===
+# Tree learners use every available core (RF via n_jobs, HGB via OpenMP) when
+# versions are trained one at a time. In parallel, each worker's RF runs
+# single-threaded and joblib caps the OpenMP threads of its worker processes.
 model_versions = {
     "v1": {
         "enet": ElasticNet(alpha=0.1, l1_ratio=0.5),
-        "rf": RandomForestRegressor(n_estimators=100, random_state=42),
+        "rf": RandomForestRegressor(n_estimators=100, random_state=42, n_jobs=-1),
         "hgb": HistGradientBoostingRegressor(random_state=42),
     },
     "v2": {
         "enet": ElasticNet(alpha=0.05, l1_ratio=0.8),
-        "rf": RandomForestRegressor(n_estimators=300, max_depth=10, min_samples_leaf=3, random_state=42),
+        "rf": RandomForestRegressor(n_estimators=300, max_depth=10, min_samples_leaf=3, random_state=42, n_jobs=-1),
         "hgb": HistGradientBoostingRegressor(max_iter=300, learning_rate=0.03, max_depth=7, random_state=42),
     },
     "v3": {
         "enet": ElasticNet(alpha=0.03, l1_ratio=0.85),
-        "rf": RandomForestRegressor(n_estimators=300, max_depth=12, min_samples_leaf=4, random_state=42),
+        "rf": RandomForestRegressor(n_estimators=300, max_depth=12, min_samples_leaf=4, random_state=42, n_jobs=-1),
         "hgb": HistGradientBoostingRegressor(learning_rate=0.02, max_iter=500, max_depth=6, min_samples_leaf=5, random_state=42),
     }
 }
 
-# === Train + Log Each Version ===
-X_train, X_test, y_train, y_test = train_test_split(X, y, test_size=0.25, random_state=42)
+# === Data Loading + Cached Preprocessing ===
 
-for version, models in model_versions.items():
-    enet, rf, hgb = models["enet"], models["rf"], models["hgb"]
-    ensemble = VotingRegressor(estimators=[("enet", enet), ("rf", rf), ("hgb", hgb)])
+def cache_key(paths, params):
+    """Hash of the input files' contents and the selection/split parameters.
 
-    pipeline = Pipeline([
-        ("preprocessor", preprocessor),
-        ("model", ensemble)
-    ])
+    Any change to either gives a new cache directory, so edited data or a
+    different split never reuses stale features.
+    """
+    digest = hashlib.sha256(json.dumps(params, sort_keys=True).encode("utf-8"))
+    for path in paths:
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1 << 20), b""):
+                digest.update(chunk)
+    return digest.hexdigest()[:16]
 
-    with mlflow.start_run(run_name=f"VotingRegressor_{version}"):
-        pipeline.fit(X_train, y_train)
-        preds = pipeline.predict(X_test)
+def load_data(data_dir, top_subjects=10, target="glucose_spike_60min"):
+    """Load the glucose training table restricted to the best-modelled subjects."""
+    results = pd.read_csv(os.path.join(data_dir, "user_model_results.csv"))
+    subjects = results.sort_values(by="r2_30min", ascending=False).head(top_subjects)["subject"].tolist()
+    df = pd.read_csv(os.path.join(data_dir, "combined_features_glucose.csv"))
+    df = df[df["subject"].isin(subjects)]
+
+    X = df.drop(columns=["glucose_spike_30min", "glucose_spike_60min", "subject"])
+    y = df[target]
+    return X, y
+
+def build_preprocessor(X):
+    categorical_cols = ["clinical_Gender", "meal_category"]
+    return ColumnTransformer(
+        transformers=[
+            ("cat", OneHotEncoder(handle_unknown="ignore"), categorical_cols),
+            ("scale", StandardScaler(), X.select_dtypes(include="number").columns.tolist())
+        ],
+        remainder="passthrough"
+    )
+
+def load_preprocessed(data_dir, cache_dir, params=SPLIT_PARAMS):
+    """Return the fitted preprocessor and transformed train/test split.
+
+    The split and the fitted ColumnTransformer are computed once per distinct
+    input data and `params` (see SPLIT_PARAMS) and stored as .npy/.joblib
+    under `cache_dir/<key>/`, so repeated runs skip CSV parsing and
+    preprocessing entirely.
+    """
+    sources = [
+        os.path.join(data_dir, "user_model_results.csv"),
+        os.path.join(data_dir, "combined_features_glucose.csv")
+    ]
+    key_dir = os.path.join(cache_dir, cache_key(sources, params))
+    names = ["X_train", "X_test", "y_train", "y_test"]
+
+    if os.path.exists(os.path.join(key_dir, "preprocessor.joblib")):
+        print(f"[cache] Using preprocessed data from {key_dir}")
+        arrays = [np.load(os.path.join(key_dir, f"{name}.npy")) for name in names]
+        return (joblib.load(os.path.join(key_dir, "preprocessor.joblib")), *arrays)
+
+    X, y = load_data(data_dir, params["top_subjects"], params["target"])
+    X_train, X_test, y_train, y_test = train_test_split(
+        X, y, test_size=params["test_size"], random_state=params["random_state"]
+    )
+    preprocessor = build_preprocessor(X).fit(X_train)
+    arrays = [
+        np.asarray(preprocessor.transform(X_train), dtype=np.float64),
+        np.asarray(preprocessor.transform(X_test), dtype=np.float64),
+        y_train.to_numpy(dtype=np.float64),
+        y_test.to_numpy(dtype=np.float64)
+    ]
+
+    os.makedirs(key_dir, exist_ok=True)
+    for name, array in zip(names, arrays):
+        np.save(os.path.join(key_dir, f"{name}.npy"), array)
+    joblib.dump(preprocessor, os.path.join(key_dir, "preprocessor.joblib"))
+    print(f"[cache] Stored preprocessed data in {key_dir}")
+    return (preprocessor, *arrays)
+
+# === Training ===
 
-        r2 = r2_score(y_test, preds)
-        rmse = np.sqrt(mean_squared_error(y_test, preds))
+def train_version(version, models, X_train, y_train, X_test, y_test, rf_jobs=-1):
+    """Fit one VotingRegressor version on the preprocessed matrix.
 
+    `rf_jobs` overrides the forest's n_jobs (1 when versions are trained in
+    parallel, so workers do not oversubscribe the cores).
+    """
+    start = time.perf_counter()
+    rf = clone(models["rf"]).set_params(n_jobs=rf_jobs)
+    ensemble = VotingRegressor(estimators=[("enet", models["enet"]), ("rf", rf), ("hgb", models["hgb"])])
+    ensemble.fit(X_train, y_train)
+    preds = ensemble.predict(X_test)
+
+    metrics = {
+        "r2": r2_score(y_test, preds),
+        "rmse": np.sqrt(mean_squared_error(y_test, preds)),
+        "train_seconds": time.perf_counter() - start
+    }
+    return version, ensemble, metrics
+
+def log_version(version, models, pipeline, metrics):
+    """Log one trained version to MLflow and write its local serving artifacts."""
+    enet, rf, hgb = models["enet"], models["rf"], models["hgb"]
+    with mlflow.start_run(run_name=f"VotingRegressor_{version}"):
         # Log parameters
         mlflow.log_param("version", version)
         mlflow.log_param("enet_alpha", enet.alpha)
@@ -80,9 +169,66 @@ for version, models in model_versions.items():
         mlflow.log_param("hgb_max_depth", getattr(hgb, "max_depth", None))
 
         # Log metrics
-        mlflow.log_metric("r2", r2)
-        mlflow.log_metric("rmse", rmse)
+        mlflow.log_metric("r2", metrics["r2"])
+        mlflow.log_metric("rmse", metrics["rmse"])
+        mlflow.log_metric("train_seconds", metrics["train_seconds"])
 
         # Save model
         mlflow.sklearn.log_model(pipeline, artifact_path=f"model_{version}")
-        print(f"[✓] Version {version} logged | R² = {r2:.3f}, RMSE = {rmse:.3f}")
+
+        # Write local artifacts for the service's model registry (GLUCOSE_MODEL_DIR),
+        # including compact tree tables for the numpy-only serving engine
+        os.makedirs(MODEL_DIR, exist_ok=True)
+        joblib.dump(pipeline, os.path.join(MODEL_DIR, f"{version}.pkl"))
+        flat_path = os.path.join(MODEL_DIR, f"{version}-flat.npz")
+        export_flat_model(pipeline, flat_path)
+        mlflow.log_artifact(flat_path, artifact_path=f"model_{version}")
+
+def main():
+    parser = argparse.ArgumentParser(description="Train and log the glucose model versions")
+    parser.add_argument("--local", action="store_true",
+                        help="Log to a local ./mlruns file store instead of the MLflow server")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--cache-dir", default=CACHE_DIR)
+    parser.add_argument("--versions", nargs="+", default=list(model_versions), choices=list(model_versions))
+    parser.add_argument("--jobs", type=int, default=-1,
+                        help="Versions trained in parallel (-1 = one process per version, up to the core count)")
+    parser.add_argument("--top-subjects", type=int, default=SPLIT_PARAMS["top_subjects"])
+    parser.add_argument("--test-size", type=float, default=SPLIT_PARAMS["test_size"])
+    parser.add_argument("--split-seed", type=int, default=SPLIT_PARAMS["random_state"])
+    args = parser.parse_args()
+    params = {**SPLIT_PARAMS, "top_subjects": args.top_subjects, "test_size": args.test_size,
+              "random_state": args.split_seed}
+
+    mlflow.set_tracking_uri("file:" + os.path.abspath("mlruns") if args.local else TRACKING_URI)
+
+    wall_start = time.perf_counter()
+    preprocessor, X_train, X_test, y_train, y_test = load_preprocessed(args.data_dir, args.cache_dir, params)
+    prep_seconds = time.perf_counter() - wall_start
+
+    n_jobs = min(len(args.versions), os.cpu_count() or 1) if args.jobs == -1 else args.jobs
+    rf_jobs = 1 if n_jobs != 1 else -1
+    train_start = time.perf_counter()
+    trained = Parallel(n_jobs=n_jobs)(
+        delayed(train_version)(version, model_versions[version], X_train, y_train, X_test, y_test, rf_jobs)
+        for version in args.versions
+    )
+    train_seconds = time.perf_counter() - train_start
+
+    # === Log Each Version ===
+    for version, ensemble, metrics in trained:
+        # Preprocessor and ensemble are already fitted; the pipeline only chains them
+        pipeline = Pipeline([
+            ("preprocessor", preprocessor),
+            ("model", ensemble)
+        ])
+        log_version(version, model_versions[version], pipeline, metrics)
+        print(f"[✓] Version {version} logged | R² = {metrics['r2']:.3f}, RMSE = {metrics['rmse']:.3f}, "
+              f"fit = {metrics['train_seconds']:.1f}s")
+
+    print(f"Preprocessing: {prep_seconds:.1f}s | "
+          f"Training {len(trained)} versions ({n_jobs} parallel): {train_seconds:.1f}s | "
+          f"Total wall-clock incl. logging: {time.perf_counter() - wall_start:.1f}s")
+
+if __name__ == "__main__":
+    main()
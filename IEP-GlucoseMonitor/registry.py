@@ -0,0 +1,150 @@
+# In-service registry of preloaded glucose model versions.
+
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import joblib
+import numpy as np
+from prometheus_client import Counter, Histogram
+
+from flat_model import FlatModel
+
+# === Monitoring Metrics ===
+MODEL_LATENCY = Histogram(
+    "glucose_monitor_model_latency_seconds",
+    "Model predict latency in seconds per version",
+    ["version", "role"],
+    buckets=(0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+)
+MODEL_PREDICTION = Histogram(
+    "glucose_monitor_model_prediction",
+    "Distribution of predicted 60-minute glucose spikes per version",
+    ["version", "role"],
+    buckets=(0, 10, 20, 30, 40, 50, 60, 80, 100, 150)
+)
+SHADOW_ABS_DIFF = Histogram(
+    "glucose_monitor_shadow_abs_diff",
+    "Absolute difference between active and shadow predictions",
+    ["active", "shadow"],
+    buckets=(0.1, 0.5, 1, 2, 5, 10, 20, 50)
+)
+SHADOW_DROPPED = Counter(
+    "glucose_monitor_shadow_dropped_total",
+    "Shadow scoring jobs dropped because the shadow queue was full"
+)
+
+MODEL_SUFFIXES = (".pkl", ".npz")
+
+def load_model_file(path):
+    """Load a sklearn pipeline (.pkl) or a compiled flat model (.npz)."""
+    if path.endswith(".npz"):
+        return FlatModel.load(path)
+    return joblib.load(path)
+
+def align_features(model, input_df):
+    """Select the model's input columns, filling any it expects but was not given."""
+    return input_df.reindex(columns=model.feature_names_in_, fill_value=0)
+
+class ModelRegistry:
+    """Holds several preloaded model versions and routes predictions to the active one.
+
+    The active and shadow selections live in one tuple that is replaced as a
+    whole, so a request always sees a consistent pair while versions are
+    swapped. Shadow scoring runs on a single background worker and never
+    delays or alters the response.
+    """
+
+    def __init__(self, max_shadow_pending=32):
+        self._models = {}
+        self._selection = (None, None)
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="shadow")
+        self._max_shadow_pending = max_shadow_pending
+        self._shadow_pending = 0
+
+    def register(self, version, model):
+        with self._lock:
+            self._models = {**self._models, version: model}
+
+    def load_dir(self, model_dir):
+        """Load every model artifact in `model_dir`, keyed by file stem."""
+        loaded = []
+        for name in sorted(os.listdir(model_dir)):
+            if name.endswith(MODEL_SUFFIXES):
+                version = os.path.splitext(name)[0]
+                self.register(version, load_model_file(os.path.join(model_dir, name)))
+                loaded.append(version)
+        return loaded
+
+    def versions(self):
+        return sorted(self._models)
+
+    @property
+    def active_version(self):
+        return self._selection[0]
+
+    @property
+    def shadow_version(self):
+        return self._selection[1]
+
+    def activate(self, version):
+        """Atomically make `version` the model that answers requests."""
+        with self._lock:
+            if version not in self._models:
+                raise KeyError(f"Unknown model version: {version}")
+            shadow = self._selection[1]
+            self._selection = (version, None if shadow == version else shadow)
+
+    def set_shadow(self, version):
+        """Score live traffic with `version` in the background (None disables)."""
+        with self._lock:
+            if version is not None and version not in self._models:
+                raise KeyError(f"Unknown model version: {version}")
+            active = self._selection[0]
+            self._selection = (active, None if version == active else version)
+
+    def predict(self, input_df):
+        """Predict with the active version and queue the shadow version, if any."""
+        active, shadow = self._selection
+        models = self._models
+        preds = self._timed_predict(active, models[active], input_df, "active")
+        if shadow is not None:
+            self._submit_shadow(shadow, models[shadow], active, input_df, preds)
+        return preds
+
+    def _timed_predict(self, version, model, input_df, role):
+        start = time.perf_counter()
+        preds = np.asarray(model.predict(align_features(model, input_df)))
+        MODEL_LATENCY.labels(version, role).observe(time.perf_counter() - start)
+        # Cap per-call observations so large planner batches stay cheap to record
+        for value in preds[:100]:
+            MODEL_PREDICTION.labels(version, role).observe(float(value))
+        return preds
+
+    def _submit_shadow(self, version, model, active, input_df, active_preds):
+        with self._lock:
+            if self._shadow_pending >= self._max_shadow_pending:
+                SHADOW_DROPPED.inc()
+                return
+            self._shadow_pending += 1
+        self._executor.submit(self._run_shadow, version, model, active, input_df, active_preds)
+
+    def _run_shadow(self, version, model, active, input_df, active_preds):
+        try:
+            preds = self._timed_predict(version, model, input_df, "shadow")
+            for diff in np.abs(preds - active_preds)[:100]:
+                SHADOW_ABS_DIFF.labels(active, version).observe(float(diff))
+        except Exception as e:
+            print(f"Shadow scoring with {version} failed: {str(e)}")
+        finally:
+            with self._lock:
+                self._shadow_pending -= 1
+
+    def status(self):
+        return {
+            "active": self.active_version,
+            "shadow": self.shadow_version,
+            "versions": self.versions()
+        }
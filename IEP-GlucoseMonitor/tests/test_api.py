@@ -1,13 +1,55 @@
 import pytest
 from httpx import AsyncClient, ASGITransport
-import os, sys
+import os, sys, json, csv, io
+import joblib
 
-sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SERVICE_DIR)
 from app import app
+from microbiome_io import HeaderCache
 
 TEST_BIO = os.path.join(os.path.dirname(__file__), "test_bio.csv")
 TEST_MICRO = os.path.join(os.path.dirname(__file__), "test_microbe.csv")
 
+MEAL_FORM = {
+    "protein_pct": "30",
+    "fat_pct": "25",
+    "carbs_pct": "45",
+    "sugar_risk": "1",
+    "refined_carb": "0",
+    "meal_category": "Lunch",
+}
+
+@pytest.fixture
+def model_bacteria(monkeypatch, tmp_path):
+    """Align microbiome inputs to the bundled model's own bacteria.
+
+    Without S3 the service has no top-bacteria list and every microbiome
+    input collapses to an empty block; this serves the model's bacteria
+    instead, with a taxonomy ("model") that uses the same names.
+    """
+    import microbiome_io
+    service = sys.modules["app"]
+    features = joblib.load(os.path.join(SERVICE_DIR, "glucose_predictor_local.pkl")).feature_names_in_
+    skip = set(service.CLINICAL_COLS) | set(service.MEAL_COLS)
+    bacteria = [f for f in features if f not in skip]
+    monkeypatch.setattr(service, "top_bacteria", bacteria)
+    monkeypatch.setattr(service, "header_cache", HeaderCache(bacteria))
+    (tmp_path / "model.json").write_text(json.dumps({"version": "model", "taxa": ["Unrelated taxon "] + bacteria}))
+    monkeypatch.setattr(microbiome_io, "TAXONOMY_DIR", str(tmp_path))
+    microbiome_io.load_taxonomy.cache_clear()
+    yield bacteria
+    microbiome_io.load_taxonomy.cache_clear()
+
+def micro_upload(bacteria, present, cells=None):
+    """One-subject microbiome CSV over `bacteria` plus an unrelated taxon."""
+    out = io.StringIO()
+    writer = csv.writer(out, lineterminator="\n")
+    writer.writerow(["subject", "Unrelated taxon "] + list(bacteria))
+    row = cells or [int(name in present) for name in bacteria]
+    writer.writerow(["s0", 1] + row)
+    return out.getvalue().encode("utf-8")
+
 @pytest.mark.asyncio
 async def test_health_check():
     transport = ASGITransport(app=app)
@@ -41,3 +83,203 @@ async def test_predict_glucose():
 
     assert response.status_code == 200
     assert "glucose_spike_60min" in response.json()
+
+@pytest.mark.asyncio
+async def test_plan_meals_grid():
+    if not (os.path.exists(TEST_BIO) and os.path.exists(TEST_MICRO)):
+        pytest.skip("CSV test files not available")
+
+    grid = {
+        "protein_pct": [10, 20, 30],
+        "fat_pct": [10, 20, 30],
+        "sugar_risk": [0, 1],
+        "meal_category": ["breakfast", "lunch"],
+    }
+    with open(TEST_BIO, "rb") as bio, open(TEST_MICRO, "rb") as micro:
+        files = {
+            "bio_file": ("bio.csv", bio, "text/csv"),
+            "micro_file": ("micro.csv", micro, "text/csv")
+        }
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            response = await ac.post("/plan-meals", data={"grid": json.dumps(grid), "top_k": "5"}, files=files)
+
+    assert response.status_code == 200
+    json_data = response.json()
+    assert json_data["n_candidates"] == 36
+    spikes = [c["glucose_spike_60min"] for c in json_data["ranked"]]
+    assert len(spikes) == 5
+    assert spikes == sorted(spikes)
+    for c in json_data["ranked"]:
+        assert c["protein_pct"] + c["fat_pct"] + c["carbs_pct"] == 100
+
+@pytest.mark.asyncio
+async def test_plan_meals_requires_candidates():
+    with open(TEST_BIO, "rb") as bio, open(TEST_MICRO, "rb") as micro:
+        files = {
+            "bio_file": ("bio.csv", bio, "text/csv"),
+            "micro_file": ("micro.csv", micro, "text/csv")
+        }
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            response = await ac.post("/plan-meals", files=files)
+
+    assert response.status_code == 400
+
+@pytest.mark.asyncio
+async def test_plan_meals_rejects_bad_candidates():
+    # 10^12 combinations: rejected from the option counts, before the product is built
+    huge = {col: list(range(100)) for col in ("protein_pct", "fat_pct", "carbs_pct", "sugar_risk", "refined_carb")}
+    huge["meal_category"] = ["lunch"] * 100
+    bad_category = [{"protein_pct": 30, "fat_pct": 25, "carbs_pct": 45,
+                     "sugar_risk": 0, "refined_carb": 0, "meal_category": 3}]
+    bad_macro = {"protein_pct": ["a lot"], "fat_pct": [20], "meal_category": ["lunch"]}
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        responses = []
+        for form in ({"grid": json.dumps(huge)}, {"candidates": json.dumps(bad_category)},
+                     {"grid": json.dumps(bad_macro)}):
+            with open(TEST_BIO, "rb") as bio:
+                responses.append(await ac.post("/plan-meals", data=form,
+                                               files={"bio_file": ("bio.csv", bio, "text/csv")}))
+
+    assert [r.status_code for r in responses] == [400, 400, 400]
+    assert "Too many candidates (1000000000000)" in responses[0].json()["detail"]
+    assert "meal_category" in responses[1].json()["detail"]
+    assert "protein_pct" in responses[2].json()["detail"]
+
+@pytest.mark.asyncio
+async def test_model_registry_swap_and_shadow():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        status = (await ac.get("/models")).json()
+        assert status["active"] in status["versions"]
+        original = status["active"]
+
+        missing = await ac.post("/models/activate", data={"version": "does-not-exist"})
+        assert missing.status_code == 404
+
+        other = [v for v in status["versions"] if v != original]
+        if not other:
+            pytest.skip("Only one model version loaded")
+
+        res = await ac.post("/models/shadow", data={"version": other[0]})
+        assert res.json()["shadow"] == other[0]
+
+        with open(TEST_BIO, "rb") as bio, open(TEST_MICRO, "rb") as micro:
+            files = {
+                "bio_file": ("bio.csv", bio, "text/csv"),
+                "micro_file": ("micro.csv", micro, "text/csv")
+            }
+            form_data = {"protein_pct": "30", "fat_pct": "25", "carbs_pct": "45",
+                         "sugar_risk": "1", "refined_carb": "0", "meal_category": "Lunch"}
+            before = (await ac.post("/predict-glucose", data=form_data, files=files)).json()
+
+            res = await ac.post("/models/activate", data={"version": other[0]})
+            assert res.json()["active"] == other[0]
+            assert res.json()["shadow"] is None
+
+            bio.seek(0)
+            micro.seek(0)
+            after = (await ac.post("/predict-glucose", data=form_data, files=files)).json()
+
+        await ac.post("/models/activate", data={"version": original})
+
+    assert before["glucose_spike_60min"] == pytest.approx(after["glucose_spike_60min"], abs=0.01)
+
+@pytest.mark.asyncio
+async def test_predict_glucose_sparse_microbiome(model_bacteria):
+    present = model_bacteria[::2]
+    # Flipping this taxon moves the bundled model's prediction
+    changed = [name for name in present if name != model_bacteria[4]]
+
+    async def predict(ac, **inputs):
+        with open(TEST_BIO, "rb") as bio:
+            files = {"bio_file": ("bio.csv", bio, "text/csv")}
+            if "micro" in inputs:
+                files["micro_file"] = ("micro.csv", inputs.pop("micro"), "text/csv")
+            return await ac.post("/predict-glucose", data={**MEAL_FORM, **inputs}, files=files)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        dense = await predict(ac, micro=micro_upload(model_bacteria, present))
+        sparse = await predict(ac, micro_taxa=json.dumps(present), taxonomy_version="model")
+        by_index = await predict(ac, micro_taxa=json.dumps([1 + model_bacteria.index(n) for n in present]),
+                                 taxonomy_version="model")
+        other = await predict(ac, micro_taxa=json.dumps(changed), taxonomy_version="model")
+        unknown = await predict(ac, micro_taxa=json.dumps(["Not a taxon"]), taxonomy_version="model")
+        missing = await predict(ac)
+
+    assert dense.status_code == sparse.status_code == 200
+    assert sparse.json() == dense.json()
+    assert by_index.json() == dense.json()
+    assert other.json()["glucose_spike_60min"] != pytest.approx(dense.json()["glucose_spike_60min"], abs=0.01)
+    assert unknown.status_code == 400
+    assert missing.status_code == 400
+
+@pytest.mark.asyncio
+async def test_predict_glucose_from_feature_store(model_bacteria, monkeypatch, tmp_path):
+    from feature_store import FeatureStore
+
+    present = model_bacteria[::2]
+    # Absent taxa left empty, as some exports write them; both paths read them as 0
+    cells = [1 if name in present else ("" if i % 3 else 0) for i, name in enumerate(model_bacteria)]
+    upload = micro_upload(model_bacteria, present, cells)
+    changed = micro_upload(model_bacteria, [name for name in present if name != model_bacteria[4]])
+
+    store = FeatureStore(str(tmp_path / "features.db"))
+    version = store.put_csv(42, upload)
+    assert store.put_csv(42, changed) == version + 1
+    monkeypatch.setattr(sys.modules["app"], "feature_store", store)
+
+    async def predict(ac, micro=None, **form):
+        with open(TEST_BIO, "rb") as bio:
+            files = {"bio_file": ("bio.csv", bio, "text/csv")}
+            if micro is not None:
+                files["micro_file"] = ("micro.csv", micro, "text/csv")
+            return await ac.post("/predict-glucose", data={**MEAL_FORM, **form}, files=files)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        dense = await predict(ac, micro=upload)
+        stored = await predict(ac, profile_user_id="42", profile_version=str(version))
+        latest = await predict(ac, profile_user_id="42")
+        unknown = await predict(ac, profile_user_id="7")
+
+    assert dense.status_code == stored.status_code == 200
+    assert stored.json() == dense.json()
+    assert latest.json()["glucose_spike_60min"] != pytest.approx(dense.json()["glucose_spike_60min"], abs=0.01)
+    assert unknown.status_code == 404
+
+@pytest.mark.asyncio
+async def test_stage_latency_histograms():
+    from prometheus_client import REGISTRY
+
+    def stage_count(stage):
+        return REGISTRY.get_sample_value(
+            "glucose_monitor_stage_duration_seconds_count",
+            {"endpoint": "/predict-glucose", "stage": stage}
+        ) or 0
+
+    before = {stage: stage_count(stage) for stage in ("parse", "preprocess", "inference")}
+    with open(TEST_BIO, "rb") as bio, open(TEST_MICRO, "rb") as micro:
+        form_data = {
+            "protein_pct": "30", "fat_pct": "25", "carbs_pct": "45",
+            "sugar_risk": "1", "refined_carb": "0", "meal_category": "Lunch",
+        }
+        files = {
+            "bio_file": ("bio.csv", bio, "text/csv"),
+            "micro_file": ("micro.csv", micro, "text/csv")
+        }
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://test") as ac:
+            response = await ac.post("/predict-glucose", data=form_data, files=files)
+
+    assert response.status_code == 200
+    for stage, count in before.items():
+        assert stage_count(stage) > count
+    assert REGISTRY.get_sample_value(
+        "glucose_monitor_http_request_duration_seconds_count",
+        {"endpoint": "/predict-glucose", "method": "POST", "status": "200"}
+    ) >= 1
@@ -0,0 +1,21 @@
+import numpy as np
+import joblib
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from flat_model import compile_pipeline, FlatModel, _random_inputs
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "glucose_predictor_local.pkl")
+
+def test_flat_model_matches_pipeline(tmp_path):
+    pipeline = joblib.load(MODEL_PATH)
+    flat = compile_pipeline(pipeline)
+    X = _random_inputs(flat, 300, seed=1)
+    np.testing.assert_allclose(flat.predict(X), pipeline.predict(X), rtol=0, atol=1e-8)
+
+    # Round trip through the artifact, including single-row inputs
+    path = tmp_path / "flat.npz"
+    flat.save(path)
+    loaded = FlatModel.load(path)
+    np.testing.assert_allclose(loaded.predict(X.iloc[:1]), pipeline.predict(X.iloc[:1]), rtol=0, atol=1e-8)
+    np.testing.assert_allclose(loaded.predict(X), pipeline.predict(X), rtol=0, atol=1e-8)
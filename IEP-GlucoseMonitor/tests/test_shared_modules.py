@@ -0,0 +1,64 @@
+import ast
+import filecmp
+import os
+
+import pytest
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+REPO_DIR = os.path.dirname(SERVICE_DIR)
+
+# Every service is its own Docker build context, so shared modules are copied
+# into each one. This service holds the reference copy of each file.
+COPIES = {
+    "tree_tables.py": ["IEP-MicrobiomAnalyzer"],
+    "feature_store.py": ["EEP-NutritionController", "IEP-MicrobiomAnalyzer"],
+    "stage_metrics.py": ["EEP-NutritionController", "IEP-FoodAnalyzer",
+                         "IEP-MicrobiomAnalyzer", "IEP-NutritionPredictor"],
+    "tracing.py": ["EEP-NutritionController", "IEP-FoodAnalyzer",
+                   "IEP-MicrobiomAnalyzer", "IEP-NutritionPredictor"],
+    os.path.join("taxonomy", "v1.json"): ["IEP-MicrobiomAnalyzer"],
+}
+
+# microbiome_io.py is shared apart from how each service maps model features
+# onto the taxonomy; everything defined in both copies must stay the same.
+MICROBIOME_IO_SERVICE_SPECIFIC = {"Taxonomy.feature_index"}
+
+def _copy_path(service, name):
+    path = os.path.join(REPO_DIR, service, name)
+    if not os.path.exists(path):
+        pytest.skip(f"{service} is not part of this checkout")
+    return path
+
+def _definitions(path):
+    """ast dump of every top-level function/class and class method, by qualified name."""
+    with open(path, encoding="utf-8") as f:
+        tree = ast.parse(f.read())
+    found = {}
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.ClassDef)):
+            found[node.name] = ast.dump(node)
+        if isinstance(node, ast.ClassDef):
+            for item in node.body:
+                if isinstance(item, ast.FunctionDef):
+                    found[f"{node.name}.{item.name}"] = ast.dump(item)
+    return found
+
+@pytest.mark.parametrize("name,service", [
+    (name, service) for name, services in COPIES.items() for service in services
+])
+def test_shared_copy_is_identical(name, service):
+    reference = os.path.join(SERVICE_DIR, name)
+    assert filecmp.cmp(reference, _copy_path(service, name), shallow=False), (
+        f"{service}/{name} differs from IEP-GlucoseMonitor/{name}; change both copies"
+    )
+
+def test_microbiome_io_shared_definitions_match():
+    ours = _definitions(os.path.join(SERVICE_DIR, "microbiome_io.py"))
+    theirs = _definitions(_copy_path("IEP-MicrobiomAnalyzer", "microbiome_io.py"))
+    shared = set(ours) & set(theirs) - MICROBIOME_IO_SERVICE_SPECIFIC
+    # Classes holding a service-specific method are compared method by method
+    shared -= {name.split(".")[0] for name in MICROBIOME_IO_SERVICE_SPECIFIC}
+
+    assert "read_projected" in shared and "load_taxonomy" in shared
+    differing = sorted(name for name in shared if ours[name] != theirs[name])
+    assert differing == [], f"microbiome_io copies differ in: {differing}"
@@ -0,0 +1,77 @@
+# Array-backed tree tables for the numpy-only model artifacts: each tree is
+# normalised into node arrays and a whole forest is evaluated by vectorised,
+# fixed-depth descent. This file is the reference; IEP-MicrobiomAnalyzer has
+# its own Docker build context and keeps an identical copy, so change both
+# (IEP-GlucoseMonitor/tests/test_shared_modules.py fails when they differ).
+
+import numpy as np
+
+def tree_table(nodes, feature, threshold, left, right, missing_left, value):
+    """Normalise one tree into (feature, threshold, left, right, missing_left, value).
+
+    Leaves point to themselves with an infinite threshold so a fixed number of
+    descent steps can be applied to every tree without branching.
+    """
+    is_leaf = left < 0
+    idx = np.arange(nodes)
+    return {
+        "feature": np.where(is_leaf, 0, feature).astype(np.int32),
+        "threshold": np.where(is_leaf, np.inf, threshold).astype(np.float64),
+        "left": np.where(is_leaf, idx, left).astype(np.int32),
+        "right": np.where(is_leaf, idx, right).astype(np.int32),
+        "missing_left": np.asarray(missing_left).astype(bool),
+        "value": np.where(is_leaf, value, 0.0).astype(np.float64),
+    }
+
+def stack_tables(tables, depth):
+    """Concatenate per-tree tables into one forest with global node indices."""
+    offsets = np.cumsum([0] + [len(t["feature"]) for t in tables[:-1]])
+    forest = {"roots": offsets.astype(np.int32), "depth": np.int32(depth)}
+    for key in ("feature", "threshold", "missing_left", "value"):
+        forest[key] = np.concatenate([t[key] for t in tables])
+    for key in ("left", "right"):
+        forest[key] = np.concatenate([t[key] + off for t, off in zip(tables, offsets)]).astype(np.int32)
+    return forest
+
+def prepare_forest(forest):
+    """Index arrays in the layout used by `evaluate_trees` (intp, interleaved children).
+
+    An optional `groups` array (index of the first tree of each group) splits
+    the sum of leaf values; without it all trees form one group.
+    """
+    groups = forest["groups"] if "groups" in forest else np.zeros(1)
+    return {
+        "roots": forest["roots"].astype(np.intp),
+        "depth": int(forest["depth"]),
+        "feature": forest["feature"].astype(np.intp),
+        "threshold": forest["threshold"],
+        "missing_left": forest["missing_left"],
+        # children[2 * node + go_left] -> right child at even, left child at odd slots
+        "children": np.stack([forest["right"], forest["left"]], axis=1).ravel().astype(np.intp),
+        "value": forest["value"],
+        "groups": np.asarray(groups).astype(np.intp),
+    }
+
+def evaluate_trees(X, forest, block_rows=256):
+    """Per-group sums of leaf values for every row of X -> (groups, rows).
+
+    All trees descend one level per step, so the loop runs `depth` times
+    regardless of the number of trees. Rows are processed in blocks to keep
+    the (trees x rows) node matrix cache-resident.
+    """
+    n_rows, n_features = X.shape
+    has_nan = np.isnan(X).any()
+    out = np.empty((len(forest["groups"]), n_rows))
+    for start in range(0, n_rows, block_rows):
+        block = X[start:start + block_rows]
+        flat_x = block.ravel()
+        row_base = (np.arange(block.shape[0], dtype=np.intp) * n_features)[None, :]
+        node = np.repeat(forest["roots"][:, None], block.shape[0], axis=1)
+        for _ in range(forest["depth"]):
+            x = flat_x.take(row_base + forest["feature"].take(node))
+            go_left = x <= forest["threshold"].take(node)
+            if has_nan:
+                go_left = np.where(np.isnan(x), forest["missing_left"].take(node), go_left)
+            node = forest["children"].take(2 * node + go_left)
+        out[:, start:start + block_rows] = np.add.reduceat(forest["value"].take(node), forest["groups"], axis=0)
+    return out
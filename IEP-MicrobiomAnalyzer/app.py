@@ -1,20 +1,28 @@
 # uvicorn app:app --reload --port 8003
 
-from fastapi import FastAPI, File, UploadFile, Request
-import pandas as pd
-import joblib
-import re
-from sklearn.preprocessing import StandardScaler
-from io import StringIO, BytesIO
+from fastapi import FastAPI, File, UploadFile, Form, Request
+from fastapi.responses import StreamingResponse
+from typing import Optional
+import io
 import os
+import json
 import time
 
+from compact_model import CompactModel
+from feature_store import open_feature_store
+from microbiome_io import HeaderCache, clean_name, header_line, read_first_row, read_projected, sparse_feature_vector
 from prometheus_client import make_asgi_app, Counter, Summary, Gauge
+from stage_metrics import StageMetrics
+from tracing import Tracing
 
 # === Monitoring Metrics ===
 REQUEST_COUNT = Counter("microbiom_analyzer_request_count", "Total number of requests to Microbiom Analyzer")
 REQUEST_LATENCY = Summary("microbiom_analyzer_request_latency_seconds", "Request latency in seconds")
 LAST_GUT_HEALTH_PROB = Gauge("microbiom_analyzer_last_gut_health_probability", "Last predicted gut health probability")
+# Spans for requests and stages, continued across services via traceparent (see tracing.py)
+tracing = Tracing("microbiom-analyzer")
+# Latency by endpoint and by stage: feature_store_read, parse, preprocess (scaling), inference
+stage_metrics = StageMetrics("microbiom_analyzer", tracing)
 
 # === FastAPI App Setup ===
 app = FastAPI()
@@ -27,52 +35,174 @@ app.mount("/metrics", metrics_app)
 @app.middleware("http")
 async def prometheus_middleware(request: Request, call_next):
     REQUEST_COUNT.inc()
+    endpoint = stage_metrics.begin(request)
     start_time = time.time()
     response = await call_next(request)
-    REQUEST_LATENCY.observe(time.time() - start_time)
+    elapsed = time.time() - start_time
+    REQUEST_LATENCY.observe(elapsed)
+    stage_metrics.observe_request(endpoint, request.method, response.status_code, elapsed)
     return response
 
-# Load model data once at startup
+# Declared after prometheus_middleware so the request span wraps it and the stages
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    with tracing.server_span(request) as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+        return response
+
+@app.on_event("shutdown")
+def close_tracing():
+    tracing.shutdown()
+
+# Rows scored per vectorised call by /predict-gut-health-batch
+BATCH_CHUNK_ROWS = int(os.environ.get("BATCH_CHUNK_ROWS", 1000))
+
+# Load model data once at startup.
+# MICROBIOME_MODEL_ENGINE=compact serves the numpy-only artifact (see compact_model.py),
+# which applies the scaler itself and avoids importing sklearn/xgboost.
 try:
-    model_data = joblib.load("microbiome_model.pkl")
-    model = model_data['model']
-    feature_cols = model_data['features']
-    scaler = model_data.get('scaler', StandardScaler())
+    if os.environ.get("MICROBIOME_MODEL_ENGINE") == "compact":
+        model = CompactModel.load(os.environ.get("MICROBIOME_COMPACT_MODEL_PATH", "microbiome_model_compact.npz"))
+        feature_cols = model.features
+        scaler = None
+    else:
+        import joblib
+        from sklearn.preprocessing import StandardScaler
+
+        model_data = joblib.load("microbiome_model.pkl")
+        model = model_data['model']
+        feature_cols = model_data['features']
+        scaler = model_data.get('scaler', StandardScaler())
 except Exception as e:
     raise RuntimeError(f"Failed to load model: {str(e)}")
 
+# Upload headers resolved to feature positions, using the training-time name cleaning
+header_cache = HeaderCache(feature_cols, normalize=clean_name)
+
+# Profiles stored by the controller, fetched by (user_id, version) instead of re-uploaded
+feature_store = open_feature_store()
+
+def score_gut_health(X):
+    """Scale the aligned feature matrix and return P(good gut health) per row."""
+    with stage_metrics.stage("preprocess"):
+        X_scaled = scaler.transform(X) if scaler else X
+    with stage_metrics.stage("inference"):
+        return model.predict_proba(X_scaled)[:, 1]
+
+def gut_health_result(prob):
+    return {
+        "probability": round(float(prob), 3),
+        "prediction": "Good" if prob > 0.5 else "Bad"
+    }
+
 @app.post("/predict-gut-health-file")
-async def predict_gut_health(file: UploadFile = File(...)):
+async def predict_gut_health(
+    file: Optional[UploadFile] = File(None),
+    taxa: Optional[str] = Form(None),
+    taxonomy_version: str = Form("v1"),
+    profile_user_id: Optional[int] = Form(None),
+    profile_version: Optional[int] = Form(None)
+):
+    """Predict gut health from a dense microbiome CSV, a sparse list of present taxa,
+    or a profile in the feature store.
+
+    `taxa` is a JSON list of taxa names or indices in the given taxonomy
+    version; everything not listed is treated as absent. `profile_user_id`
+    (plus an optional `profile_version`, latest by default) references a
+    profile the controller has already stored.
+    """
     try:
-        # Read and parse the CSV file
-        contents = await file.read()
-        df = pd.read_csv(StringIO(contents.decode("utf-8")))
-        
-        # Clean column names by removing special characters
-        df.columns = [re.sub(r'[\[\],<>]', '', col).strip() for col in df.columns.astype(str)]
-        
-        # Check for required features
-        missing = set(feature_cols) - set(df.columns)
-        if missing:
-            return {"error": f"Missing required features: {missing}"}
+        if profile_user_id is not None:
+            if feature_store is None:
+                return {"error": "Feature store is not configured (FEATURE_STORE_PATH)"}
+            try:
+                with stage_metrics.stage("feature_store_read"):
+                    profile = feature_store.get_profile(profile_user_id, profile_version)
+            except KeyError as e:
+                return {"error": e.args[0]}
+            with stage_metrics.stage("parse"):
+                layout = header_cache.resolve(profile.header)
+                X = profile.project(layout)[None, :] if not layout.missing else None
+            if layout.missing:
+                return {"error": f"Missing required features: {set(layout.missing)}"}
+            result = gut_health_result(score_gut_health(X)[0])
+            return {**result, "profile_version": profile.version}
 
-        # Prepare and scale features
-        X = df[feature_cols]
-        X_scaled = scaler.transform(X) if scaler else X
+        if taxa is not None:
+            try:
+                with stage_metrics.stage("parse"):
+                    X = sparse_feature_vector(taxa, taxonomy_version, feature_cols)[None, :]
+            except ValueError as e:
+                return {"error": str(e)}
+            return gut_health_result(score_gut_health(X)[0])
+
+        if file is None:
+            return {"error": "Provide either a microbiome file or a list of taxa"}
+
+        # Read the upload and resolve its header (cached per distinct header)
+        contents = await file.read()
+        if not contents.strip():
+            return {"error": "Uploaded file is empty or invalid"}
+        with stage_metrics.stage("parse"):
+            layout = header_cache.resolve(header_line(contents))
+            # Parse only the feature columns of the first row
+            X = read_first_row(contents, layout)[None, :] if not layout.missing else None
+        if layout.missing:
+            return {"error": f"Missing required features: {set(layout.missing)}"}
 
-        # Make prediction
-        prob = model.predict_proba(X_scaled)[0, 1]
+        prob = score_gut_health(X)[0]
         
-        return {
-            "probability": round(float(prob), 3),
-            "prediction": "Good" if prob > 0.5 else "Bad"
-        }
+        return gut_health_result(prob)
 
-    except pd.errors.EmptyDataError:
-        return {"error": "Uploaded file is empty or invalid"}
     except Exception as e:
         return {"error": f"Prediction failed: {str(e)}"}
     
+@app.post("/predict-gut-health-batch")
+def predict_gut_health_batch(file: UploadFile = File(...)):
+    """Score every subject in a cohort CSV and stream one JSON line per subject.
+
+    Rows are streamed through the projected parser and scored BATCH_CHUNK_ROWS
+    at a time with a single vectorised scale + predict_proba call per chunk,
+    so memory stays bounded regardless of file size. Results are keyed by the `subject` column (or the
+    row number when it is absent); a problem with the file is reported as a
+    final `{"error": ...}` line.
+    """
+    # The header is resolved and the text wrapper opened while the request is
+    # still being handled; the generator only consumes the already open upload.
+    try:
+        layout = header_cache.resolve(header_line(file.file.readline()))
+        file.file.seek(0)
+    except Exception as e:
+        layout, error = None, {"error": f"Prediction failed: {str(e)}"}
+    else:
+        error = {"error": f"Missing required features: {set(layout.missing)}"} if layout.missing else None
+    if error is not None:
+        return StreamingResponse(iter([json.dumps(error) + "\n"]), media_type="application/x-ndjson")
+    lines = io.TextIOWrapper(file.file, encoding="utf-8-sig", newline="")
+
+    def results():
+        try:
+            chunks = read_projected(lines, layout, chunk_rows=BATCH_CHUNK_ROWS)
+            while True:
+                with stage_metrics.stage("parse"):
+                    chunk = next(chunks, None)
+                if chunk is None:
+                    break
+                subjects, X = chunk
+                probs = score_gut_health(X)
+                yield "\n".join(
+                    json.dumps({"subject": subject, **gut_health_result(prob)})
+                    for subject, prob in zip(subjects, probs)
+                ) + "\n"
+        except Exception as e:
+            yield json.dumps({"error": f"Prediction failed: {str(e)}"}) + "\n"
+        finally:
+            # Hand the spooled upload back without closing it; FastAPI closes it
+            lines.detach()
+
+    return StreamingResponse(results(), media_type="application/x-ndjson")
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
\ No newline at end of file
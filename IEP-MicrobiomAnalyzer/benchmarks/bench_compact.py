@@ -0,0 +1,102 @@
+# Latency, memory and startup cost of the pickled ensemble vs the compact artifact.
+# RUN: python benchmarks/bench_compact.py [--json results.json]
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SERVICE_DIR)
+from compact_model import _random_inputs
+
+PICKLE_PATH = os.path.join(SERVICE_DIR, "microbiome_model.pkl")
+COMPACT_PATH = os.path.join(SERVICE_DIR, "microbiome_model_compact.npz")
+
+# Fresh-interpreter startup: imports + artifact load, as the service does at boot
+STARTUP = {
+    "pickle": (
+        "import joblib\n"
+        f"model_data = joblib.load({PICKLE_PATH!r})\n"
+    ),
+    "compact": (
+        "from compact_model import CompactModel\n"
+        f"model = CompactModel.load({COMPACT_PATH!r})\n"
+    ),
+}
+# Peak RSS is read from /proc (ru_maxrss of a child inherits the parent's peak)
+STARTUP_PROBE = (
+    "import sys, time\n"
+    "start = time.perf_counter()\n"
+    "exec(sys.argv[1])\n"
+    "seconds = time.perf_counter() - start\n"
+    "status = open('/proc/self/status').read()\n"
+    "print(seconds, status.split('VmHWM:')[1].split()[0])\n"
+)
+
+def startup_cost(code, repeat):
+    """Best import+load time and the peak RSS (bytes) of a fresh interpreter."""
+    best, rss = float("inf"), 0
+    for _ in range(repeat):
+        out = subprocess.run(
+            [sys.executable, "-c", STARTUP_PROBE, code],
+            cwd=SERVICE_DIR, capture_output=True, text=True, check=True
+        ).stdout.split()
+        best = min(best, float(out[0]))
+        rss = int(out[1]) * 1024
+    return best, rss
+
+def measure(fn, repeat):
+    """Best wall time over `repeat` runs and the tracemalloc peak of one run."""
+    fn()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the compact gut-health artifact")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    import joblib
+    from compact_model import CompactModel
+
+    model_data = joblib.load(PICKLE_PATH)
+    compact = CompactModel.load(COMPACT_PATH)
+    engines = {
+        "pickle": lambda X: model_data["model"].predict_proba(model_data["scaler"].transform(X)),
+        "compact": compact.predict_proba,
+    }
+
+    results = []
+    print(f"{'engine':8s} {'stage':12s} {'time ms':>10s} {'memory MB':>10s}")
+    for name, code in STARTUP.items():
+        seconds, rss = startup_cost(code, 3)
+        results.append({"engine": name, "stage": "startup", "seconds": seconds, "peak_rss_bytes": rss})
+        print(f"{name:8s} {'startup':12s} {seconds * 1e3:10.1f} {rss / 1e6:10.1f}")
+
+    X = _random_inputs(1000, len(compact.features))
+    for n_rows in (1, 100, 1000):
+        for name, fn in engines.items():
+            seconds, peak = measure(lambda: fn(X[:n_rows]), 20 if n_rows == 1 else 5)
+            results.append({"engine": name, "stage": f"rows={n_rows}", "seconds": seconds, "peak_bytes": peak})
+            print(f"{name:8s} {f'rows={n_rows}':12s} {seconds * 1e3:10.2f} {peak / 1e6:10.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,81 @@
+# CPU microbenchmarks of the /predict-gut-health hot path, without any network:
+# header cleaning and resolution, projected row parsing, scaler.transform and
+# predict_proba (pickled model and compact artifact), on the tests/*.csv fixture
+# and synthetic wide inputs at several batch sizes. Fails (exit 1) on
+# regressions against the local baseline (written by the first run).
+# RUN: python benchmarks/bench_inference.py [--quick] [--only predict_proba] [--update-baseline]
+
+import io
+import os
+import sys
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(SERVICE_DIR)
+sys.path.append(BENCH_DIR)
+os.chdir(SERVICE_DIR)
+
+import numpy as np
+
+import app as service
+from compact_model import CompactModel, _random_inputs
+from microbench import Suite, main
+from microbiome_io import HeaderCache, clean_name, header_line, read_first_row, read_projected
+
+MICRO_CSV = os.path.join(SERVICE_DIR, "tests", "test_microbe.csv")
+COMPACT_PATH = os.path.join(SERVICE_DIR, "microbiome_model_compact.npz")
+BASELINE = os.path.join(BENCH_DIR, "baseline_inference.json")
+
+BATCH_SIZES = (1, 10, 100, 1000)
+# Columns of the synthetic wide uploads (model features plus unrelated taxa)
+WIDE_TAXA = 5000
+
+def wide_upload(features, n_rows, n_taxa=WIDE_TAXA, seed=0):
+    """0/1 microbiome CSV with `n_rows` subjects and `n_taxa` columns, the model's features among them."""
+    rng = np.random.default_rng(seed)
+    columns = list(features) + [f"Taxon {i} " for i in range(n_taxa - len(features))]
+    rng.shuffle(columns)
+    values = (rng.random((n_rows, len(columns))) < 0.1).astype(np.int8)
+    lines = [",".join(["subject"] + [c.replace(",", "") for c in columns])]
+    lines += [f"s{i}," + ",".join(map(str, row)) for i, row in enumerate(values.tolist())]
+    return ("\n".join(lines) + "\n").encode("utf-8")
+
+def parse_all(contents, layout):
+    return [X for _, X in read_projected(io.StringIO(contents.decode("utf-8-sig")), layout)]
+
+def build_suite():
+    suite = Suite("microbiom-analyzer inference")
+    features = list(service.feature_cols)
+    with open(MICRO_CSV, "rb") as f:
+        fixture = f.read()
+    wide = wide_upload(features, 1)
+
+    # Header cleaning: a new header is cleaned and matched once, repeats only hash the line
+    for name, contents in (("fixture", fixture), ("wide", wide)):
+        line = header_line(contents)
+        suite.add(f"header/{name}_new", lambda line=line: HeaderCache(features, normalize=clean_name).resolve(line))
+        cache = HeaderCache(features, normalize=clean_name)
+        suite.add(f"header/{name}_cached", lambda line=line, cache=cache: cache.resolve(line))
+
+    layout = HeaderCache(features, normalize=clean_name).resolve(header_line(fixture))
+    suite.add("parse/fixture_first_row", lambda: read_first_row(fixture, layout))
+    for n_rows in (1, 100, 1000):
+        contents = wide_upload(features, n_rows)
+        wide_layout = HeaderCache(features, normalize=clean_name).resolve(header_line(contents))
+        suite.add(f"parse/wide_rows={n_rows}", lambda c=contents, l=wide_layout: parse_all(c, l), repeat=5)
+
+    compact = CompactModel.load(COMPACT_PATH)
+    X_all = _random_inputs(max(BATCH_SIZES), len(features))
+    for n_rows in BATCH_SIZES:
+        X = X_all[:n_rows]
+        if service.scaler is not None:
+            suite.add(f"scaler_transform/batch={n_rows}", lambda X=X: service.scaler.transform(X))
+            X_scaled = service.scaler.transform(X)
+        else:
+            X_scaled = X
+        suite.add(f"predict_proba/service/batch={n_rows}", lambda X=X_scaled: service.model.predict_proba(X))
+        suite.add(f"predict_proba/compact/batch={n_rows}", lambda X=X: compact.predict_proba(X))
+    return suite
+
+if __name__ == "__main__":
+    sys.exit(main(build_suite(), BASELINE))
@@ -0,0 +1,97 @@
+# Parse time and peak memory of microbiome uploads: full pandas parse vs projected parser.
+# RUN: python benchmarks/bench_parse.py [--json results.json]
+
+import argparse
+import io
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from microbiome_io import HeaderCache, clean_name, header_line, read_projected
+
+FIXTURE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tests", "test_microbe.csv")
+N_FEATURES = 20
+
+def make_upload(n_rows, n_taxa, seed=0):
+    """Synthetic 0/1 microbiome CSV (bytes) plus the feature columns to project."""
+    rng = np.random.default_rng(seed)
+    taxa = [f"Taxon {i} " for i in range(n_taxa)]
+    data = (rng.random((n_rows, n_taxa)) < 0.1).astype(np.int8)
+    df = pd.DataFrame(data, columns=taxa)
+    df.insert(0, "subject", [f"s{i}" for i in range(n_rows)])
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False)
+    features = [clean_name(t) for t in rng.choice(taxa, N_FEATURES, replace=False)]
+    return buffer.getvalue().encode("utf-8"), features
+
+def fixture_upload():
+    with open(FIXTURE, "rb") as f:
+        contents = f.read()
+    import joblib
+    features = joblib.load(os.path.join(os.path.dirname(FIXTURE), "..", "microbiome_model.pkl"))["features"]
+    return contents, features
+
+def parse_pandas(contents, features):
+    """Baseline: materialise every column, clean names, then select features."""
+    df = pd.read_csv(io.StringIO(contents.decode("utf-8")))
+    df.columns = [clean_name(col) for col in df.columns.astype(str)]
+    return df[features].to_numpy()
+
+def parse_projected(contents, features, cache):
+    """Projected parser streaming over the raw bytes, as the batch endpoint does."""
+    layout = cache.resolve(header_line(contents))
+    lines = io.TextIOWrapper(io.BytesIO(contents), encoding="utf-8-sig", newline="")
+    return np.vstack([X for _, X in read_projected(lines, layout)])
+
+def measure(fn, repeat):
+    """Best wall time over `repeat` runs and the tracemalloc peak of one run."""
+    fn()
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - start)
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark microbiome upload parsing")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    cases = {
+        "fixture (1 x 1979)": fixture_upload(),
+        "wide (1 x 20000)": make_upload(1, 20000),
+        "tall (5000 x 1979)": make_upload(5000, 1979),
+    }
+
+    results = []
+    print(f"{'input':22s} {'parser':10s} {'time ms':>10s} {'peak MB':>10s}")
+    for name, (contents, features) in cases.items():
+        repeat = 3 if len(contents) > 5_000_000 else 20
+        cache = HeaderCache(features, normalize=clean_name)
+        expected = parse_pandas(contents, features)
+        assert np.array_equal(parse_projected(contents, features, cache), expected)
+        for parser_name, fn in (
+            ("pandas", lambda: parse_pandas(contents, features)),
+            ("projected", lambda: parse_projected(contents, features, cache)),
+        ):
+            seconds, peak = measure(fn, repeat)
+            results.append({"input": name, "parser": parser_name, "seconds": seconds, "peak_bytes": peak})
+            print(f"{name:22s} {parser_name:10s} {seconds * 1e3:10.2f} {peak / 1e6:10.2f}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,179 @@
+# Small harness for CPU microbenchmarks: best-of-N timing, tracemalloc peak and
+# retained memory, and comparison against a baseline JSON that fails the run on
+# regressions. Baselines are machine-local (not committed): the first run writes
+# one, and times are compared relative to a calibration case run in the same
+# process. The same module is copied into each service's benchmarks.
+
+import argparse
+import gc
+import json
+import statistics
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+# Inner loops are sized so one timed repeat takes at least this long
+MIN_REPEAT_SECONDS = 0.02
+
+CALIBRATION_DATA = np.random.default_rng(0).random(100_000)
+
+def calibration_case():
+    """Fixed mix of interpreter and numpy work that case times are scaled by.
+
+    It slows down with the machine (CPU model, frequency scaling, noisy
+    neighbours), so comparing times relative to it cancels most of the
+    difference between the run that wrote the baseline and this one.
+    """
+    total = 0
+    for i in range(20_000):
+        total += i % 7
+    return total + float(np.sort(CALIBRATION_DATA)[total % 1000])
+
+def measure(fn, repeat=7):
+    """Per-call timings (best and median, seconds) and memory (bytes) of `fn()`.
+
+    Each repeat runs `fn` enough times to last MIN_REPEAT_SECONDS, so fast
+    calls are not dominated by timer resolution. Memory is taken from one
+    extra call under tracemalloc: `peak_bytes` is the most allocated at once
+    above what was live before the call, `retained_bytes` what is still
+    allocated after it (caches, leaks).
+    """
+    fn()
+    start = time.perf_counter()
+    fn()
+    once = time.perf_counter() - start
+    number = max(1, int(MIN_REPEAT_SECONDS / max(once, 1e-9)))
+
+    timings = []
+    gc_enabled = gc.isenabled()
+    gc.disable()
+    try:
+        for _ in range(repeat):
+            start = time.perf_counter()
+            for _ in range(number):
+                fn()
+            timings.append((time.perf_counter() - start) / number)
+    finally:
+        if gc_enabled:
+            gc.enable()
+
+    gc.collect()
+    tracemalloc.start()
+    before, _ = tracemalloc.get_traced_memory()
+    result = fn()
+    after, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return {
+        "best_seconds": min(timings),
+        "median_seconds": statistics.median(timings),
+        "calls_per_repeat": number,
+        "peak_bytes": peak - before,
+        "retained_bytes": after - before,
+    }
+
+class Suite:
+    """Named cases, each a zero-argument callable measured by `measure`."""
+
+    def __init__(self, name):
+        self.name = name
+        self.cases = []
+
+    def add(self, case, fn, repeat=7):
+        self.cases.append((case, fn, repeat))
+
+    def run(self, quick=False, pattern=None):
+        results = {}
+        print(f"{'case':48s} {'best ms':>10s} {'median ms':>10s} {'peak MB':>9s} {'kept MB':>9s}")
+        for case, fn, repeat in self.cases:
+            if pattern and pattern not in case:
+                continue
+            r = measure(fn, repeat=3 if quick else repeat)
+            results[case] = r
+            print(f"{case:48s} {r['best_seconds'] * 1e3:10.3f} {r['median_seconds'] * 1e3:10.3f} "
+                  f"{r['peak_bytes'] / 1e6:9.2f} {r['retained_bytes'] / 1e6:9.2f}")
+        return results
+
+def compare(results, baseline, time_tolerance=0.5, memory_tolerance=0.25, min_memory_bytes=64 * 1024,
+            speed_ratio=1.0):
+    """Messages for cases slower or hungrier than the baseline beyond the tolerances.
+
+    Time is compared on the best run (least noisy), after scaling the
+    baseline by `speed_ratio` (this run's calibration time over the
+    baseline's). Peak memory is compared relatively, ignoring growth below
+    `min_memory_bytes` so tiny cases do not flap.
+    """
+    regressions = []
+    for case, r in results.items():
+        base = baseline.get(case)
+        if base is None:
+            continue
+        expected = base["best_seconds"] * speed_ratio
+        if r["best_seconds"] > expected * (1 + time_tolerance):
+            regressions.append(
+                f"{case}: time {expected * 1e3:.3f} -> {r['best_seconds'] * 1e3:.3f} ms (calibrated)"
+            )
+        grown = r["peak_bytes"] - base["peak_bytes"]
+        if grown > min_memory_bytes and r["peak_bytes"] > base["peak_bytes"] * (1 + memory_tolerance):
+            regressions.append(
+                f"{case}: peak memory {base['peak_bytes'] / 1e6:.2f} -> {r['peak_bytes'] / 1e6:.2f} MB"
+            )
+    return regressions
+
+def main(suite, baseline_path, argv=None):
+    """Run `suite`, write/compare the baseline; returns the process exit code."""
+    parser = argparse.ArgumentParser(description=f"Microbenchmarks: {suite.name}")
+    parser.add_argument("--baseline", default=baseline_path, help="Baseline JSON to compare against (written if missing)")
+    parser.add_argument("--update-baseline", action="store_true", help="Store this run as the baseline")
+    parser.add_argument("--json", help="Also write results to this file")
+    parser.add_argument("--quick", action="store_true", help="Fewer repeats (noisier)")
+    parser.add_argument("--only", help="Run only cases whose name contains this text")
+    parser.add_argument("--time-tolerance", type=float, default=0.5, help="Allowed relative slowdown")
+    parser.add_argument("--memory-tolerance", type=float, default=0.25, help="Allowed relative peak-memory growth")
+    args = parser.parse_args(argv)
+
+    # Calibrated before and after the suite; the faster reading is the machine's speed
+    calibration = measure(calibration_case)["best_seconds"]
+    results = suite.run(quick=args.quick, pattern=args.only)
+    calibration = min(calibration, measure(calibration_case)["best_seconds"])
+    print(f"{'(calibration)':48s} {calibration * 1e3:10.3f}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"calibration_seconds": calibration, "cases": results}, f, indent=2)
+
+    try:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = None
+    if args.update_baseline or baseline is None:
+        cases = dict(results)
+        if baseline is not None:
+            # Cases left out by --only keep their stored numbers, rescaled to this run's calibration
+            ratio = calibration / baseline.get("calibration_seconds", calibration)
+            cases = {
+                case: {**r, "best_seconds": r["best_seconds"] * ratio, "median_seconds": r["median_seconds"] * ratio}
+                for case, r in baseline["cases"].items()
+            }
+            cases.update(results)
+        with open(args.baseline, "w") as f:
+            json.dump({"suite": suite.name, "python": sys.version.split()[0],
+                       "calibration_seconds": calibration, "cases": cases}, f, indent=2)
+            f.write("\n")
+        print(f"{'No baseline found; this run' if baseline is None else 'Baseline'} written to {args.baseline}")
+        return 0
+
+    base_calibration = baseline.get("calibration_seconds", calibration)
+    speed_ratio = calibration / base_calibration
+    print(f"Calibration {calibration * 1e3:.3f} ms, {base_calibration * 1e3:.3f} ms when the baseline was written")
+    regressions = compare(results, baseline["cases"], args.time_tolerance, args.memory_tolerance,
+                          speed_ratio=speed_ratio)
+    if regressions:
+        print(f"\n{len(regressions)} REGRESSION(S) against {args.baseline}:")
+        for message in regressions:
+            print(f"  {message}")
+        return 1
+    print(f"\nNo regressions against {args.baseline}")
+    return 0
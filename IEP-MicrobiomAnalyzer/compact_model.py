@@ -0,0 +1,237 @@
+# Flatten the calibrated gut-health ensemble into a numpy-only inference artifact.
+# RUN: python compact_model.py microbiome_model.pkl microbiome_model_compact.npz --check
+
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+from tree_tables import evaluate_trees, prepare_forest, stack_tables, tree_table
+
+# === Tree Tables ===
+
+def _sklearn_tree_table(tree, scale):
+    """Table for a fitted sklearn classification `Tree`, leaves holding scaled P(class 1)."""
+    missing_left = getattr(tree, "missing_go_to_left", np.zeros(tree.node_count, dtype=np.uint8))
+    counts = tree.value[:, 0, :]
+    return tree_table(
+        tree.node_count, tree.feature, tree.threshold,
+        tree.children_left, tree.children_right,
+        missing_left, counts[:, 1] / counts.sum(axis=1) * scale
+    )
+
+def _xgb_tree_table(tree):
+    """Table for one tree of an XGBoost JSON model dump.
+
+    XGBoost sends a row left when `x < threshold` on float32 inputs; moving the
+    threshold to the next float32 below turns that into the `x <= threshold`
+    test used by the evaluator without changing any decision.
+    """
+    left = np.asarray(tree["left_children"], dtype=np.int64)
+    threshold = np.asarray(tree["split_conditions"], dtype=np.float32)
+    return tree_table(
+        len(left), np.asarray(tree["split_indices"]),
+        np.nextafter(threshold, np.float32(-np.inf)),
+        left, np.asarray(tree["right_children"], dtype=np.int64),
+        np.asarray(tree["default_left"]), threshold.astype(np.float64)
+    )
+
+def _tree_depth(left, right):
+    """Depth of a tree given its child arrays (root at node 0)."""
+    depth, level = 0, np.array([0])
+    while True:
+        level = np.concatenate([left[level], right[level]])
+        level = level[level >= 0]
+        if len(level) == 0:
+            return depth
+        depth += 1
+
+def _expit(z):
+    return 1.0 / (1.0 + np.exp(-z))
+
+# === Model Compilation ===
+
+def _compile_xgb(estimator):
+    """Tree tables and margin offset of a fitted binary XGBClassifier."""
+    booster = estimator.get_booster()
+    model = json.loads(booster.save_raw("json"))["learner"]
+    if model["objective"]["name"] != "binary:logistic":
+        raise NotImplementedError(f"Unsupported XGBoost objective: {model['objective']['name']}")
+    trees = model["gradient_booster"]["model"]["trees"]
+    best = getattr(estimator, "best_iteration", None)
+    if best is not None:
+        trees = trees[:best + 1]
+    base_score = float(str(model["learner_model_param"]["base_score"]).strip("[]"))
+    depth = max(_tree_depth(np.asarray(t["left_children"]), np.asarray(t["right_children"])) for t in trees)
+    return [_xgb_tree_table(t) for t in trees], depth, np.log(base_score / (1.0 - base_score))
+
+def _compile_forest(estimator):
+    """Tree tables of a fitted RandomForestClassifier, leaves pre-divided by the tree count."""
+    trees = estimator.estimators_
+    tables = [_sklearn_tree_table(t.tree_, 1.0 / len(trees)) for t in trees]
+    return tables, max(t.tree_.max_depth for t in trees)
+
+def compile_model(model_data):
+    """Compile a saved {model, features, scaler} bundle into a CompactModel.
+
+    Every calibration fold of the CalibratedClassifierCV keeps its own
+    soft-voting members and sigmoid calibrator; their trees are stacked into
+    one table per member so a prediction is a handful of vectorised passes.
+    """
+    calibrated = model_data["model"]
+    if getattr(calibrated, "method", None) != "sigmoid":
+        raise NotImplementedError("Only sigmoid-calibrated models are supported")
+    if list(calibrated.classes_) != [0, 1]:
+        raise NotImplementedError("Only binary 0/1 models are supported")
+
+    folds = calibrated.calibrated_classifiers_
+    first = folds[0].estimator
+    if getattr(first, "voting", None) != "soft":
+        raise NotImplementedError("Only soft-voting ensembles are supported")
+    weights = np.ones(len(first.estimators_)) if first.weights is None \
+        else np.asarray(first.weights, dtype=float)
+
+    members = []
+    arrays = {
+        "calibration_a": np.array([f.calibrators[0].a_ for f in folds], dtype=np.float64),
+        "calibration_b": np.array([f.calibrators[0].b_ for f in folds], dtype=np.float64),
+    }
+    scaler = model_data.get("scaler")
+    if scaler is not None and hasattr(scaler, "scale_"):
+        arrays["scaler_mean"] = np.asarray(scaler.mean_ if scaler.with_mean else 0.0, dtype=np.float64) \
+            * np.ones(scaler.n_features_in_)
+        arrays["scaler_scale"] = np.asarray(scaler.scale_ if scaler.with_std else 1.0, dtype=np.float64) \
+            * np.ones(scaler.n_features_in_)
+
+    for i, (name, _) in enumerate(first.estimators):
+        fitted = [f.estimator.named_estimators_[name] for f in folds]
+        kind = fitted[0].__class__.__name__
+        if kind == "LogisticRegression":
+            arrays[f"{name}.coef"] = np.vstack([np.ravel(e.coef_) for e in fitted]).astype(np.float64)
+            arrays[f"{name}.intercept"] = np.array([np.ravel(e.intercept_)[0] for e in fitted], dtype=np.float64)
+            members.append({"name": name, "kind": "linear", "weight": weights[i]})
+            continue
+        if kind == "XGBClassifier":
+            compiled = [_compile_xgb(e) for e in fitted]
+            arrays[f"{name}.offset"] = np.array([c[2] for c in compiled], dtype=np.float64)
+            link = "logit"
+        elif kind == "RandomForestClassifier":
+            compiled = [_compile_forest(e) for e in fitted]
+            link = "identity"
+        else:
+            raise NotImplementedError(f"Unsupported estimator: {kind}")
+        tables = [t for c in compiled for t in c[0]]
+        forest = stack_tables(tables, max(c[1] for c in compiled))
+        forest["groups"] = np.cumsum([0] + [len(c[0]) for c in compiled[:-1]]).astype(np.int32)
+        arrays.update({f"{name}.{k}": v for k, v in forest.items()})
+        members.append({"name": name, "kind": "forest", "link": link, "weight": weights[i]})
+
+    meta = {"features": list(model_data["features"]), "members": members}
+    return CompactModel(meta, arrays)
+
+# === Evaluator ===
+
+class CompactModel:
+    """Numpy-only evaluator for the calibrated gut-health ensemble.
+
+    Takes the raw (unscaled) feature matrix: the training scaler is applied
+    internally, then each fold's soft vote is passed through its sigmoid
+    calibrator and the folds are averaged, as CalibratedClassifierCV does.
+    """
+
+    def __init__(self, meta, arrays):
+        self.meta = meta
+        self.arrays = arrays
+        self.features = meta["features"]
+        total = sum(m["weight"] for m in meta["members"])
+        self._members = []
+        for member in meta["members"]:
+            prefix = member["name"] + "."
+            params = {k[len(prefix):]: v for k, v in arrays.items() if k.startswith(prefix)}
+            if member["kind"] == "forest":
+                params = {**prepare_forest(params), "offset": params.get("offset", 0.0)}
+            self._members.append((member, member["weight"] / total, params))
+
+    def predict_proba(self, X):
+        X = np.asarray(X, dtype=np.float64)
+        if "scaler_mean" in self.arrays:
+            X = (X - self.arrays["scaler_mean"]) / self.arrays["scaler_scale"]
+        # Tree learners see float32 inputs, as in sklearn and XGBoost
+        X32 = X.astype(np.float32).astype(np.float64)
+
+        vote = np.zeros((len(self.arrays["calibration_a"]), X.shape[0]))
+        for member, weight, params in self._members:
+            if member["kind"] == "linear":
+                out = _expit(params["coef"] @ X.T + params["intercept"][:, None])
+            else:
+                out = evaluate_trees(X32, params, block_rows=128)
+                if member["link"] == "logit":
+                    out = _expit(out + np.asarray(params["offset"]).reshape(-1, 1))
+            vote += weight * out
+
+        a = self.arrays["calibration_a"][:, None]
+        b = self.arrays["calibration_b"][:, None]
+        positive = _expit(-(a * vote + b)).mean(axis=0)
+        return np.column_stack([1.0 - positive, positive])
+
+    def save(self, path):
+        np.savez_compressed(path, meta=np.asarray(json.dumps(self.meta)), **self.arrays)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path, allow_pickle=False) as data:
+            meta = json.loads(str(data["meta"]))
+            arrays = {k: data[k] for k in data.files if k != "meta"}
+        return cls(meta, arrays)
+
+def export_compact_model(model_data, path):
+    """Compile a saved model bundle and write the compact artifact to `path`."""
+    compact = compile_model(model_data)
+    compact.save(path)
+    return compact
+
+# === CLI ===
+
+def _random_inputs(n_rows, n_features, seed=0):
+    """Synthetic presence/absence profiles like the ones the service scores."""
+    rng = np.random.default_rng(seed)
+    return (rng.random((n_rows, n_features)) < 0.5).astype(np.float64)
+
+def _time_per_call(fn, X, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        fn(X)
+    return (time.perf_counter() - start) / repeat
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the gut-health model to a compact artifact")
+    parser.add_argument("model", nargs="?", default="microbiome_model.pkl")
+    parser.add_argument("output", nargs="?", default="microbiome_model_compact.npz")
+    parser.add_argument("--check", action="store_true", help="Verify parity and report latency")
+    args = parser.parse_args()
+
+    import joblib
+
+    model_data = joblib.load(args.model)
+    export_compact_model(model_data, args.output)
+    compact = CompactModel.load(args.output)
+    print(f"[✓] Exported {args.output} "
+          f"({os.path.getsize(args.output) / 1024:.0f} KB vs {os.path.getsize(args.model) / 1024:.0f} KB pickle)")
+
+    if args.check:
+        def reference(X):
+            return model_data["model"].predict_proba(model_data["scaler"].transform(X))
+
+        X = _random_inputs(2000, len(compact.features))
+        max_err = np.abs(reference(X) - compact.predict_proba(X)).max()
+        print(f"Max abs difference on {len(X)} rows: {max_err:.2e}")
+        for n_rows, repeat in ((1, 50), (1000, 5)):
+            batch = X[:n_rows]
+            t_ref = _time_per_call(reference, batch, repeat)
+            t_compact = _time_per_call(compact.predict_proba, batch, repeat)
+            print(f"rows={n_rows:5d} pickle={t_ref * 1e3:8.2f} ms  compact={t_compact * 1e3:8.2f} ms")
+
+if __name__ == "__main__":
+    main()
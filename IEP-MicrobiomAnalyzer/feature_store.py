@@ -0,0 +1,171 @@
+# Shared microbiome feature store: each user's profile is parsed once by the
+# controller and stored as a versioned bit vector aligned to the upload's taxa.
+# The same module is copied into every service that reads or writes profiles.
+
+import csv
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+
+import numpy as np
+
+# SQLite file on a volume shared by the controller and the IEPs (unset = disabled)
+FEATURE_STORE_PATH = os.environ.get("FEATURE_STORE_PATH")
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS taxonomies (
+    taxonomy_id TEXT PRIMARY KEY,
+    header BLOB NOT NULL,
+    n_columns INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS profiles (
+    user_id INTEGER NOT NULL,
+    version INTEGER NOT NULL,
+    taxonomy_id TEXT NOT NULL REFERENCES taxonomies(taxonomy_id),
+    bits BLOB NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (user_id, version)
+);
+"""
+
+def split_csv(contents):
+    """Raw header line, column names and first data row of a CSV upload."""
+    end = contents.find(b"\n")
+    header = (contents if end == -1 else contents[:end]).rstrip(b"\r")
+    reader = csv.reader(io.StringIO(contents.decode("utf-8-sig")))
+    columns = next(reader, [])
+    for row in reader:
+        if row:
+            return header, columns, row
+    raise ValueError("Uploaded file has no data rows")
+
+def presence_vector(columns, cells):
+    """0/1 vector of a profile row over every column.
+
+    The subject column and empty cells are stored as 0 (absent), matching
+    microbiome_io.read_projected for direct uploads.
+    """
+    values = np.zeros(len(columns), dtype=np.uint8)
+    for i, (name, cell) in enumerate(zip(columns, cells)):
+        if name.strip().lower() == "subject" or not cell.strip():
+            continue
+        try:
+            value = float(cell)
+        except ValueError:
+            raise ValueError(f"Non-numeric value {cell!r} for taxon {name.strip()!r}")
+        if value not in (0.0, 1.0):
+            raise ValueError(f"Microbiome profiles must be presence/absence (0/1), got {cell!r} for {name.strip()!r}")
+        values[i] = int(value)
+    return values
+
+class Profile:
+    """One stored microbiome profile: the header it is aligned to and its 0/1 values."""
+
+    def __init__(self, user_id, version, taxonomy_id, header, values):
+        self.user_id = user_id
+        self.version = version
+        self.taxonomy_id = taxonomy_id
+        self.header = header
+        self.values = values
+
+    def project(self, layout):
+        """Feature row for a resolved header layout (see microbiome_io.HeaderCache)."""
+        X = np.zeros(len(layout.indices))
+        X[layout.present] = self.values[layout.indices[layout.present]]
+        return X
+
+class FeatureStore:
+    """SQLite-backed store of versioned per-user microbiome profiles.
+
+    Taxonomies are keyed by a hash of the raw header line, so the wide header
+    is stored once however many profiles use it; each profile is a packed bit
+    vector over that header. Storing a profile identical to the user's latest
+    one returns the existing version instead of creating a new one.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+
+    def register_taxonomy(self, header, n_columns):
+        """Store a header line once and return its id (hash of the raw line)."""
+        taxonomy_id = hashlib.blake2b(header, digest_size=16).hexdigest()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR IGNORE INTO taxonomies (taxonomy_id, header, n_columns) VALUES (?, ?, ?)",
+                (taxonomy_id, header, n_columns)
+            )
+        return taxonomy_id
+
+    def put_profile(self, user_id, header, values):
+        """Store a profile and return its version (1, 2, ... per user)."""
+        values = np.asarray(values, dtype=bool)
+        taxonomy_id = self.register_taxonomy(header, len(values))
+        bits = np.packbits(values).tobytes()
+        with self._lock:
+            self._conn.execute("BEGIN IMMEDIATE")
+            try:
+                latest = self._conn.execute(
+                    "SELECT version, taxonomy_id, bits FROM profiles WHERE user_id = ? "
+                    "ORDER BY version DESC LIMIT 1",
+                    (user_id,)
+                ).fetchone()
+                if latest and latest[1] == taxonomy_id and latest[2] == bits:
+                    version = latest[0]
+                else:
+                    version = latest[0] + 1 if latest else 1
+                    self._conn.execute(
+                        "INSERT INTO profiles (user_id, version, taxonomy_id, bits, created_at) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        (user_id, version, taxonomy_id, bits, time.time())
+                    )
+                self._conn.execute("COMMIT")
+            except Exception:
+                self._conn.execute("ROLLBACK")
+                raise
+        return version
+
+    def put_csv(self, user_id, contents):
+        """Parse the first row of a microbiome CSV upload and store it."""
+        header, columns, cells = split_csv(contents)
+        return self.put_profile(user_id, header, presence_vector(columns, cells))
+
+    def latest_version(self, user_id):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT MAX(version) FROM profiles WHERE user_id = ?", (user_id,)
+            ).fetchone()
+        return row[0]
+
+    def get_profile(self, user_id, version=None):
+        """Stored profile by reference; the latest version when `version` is None."""
+        query = (
+            "SELECT p.version, p.taxonomy_id, t.header, t.n_columns, p.bits "
+            "FROM profiles p JOIN taxonomies t ON p.taxonomy_id = t.taxonomy_id WHERE p.user_id = ?"
+        )
+        params = (user_id,)
+        if version is None:
+            query += " ORDER BY p.version DESC LIMIT 1"
+        else:
+            query += " AND p.version = ?"
+            params = (user_id, version)
+        with self._lock:
+            row = self._conn.execute(query, params).fetchone()
+        if row is None:
+            raise KeyError(f"No stored microbiome profile for user {user_id}"
+                           + ("" if version is None else f" version {version}"))
+        version, taxonomy_id, header, n_columns, bits = row
+        values = np.unpackbits(np.frombuffer(bits, dtype=np.uint8), count=n_columns)
+        return Profile(user_id, version, taxonomy_id, bytes(header), values)
+
+def open_feature_store():
+    """The configured feature store, or None when FEATURE_STORE_PATH is unset."""
+    if not FEATURE_STORE_PATH:
+        return None
+    return FeatureStore(FEATURE_STORE_PATH)
@@ -0,0 +1,195 @@
+# Microbiome input handling: versioned taxonomy, sparse profiles, header resolution
+# and column-projected CSV parsing.
+
+import csv
+import hashlib
+import io
+import json
+import os
+import re
+import threading
+from collections import OrderedDict
+from functools import lru_cache
+
+import numpy as np
+
+TAXONOMY_DIR = os.environ.get(
+    "TAXONOMY_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "taxonomy")
+)
+
+def clean_name(name):
+    """Same column cleaning the model was trained with (see model.py)."""
+    return re.sub(r'[\[\],<>]', '', name).strip()
+
+class Taxonomy:
+    """Ordered list of taxa that sparse microbiome profiles are indexed against."""
+
+    def __init__(self, version, taxa):
+        self.version = version
+        self.taxa = list(taxa)
+        self._index = {}
+        for i, name in enumerate(self.taxa):
+            self._index.setdefault(name.strip(), i)
+
+    def __len__(self):
+        return len(self.taxa)
+
+    def resolve(self, items):
+        """Map taxa names and/or integer indices to sorted taxonomy indices."""
+        indices = set()
+        unknown = []
+        for item in items:
+            if isinstance(item, bool):
+                unknown.append(item)
+            elif isinstance(item, int):
+                if 0 <= item < len(self.taxa):
+                    indices.add(item)
+                else:
+                    unknown.append(item)
+            elif isinstance(item, str) and item.strip() in self._index:
+                indices.add(self._index[item.strip()])
+            else:
+                unknown.append(item)
+        if unknown:
+            raise ValueError(f"Unknown taxa for taxonomy {self.version}: {unknown[:10]}")
+        return np.array(sorted(indices), dtype=np.int64)
+
+    @lru_cache(maxsize=8)
+    def feature_index(self, features):
+        """Taxonomy index of each model feature (-1 when the taxonomy lacks it)."""
+        by_clean = {}
+        for i, name in enumerate(self.taxa):
+            by_clean.setdefault(clean_name(name), i)
+        return np.array([by_clean.get(f, -1) for f in features], dtype=np.int64)
+
+@lru_cache(maxsize=None)
+def load_taxonomy(version):
+    path = os.path.join(TAXONOMY_DIR, f"{os.path.basename(version)}.json")
+    if not os.path.exists(path):
+        raise ValueError(f"Unknown taxonomy version: {version}")
+    with open(path, encoding="utf-8") as f:
+        data = json.load(f)
+    return Taxonomy(data["version"], data["taxa"])
+
+def parse_sparse_taxa(raw):
+    """Parse a JSON list of present taxa (names or indices) from a form field."""
+    try:
+        items = json.loads(raw)
+    except json.JSONDecodeError as e:
+        raise ValueError(f"Taxa must be a JSON list: {str(e)}")
+    if not isinstance(items, list):
+        raise ValueError("Taxa must be a JSON list of names or indices")
+    return items
+
+def sparse_feature_vector(raw_taxa, version, features):
+    """Presence vector over `features` built directly from a sparse taxa list."""
+    taxonomy = load_taxonomy(version)
+    present = taxonomy.resolve(parse_sparse_taxa(raw_taxa))
+    feature_index = taxonomy.feature_index(tuple(features))
+    return np.isin(feature_index, present).astype(np.float64)
+
+# === Header Resolution Cache ===
+
+def header_line(contents):
+    """First line of a CSV upload (without the line terminator)."""
+    end = contents.find(b"\n")
+    line = contents if end == -1 else contents[:end]
+    return line.rstrip(b"\r")
+
+def parse_header(line):
+    """Column names of a raw CSV header line (BOM stripped, quotes honoured)."""
+    text = line.decode("utf-8-sig")
+    return next(csv.reader([text]), [])
+
+class HeaderLayout:
+    """Resolved position of each model feature in an uploaded file's columns."""
+
+    def __init__(self, indices, missing, subject_index=-1):
+        self.indices = indices
+        self.missing = missing
+        self.present = indices >= 0
+        self.subject_index = subject_index
+
+class HeaderCache:
+    """LRU cache of header layouts keyed by a hash of the raw header line.
+
+    Clients upload the same wide header over and over, so resolving it
+    (name cleaning, matching against the model's features) is done once per
+    distinct header and later uploads only pay for hashing the line.
+    """
+
+    def __init__(self, features, normalize=str, maxsize=64):
+        self.features = list(features)
+        self.normalize = normalize
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._layouts = OrderedDict()
+        self._lock = threading.Lock()
+
+    def resolve(self, line):
+        key = hashlib.blake2b(line, digest_size=16).digest()
+        with self._lock:
+            layout = self._layouts.get(key)
+            if layout is not None:
+                self._layouts.move_to_end(key)
+                self.hits += 1
+                return layout
+        layout = self._build(line)
+        with self._lock:
+            self.misses += 1
+            self._layouts[key] = layout
+            if len(self._layouts) > self.maxsize:
+                self._layouts.popitem(last=False)
+        return layout
+
+    def _build(self, line):
+        positions = {}
+        for i, name in enumerate(parse_header(line)):
+            positions.setdefault(self.normalize(name), i)
+        indices = np.array([positions.get(f, -1) for f in self.features], dtype=np.int64)
+        missing = [f for f, i in zip(self.features, indices) if i < 0]
+        return HeaderLayout(indices, missing, positions.get("subject", -1))
+
+# === Projected Parsing ===
+
+def read_projected(lines, layout, chunk_rows=1000, max_rows=None):
+    """Stream (subjects, X) chunks holding only the layout's feature columns.
+
+    `lines` is any iterable of CSV text lines (header first). Each row is
+    split once and only the resolved feature positions (plus the subject
+    column) are converted, so nothing proportional to the file width is kept.
+    Features missing from the file and empty cells are filled with 0 (absent),
+    as feature_store.presence_vector stores them, so an upload gives the same
+    model input whether it is sent directly or by reference.
+    """
+    reader = csv.reader(lines)
+    next(reader, None)
+    positions = layout.indices[layout.present].tolist()
+    n_features = len(layout.indices)
+    subject_index = layout.subject_index
+
+    subjects, rows = [], []
+    for row_number, row in enumerate(reader):
+        if max_rows is not None and row_number >= max_rows:
+            break
+        if not row:
+            continue
+        rows.append([float(row[i]) if row[i].strip() else 0.0 for i in positions])
+        subjects.append(row[subject_index] if subject_index >= 0 else row_number)
+        if len(rows) >= chunk_rows:
+            yield subjects, _fill_missing(rows, layout, n_features)
+            subjects, rows = [], []
+    if rows:
+        yield subjects, _fill_missing(rows, layout, n_features)
+
+def _fill_missing(rows, layout, n_features):
+    X = np.zeros((len(rows), n_features))
+    X[:, layout.present] = np.asarray(rows, dtype=np.float64).reshape(len(rows), -1)
+    return X
+
+def read_first_row(contents, layout):
+    """Feature values of the first data row of an in-memory CSV upload."""
+    for _, X in read_projected(io.StringIO(contents.decode("utf-8-sig")), layout, max_rows=1):
+        return X[0]
+    raise ValueError("Uploaded file has no data rows")
@@ -1,4 +1,12 @@
+# RUN: python model.py                       (interactive plots)
+#      python model.py --headless --jobs -1   (unattended: plots to files, JSON report)
+
+import argparse
+import hashlib
+import json
+import os
 import re
+import time
 import pandas as pd
 import numpy as np
 import joblib
@@ -13,15 +21,22 @@ from sklearn.linear_model import LogisticRegression
 from sklearn.ensemble import RandomForestClassifier, VotingClassifier
 from sklearn.calibration import CalibratedClassifierCV
 from sklearn.preprocessing import StandardScaler
+from compact_model import export_compact_model
 
 DATA_PATH = '../Data-Processing/Dataset/cleaned_microbes_and_gut.csv'
 CV_FOLDS = 5
 RANDOM_STATE = 42
 MAX_FEATURES = 20  
+VARIANCE_THRESHOLD = 0.01
+CACHE_DIR = '.cache'
+
+# Set from the command line in main()
+N_JOBS = -1
+PLOTS_DIR = None
 
-def load_and_clean_data():
+def load_and_clean_data(data_path=DATA_PATH):
     """Load and clean column names to ensure consistency"""
-    df = pd.read_csv(DATA_PATH)
+    df = pd.read_csv(data_path)
     raw_cols = df.columns.astype(str).tolist()
     cleaned = [re.sub(r'[\[\],<>]', '', c).strip() for c in raw_cols]
     counts = {}
@@ -36,7 +51,7 @@ def load_and_clean_data():
 def preprocess_data(df):
     """Handle missing values, feature selection, and scaling"""
     # Removes columns where variance is less than 0.01 (barely change across samples) -> not helpful for predictions
-    selector = VarianceThreshold(threshold=0.01)
+    selector = VarianceThreshold(threshold=VARIANCE_THRESHOLD)
     X_sel = selector.fit_transform(df.drop(columns=['subject', 'gut_health_binary']))
     features = list(df.drop(columns=['subject', 'gut_health_binary']).columns[selector.get_support()])
     # Select top informative features using ANOVA F-test
@@ -48,11 +63,43 @@ def preprocess_data(df):
     X_sel = scaler.fit_transform(X_sel)
     return X_sel, features, scaler  
 
+def file_hash(path):
+    """Content hash of the training data, used as the feature-selection cache key."""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:16]
+
+def cached_preprocess(df, data_path, cache_dir=CACHE_DIR):
+    """preprocess_data, reusing the previous result for the same data and settings"""
+    key = f"{file_hash(data_path)}_vt{VARIANCE_THRESHOLD}_k{MAX_FEATURES}"
+    cache_path = os.path.join(cache_dir, f"features_{key}.joblib")
+    if os.path.exists(cache_path):
+        print(f"[cache] Using feature selection from {cache_path}")
+        return joblib.load(cache_path)
+    result = preprocess_data(df)
+    os.makedirs(cache_dir, exist_ok=True)
+    joblib.dump(result, cache_path)
+    return result
+
+def finish_plot(name):
+    """Show the current figure, or save it to PLOTS_DIR when running headless"""
+    if PLOTS_DIR:
+        os.makedirs(PLOTS_DIR, exist_ok=True)
+        path = os.path.join(PLOTS_DIR, f"{re.sub(r'[^A-Za-z0-9]+', '_', name).strip('_').lower()}.png")
+        plt.savefig(path, dpi=120)
+        plt.close()
+        print(f"Plot saved to {path}")
+    else:
+        plt.show()
+
 def evaluate_model(model, X, y, cv_method, model_name=""):
     """Comprehensive model evaluation with multiple metrics"""
     print(f"\nEvaluating {model_name or model.__class__.__name__} with {cv_method.__class__.__name__}")
-    # Get cross-validated predictions
-    y_pred = cross_val_predict(model, X, y, cv=cv_method, method='predict_proba')[:,1]
+    start = time.perf_counter()
+    # Get cross-validated predictions (folds fitted in parallel)
+    y_pred = cross_val_predict(model, X, y, cv=cv_method, method='predict_proba', n_jobs=N_JOBS)[:,1]
     y_pred_class = (y_pred > 0.5).astype(int)
     # Calculate metrics
     acc = accuracy_score(y, y_pred_class)
@@ -61,7 +108,8 @@ def evaluate_model(model, X, y, cv_method, model_name=""):
     f1 = f1_score(y, y_pred_class, zero_division=0)
     fpr, tpr, _ = roc_curve(y, y_pred)
     roc_auc = auc(fpr, tpr)
-    print(f"Accuracy: {acc:.3f}, Precision: {prec:.3f}, Recall: {rec:.3f}, F1: {f1:.3f}, AUC: {roc_auc:.3f}")
+    seconds = time.perf_counter() - start
+    print(f"Accuracy: {acc:.3f}, Precision: {prec:.3f}, Recall: {rec:.3f}, F1: {f1:.3f}, AUC: {roc_auc:.3f} ({seconds:.1f}s)")
     # Plot ROC curve
     plt.figure()
     plt.plot(fpr, tpr, label=f'ROC (AUC={roc_auc:.2f})')
@@ -70,8 +118,12 @@ def evaluate_model(model, X, y, cv_method, model_name=""):
     plt.ylabel('True Positive Rate')
     plt.title(f'ROC Curve - {model_name or model.__class__.__name__}')
     plt.legend()
-    plt.show()
-    return model
+    finish_plot(f'roc_{model_name or model.__class__.__name__}')
+    return {
+        'cv': cv_method.__class__.__name__,
+        'accuracy': acc, 'precision': prec, 'recall': rec, 'f1': f1, 'auc': roc_auc,
+        'seconds': seconds
+    }
 
 def train_final_model(X, y, features, scaler):
     """Train an optimized ensemble model"""
@@ -119,6 +171,25 @@ def train_final_model(X, y, features, scaler):
     calibrated.fit(X_res, y_res)
     return calibrated
 
+def ensemble_feature_importances(model):
+    """Feature importance averaged over the tree members of the fitted ensembles.
+
+    A CalibratedClassifierCV keeps one fitted VotingClassifier per
+    calibration fold (its `estimator` attribute is only the unfitted
+    template), so the importances of every fold's fitted members are averaged.
+    """
+    folds = getattr(model, 'calibrated_classifiers_', None)
+    ensembles = [fold.estimator for fold in folds] if folds else [model]
+    importances = [
+        est.feature_importances_
+        for ensemble in ensembles
+        for est in getattr(ensemble, 'estimators_', [ensemble])
+        if hasattr(est, 'feature_importances_')
+    ]
+    if not importances:
+        raise AttributeError("No feature importance available")
+    return np.mean(importances, axis=0)
+
 def save_model_with_metadata(model, features, scaler, filepath):
     """Save model with all necessary metadata"""
     model_data = {
@@ -133,19 +204,48 @@ def save_model_with_metadata(model, features, scaler, filepath):
     }
     joblib.dump(model_data, filepath)
     print(f"Model saved to {filepath} with all metadata")
+    # Numpy-only artifact served with MICROBIOME_MODEL_ENGINE=compact (see compact_model.py)
+    compact_path = os.path.splitext(filepath)[0] + '_compact.npz'
+    export_compact_model(model_data, compact_path)
+    print(f"Compact model saved to {compact_path}")
 
 def main():
+    global N_JOBS, PLOTS_DIR
+    parser = argparse.ArgumentParser(description="Train and evaluate the gut-health model")
+    parser.add_argument('--data', default=DATA_PATH, help="Cleaned microbes + gut health CSV")
+    parser.add_argument('--output', default='microbiome_model.pkl')
+    parser.add_argument('--jobs', type=int, default=-1, help="Parallel CV fits (-1 = all cores)")
+    parser.add_argument('--headless', action='store_true', help="Write plots to files instead of showing them")
+    parser.add_argument('--plots-dir', default='plots')
+    parser.add_argument('--cache-dir', default=CACHE_DIR)
+    parser.add_argument('--report', default='training_report.json', help="Where to write the JSON report")
+    args = parser.parse_args()
+
+    N_JOBS = args.jobs
+    if args.headless:
+        plt.switch_backend('Agg')
+        PLOTS_DIR = args.plots_dir
+
+    timings = {}
+    report = {'data': args.data, 'jobs': N_JOBS, 'evaluations': {}}
+    total_start = time.perf_counter()
     # 1. Load and clean data
-    df = load_and_clean_data()
+    start = time.perf_counter()
+    df = load_and_clean_data(args.data)
+    timings['load_seconds'] = time.perf_counter() - start
     # 2. Preprocess data
-    X, features, scaler = preprocess_data(df)  
+    start = time.perf_counter()
+    X, features, scaler = cached_preprocess(df, args.data, args.cache_dir)
+    timings['feature_selection_seconds'] = time.perf_counter() - start
     y = (df['gut_health_binary'] == 'Good').astype(int)
     print(f"\nClass Distribution: {np.bincount(y)} (Bad, Good)")
     print(f"Selected {len(features)} features:")
     print(features)
+    report['class_distribution'] = np.bincount(y).tolist()
+    report['features'] = features
     # 3. Evaluate simple models first
     print("\n=== SIMPLE MODEL EVALUATION ===")
-    lr = evaluate_model(
+    report['evaluations']['Logistic Regression'] = evaluate_model(
         LogisticRegression(penalty='l2', C=0.1, solver='liblinear'),
         X, y, LeaveOneOut(),
         model_name="Logistic Regression"
@@ -153,17 +253,19 @@ def main():
     # Use smaller k-fold for RandomForest to ensure each class is represented
     min_class_count = np.bincount(y).min()
     n_splits = min(CV_FOLDS, min_class_count)
-    rf = evaluate_model(
+    report['evaluations']['Random Forest'] = evaluate_model(
         RandomForestClassifier(n_estimators=100, max_depth=3),
         X, y, StratifiedKFold(n_splits=n_splits),
         model_name="Random Forest"
     )
     # 4. Train and evaluate final ensemble
     print("\n=== FINAL ENSEMBLE TRAINING ===")
+    start = time.perf_counter()
     final_model = train_final_model(X, y, features, scaler)
+    timings['final_training_seconds'] = time.perf_counter() - start
     # 5. Final evaluation with StratifiedKFold
     print("\n=== FINAL MODEL EVALUATION ===")
-    evaluate_model(
+    report['evaluations']['Final Ensemble'] = evaluate_model(
         final_model, 
         X, y, 
         StratifiedKFold(n_splits=n_splits),
@@ -171,33 +273,27 @@ def main():
     )
     # 6. Feature importance
     try:
-        # Handle different model types for feature importance
-        if hasattr(final_model.base_estimator, 'feature_importances_'):
-            importances = final_model.base_estimator.feature_importances_
-        elif hasattr(final_model, 'feature_importances_'):
-            importances = final_model.feature_importances_
-        elif hasattr(final_model, 'estimators_'):
-            # For voting classifier, get average importance
-            importances = np.mean([
-                est.feature_importances_ 
-                for est in final_model.estimators_ 
-                if hasattr(est, 'feature_importances_')
-            ], axis=0)
-        else:
-            raise AttributeError("No feature importance available")
+        importances = ensemble_feature_importances(final_model)
         plt.figure(figsize=(10, 6))
         importance_df = pd.Series(importances, index=features).sort_values()
         importance_df.plot(kind='barh')
         plt.title('Feature Importance')
         plt.tight_layout()
-        plt.show()
+        finish_plot('feature_importance')
         print("\nTop 5 Most Important Features:")
         print(importance_df.nlargest(5))
+        report['top_features'] = importance_df.nlargest(5).to_dict()
     except Exception as e:
         print(f"Could not plot feature importance: {str(e)}")
     # 7. Save model with all necessary metadata
-    save_model_with_metadata(final_model, features, scaler, 'microbiome_model.pkl')
+    save_model_with_metadata(final_model, features, scaler, args.output)
+    # 8. Write the JSON report
+    timings['total_seconds'] = time.perf_counter() - total_start
+    report['timings'] = timings
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2, default=float)
+    print(f"Report written to {args.report} (total {timings['total_seconds']:.1f}s)")
 
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
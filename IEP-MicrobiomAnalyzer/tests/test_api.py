@@ -1,6 +1,6 @@
 import pytest
 from httpx import AsyncClient, ASGITransport
-import os, sys
+import os, sys, json
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from app import app
@@ -29,3 +29,103 @@ async def test_predict_gut_health_file():
     assert response.status_code == 200
     json_data = response.json()
     assert "prediction" in json_data or "error" in json_data
+
+def _present_taxa(path):
+    """Names of the taxa marked present in the first row of a dense CSV."""
+    import pandas as pd
+    df = pd.read_csv(path, encoding="utf-8-sig").drop(columns=["subject"], errors="ignore")
+    row = df.iloc[0]
+    return [name for name in df.columns if row[name] == 1]
+
+@pytest.mark.asyncio
+async def test_predict_gut_health_sparse_matches_dense():
+    if not os.path.exists(TEST_MICROBIOME_FILE):
+        pytest.skip("Microbiome test file not found.")
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        with open(TEST_MICROBIOME_FILE, "rb") as file:
+            dense = await ac.post("/predict-gut-health-file", files={"file": ("micro.csv", file, "text/csv")})
+        sparse = await ac.post(
+            "/predict-gut-health-file",
+            data={"taxa": json.dumps(_present_taxa(TEST_MICROBIOME_FILE)), "taxonomy_version": "v1"}
+        )
+        unknown = await ac.post("/predict-gut-health-file", data={"taxa": json.dumps(["Not a bacterium"])})
+
+    assert sparse.status_code == 200
+    assert sparse.json() == dense.json()
+    assert "error" in unknown.json()
+
+@pytest.mark.asyncio
+async def test_predict_gut_health_batch_streams_every_subject(monkeypatch):
+    import pandas as pd
+    from io import StringIO
+
+    # Build a small cohort from the single-subject fixture
+    row = pd.read_csv(TEST_MICROBIOME_FILE, encoding="utf-8-sig")
+    cohort = pd.concat([row] * 5, ignore_index=True)
+    cohort["subject"] = [f"s{i}" for i in range(5)]
+    buffer = StringIO()
+    cohort.to_csv(buffer, index=False)
+
+    # Force several chunks so chunk boundaries are exercised
+    monkeypatch.setattr(sys.modules["app"], "BATCH_CHUNK_ROWS", 2)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        with open(TEST_MICROBIOME_FILE, "rb") as file:
+            single = (await ac.post(
+                "/predict-gut-health-file", files={"file": ("micro.csv", file, "text/csv")}
+            )).json()
+        response = await ac.post(
+            "/predict-gut-health-batch",
+            files={"file": ("cohort.csv", buffer.getvalue().encode(), "text/csv")}
+        )
+
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["subject"] for r in results] == [f"s{i}" for i in range(5)]
+    for r in results:
+        assert r["probability"] == single["probability"]
+
+@pytest.mark.asyncio
+async def test_predict_gut_health_batch_reports_missing_features():
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        response = await ac.post(
+            "/predict-gut-health-batch",
+            files={"file": ("cohort.csv", b"subject,not_a_microbe\ns0,1\n", "text/csv")}
+        )
+
+    assert response.status_code == 200
+    [result] = [json.loads(line) for line in response.text.splitlines()]
+    assert result["error"].startswith("Missing required features")
+
+@pytest.mark.asyncio
+async def test_predict_gut_health_from_feature_store(monkeypatch, tmp_path):
+    from feature_store import FeatureStore
+
+    store = FeatureStore(str(tmp_path / "features.db"))
+    with open(TEST_MICROBIOME_FILE, "rb") as file:
+        contents = file.read()
+    version = store.put_csv(42, contents)
+    # Storing the same profile again does not create a new version
+    assert store.put_csv(42, contents) == version
+    # Absent taxa written as empty cells are the same profile, directly or stored
+    header, _, row = contents.partition(b"\n")
+    blanked = header + b"\n" + row.replace(b",0", b",")
+    assert store.put_csv(42, blanked) == version
+    monkeypatch.setattr(sys.modules["app"], "feature_store", store)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        dense = await ac.post("/predict-gut-health-file", files={"file": ("micro.csv", contents, "text/csv")})
+        dense_blanked = await ac.post("/predict-gut-health-file", files={"file": ("micro.csv", blanked, "text/csv")})
+        stored = await ac.post("/predict-gut-health-file", data={"profile_user_id": 42, "profile_version": version})
+        latest = await ac.post("/predict-gut-health-file", data={"profile_user_id": 42})
+        unknown = await ac.post("/predict-gut-health-file", data={"profile_user_id": 7})
+
+    assert dense_blanked.json() == dense.json()
+    assert stored.json() == {**dense.json(), "profile_version": version}
+    assert latest.json() == stored.json()
+    assert "error" in unknown.json()
@@ -0,0 +1,25 @@
+import numpy as np
+import joblib
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from compact_model import compile_model, CompactModel, _random_inputs
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "microbiome_model.pkl")
+
+def test_compact_model_matches_calibrated_ensemble(tmp_path):
+    model_data = joblib.load(MODEL_PATH)
+    compact = compile_model(model_data)
+    assert compact.features == list(model_data["features"])
+
+    # Held-out presence/absence profiles never seen in training
+    X = _random_inputs(500, len(compact.features), seed=1)
+    expected = model_data["model"].predict_proba(model_data["scaler"].transform(X))
+    np.testing.assert_allclose(compact.predict_proba(X), expected, rtol=0, atol=1e-6)
+
+    # Round trip through the artifact, including single-row inputs
+    path = tmp_path / "compact.npz"
+    compact.save(path)
+    loaded = CompactModel.load(path)
+    np.testing.assert_allclose(loaded.predict_proba(X[:1]), expected[:1], rtol=0, atol=1e-6)
+    np.testing.assert_allclose(loaded.predict_proba(X), expected, rtol=0, atol=1e-6)
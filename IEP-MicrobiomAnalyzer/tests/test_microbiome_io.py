@@ -0,0 +1,38 @@
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from microbiome_io import HeaderCache, clean_name, header_line
+
+def test_header_cache_resolves_once_per_header():
+    cache = HeaderCache(["A b", "C", "Z"], normalize=clean_name)
+    contents = "﻿subject,[A b] ,C,D\r\n1,1,0,1\n".encode("utf-8")
+
+    layout = cache.resolve(header_line(contents))
+    assert layout.indices.tolist() == [1, 2, -1]
+    assert layout.missing == ["Z"]
+
+    assert cache.resolve(header_line(contents)) is layout
+    assert (cache.hits, cache.misses) == (1, 1)
+
+def test_header_cache_evicts_least_recently_used():
+    cache = HeaderCache(["x"], maxsize=2)
+    for header in (b"x,a", b"x,b", b"x,a", b"x,c"):
+        cache.resolve(header)
+    cache.resolve(b"x,a")
+    assert (cache.hits, cache.misses) == (2, 3)
+    cache.resolve(b"x,b")
+    assert cache.misses == 4
+
+def test_read_projected_streams_only_feature_columns():
+    from io import StringIO
+    from microbiome_io import read_projected, read_first_row
+
+    cache = HeaderCache(["b", "missing", "d"])
+    text = "subject,a,b,c,d\ns1,9,1,9,0\ns2,9,0,9,1\ns3,9,1,9,1\n"
+    layout = cache.resolve(header_line(text.encode()))
+
+    chunks = list(read_projected(StringIO(text), layout, chunk_rows=2))
+    assert [subjects for subjects, _ in chunks] == [["s1", "s2"], ["s3"]]
+    assert chunks[0][1].tolist() == [[1, 0, 0], [0, 0, 1]]
+    assert chunks[1][1].tolist() == [[1, 0, 1]]
+    assert read_first_row(text.encode(), layout).tolist() == [1, 0, 0]
@@ -0,0 +1,26 @@
+import numpy as np
+import pandas as pd
+import joblib
+import os, sys
+
+sys.path.append(os.path.dirname(os.path.dirname(__file__)))
+from model import ensemble_feature_importances
+
+MODEL_PATH = os.path.join(os.path.dirname(os.path.dirname(__file__)), "microbiome_model.pkl")
+
+def test_feature_importances_come_from_fitted_fold_ensembles():
+    model_data = joblib.load(MODEL_PATH)
+    model = model_data["model"]
+    importances = ensemble_feature_importances(model)
+
+    assert importances.shape == (len(model_data["features"]),)
+    assert np.all(importances >= 0) and importances.sum() > 0
+    # Mean over the tree members of every calibration fold, not the unfitted template
+    members = [est.feature_importances_ for fold in model.calibrated_classifiers_
+               for est in fold.estimator.estimators_ if hasattr(est, "feature_importances_")]
+    np.testing.assert_allclose(importances, np.mean(members, axis=0))
+
+    # What the training report records as top_features
+    top_features = pd.Series(importances, index=model_data["features"]).nlargest(5).to_dict()
+    assert len(top_features) == 5
+    assert set(top_features) <= set(model_data["features"])
@@ -1,23 +1,99 @@
 # RUN: uvicorn app:app --host 0.0.0.0 --port 8002
 
+import asyncio
+from typing import List
+
 from fastapi import FastAPI, Request
 from pydantic import BaseModel
-import openai
 import os
 from dotenv import load_dotenv
-import re
+import json
 import time
 
-from prometheus_client import make_asgi_app, Counter, Summary, Gauge
+from batch_prompt import build_batch_prompt, parse_batch_response, split_by_token_budget
+from food_composition import CompositionTable, estimate_nutrition
+from llm_client import LLMClient, LLMError
+from nutrition_schema import InvalidNutrition, parse_nutrition
+from singleflight import SingleFlight, canonical_caption
+from prometheus_client import make_asgi_app, Counter, Summary, Gauge, Histogram
+from stage_metrics import StageMetrics
+from tracing import Tracing
 
 # === Monitoring Metrics ===
 REQUEST_COUNT = Counter("nutrition_predictor_request_count", "Total number of prediction requests to Nutrition Predictor")
 REQUEST_LATENCY = Summary("nutrition_predictor_request_latency_seconds", "Prediction request latency in seconds")
 LAST_PREDICTED_CARBS = Gauge("nutrition_predictor_last_predicted_carbs_pct", "Last predicted carbohydrates percentage")
+# local / (local + llm) is the fraction of captions served from the composition table
+PREDICTION_SOURCE = Counter(
+    "nutrition_predictor_predictions_total",
+    "Nutrition predictions by where they were computed",
+    ["source"]
+)
+LOCAL_COVERAGE = Histogram(
+    "nutrition_predictor_local_coverage_ratio",
+    "Share of a caption's ingredient weight found in the composition table",
+    buckets=(0.0, 0.2, 0.4, 0.6, 0.8, 0.9, 1.0)
+)
+BATCH_CAPTIONS = Histogram(
+    "nutrition_predictor_batch_captions",
+    "Captions packed into one LLM prompt by /predict-nutrition-batch",
+    buckets=(1, 2, 5, 10, 20, 50, 100)
+)
+BATCH_FALLBACKS = Counter(
+    "nutrition_predictor_batch_fallbacks_total",
+    "Batched captions without a valid answer, retried with a single-caption call"
+)
+INVALID_RESPONSES = Counter(
+    "nutrition_predictor_invalid_responses_total",
+    "LLM answers that broke the nutrition JSON contract",
+    ["reason"]
+)
+# Spans for requests and stages, continued across services via traceparent (see tracing.py)
+tracing = Tracing("nutrition-predictor")
+# Latency by endpoint and by stage: inference (composition table), upstream (LLM), parse (answer validation)
+stage_metrics = StageMetrics("nutrition_predictor", tracing)
 
 # === Load API Key ===
 load_dotenv()
-openai.api_key = os.getenv("OPENAI_API_KEY")
+OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
+
+# === LLM Client ===
+OPENAI_API_URL = os.getenv("OPENAI_API_URL") or "https://api.openai.com/v1/chat/completions"
+# Concurrent completions, per-request timeout (seconds) and retries on 429/5xx
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", 8))
+OPENAI_TIMEOUT         = float(os.getenv("OPENAI_TIMEOUT", 30))
+OPENAI_MAX_RETRIES     = int(os.getenv("OPENAI_MAX_RETRIES", 3))
+
+llm = LLMClient(
+    OPENAI_API_URL, OPENAI_API_KEY,
+    model="gpt-3.5-turbo",
+    max_concurrency=OPENAI_MAX_CONCURRENCY,
+    timeout=OPENAI_TIMEOUT,
+    max_retries=OPENAI_MAX_RETRIES
+)
+
+# === Response Contract ===
+# Times a malformed answer is sent back to the model for repair before giving up
+NUTRITION_REPAIR_ATTEMPTS = int(os.getenv("NUTRITION_REPAIR_ATTEMPTS", 1))
+RESPONSE_EXAMPLE = json.dumps({"protein_pct": 30, "fat_pct": 20, "carbs_pct": 50, "sugar_risk": 0, "refined_carb": 1})
+REPAIR_PROMPT = (
+    "That answer was invalid: {error}. Reply with only a JSON object with the fields "
+    "protein_pct, fat_pct, carbs_pct (numbers from 0 to 100 summing to 100), sugar_risk and "
+    "refined_carb (0 or 1), like this: {example}"
+)
+
+# Identical captions in flight at the same time share one LLM call
+inflight = SingleFlight()
+
+# === Batch Prompts ===
+# Estimated tokens (prompt plus answer) per multi-caption prompt, and captions per prompt
+BATCH_TOKEN_BUDGET = int(os.getenv("BATCH_TOKEN_BUDGET", 3000))
+BATCH_MAX_CAPTIONS = int(os.getenv("BATCH_MAX_CAPTIONS", 25))
+
+# === Local Composition Table ===
+# Captions whose ingredient weight is at least this share known locally skip the LLM (above 1 disables)
+LOCAL_NUTRITION_MIN_COVERAGE = float(os.getenv("LOCAL_NUTRITION_MIN_COVERAGE", 0.8))
+composition_table = CompositionTable.load()
 
 # === FastAPI App Setup ===
 app = FastAPI()
@@ -30,19 +106,56 @@ app.mount("/metrics", metrics_app)
 @app.middleware("http")
 async def prometheus_middleware(request: Request, call_next):
     REQUEST_COUNT.inc()
+    endpoint = stage_metrics.begin(request)
     start_time = time.time()
     response = await call_next(request)
-    REQUEST_LATENCY.observe(time.time() - start_time)
+    elapsed = time.time() - start_time
+    REQUEST_LATENCY.observe(elapsed)
+    stage_metrics.observe_request(endpoint, request.method, response.status_code, elapsed)
     return response
 
+# Declared after prometheus_middleware so the request span wraps it and the stages
+@app.middleware("http")
+async def tracing_middleware(request: Request, call_next):
+    with tracing.server_span(request) as span:
+        response = await call_next(request)
+        span.set_attribute("http.status_code", response.status_code)
+        return response
+
+@app.on_event("shutdown")
+def close_tracing():
+    tracing.shutdown()
+
+@app.on_event("shutdown")
+async def close_llm_client():
+    await llm.aclose()
+
 # === API Endpoints ===
 
 class FoodDescription(BaseModel):
     caption: str
 
-@app.post("/predict-nutrition")
-def predict_nutrition(payload: FoodDescription):
-    caption = payload.caption
+class FoodDescriptionBatch(BaseModel):
+    captions: List[str]
+
+def local_nutrition(caption):
+    """Response for a caption answered from the composition table, or None."""
+    with stage_metrics.stage("inference"):
+        nutrition, coverage = estimate_nutrition(caption, composition_table, LOCAL_NUTRITION_MIN_COVERAGE)
+    LOCAL_COVERAGE.observe(coverage)
+    if nutrition is None:
+        return None
+    PREDICTION_SOURCE.labels("local").inc()
+    LAST_PREDICTED_CARBS.set(nutrition["carbs_pct"])
+    return {
+        "nutrition": nutrition,
+        "result": ", ".join(f"{key} = {value}" for key, value in nutrition.items()),
+        "source": "local"
+    }
+
+async def llm_nutrition(caption):
+    """Response for a caption estimated by one LLM call; raises LLMError when the call fails."""
+    PREDICTION_SOURCE.labels("llm").inc()
     prompt = f"""
         You are a nutrition expert. Given the following food description, estimate the approximate macronutrient distribution of the meal:
 
@@ -55,52 +168,117 @@ def predict_nutrition(payload: FoodDescription):
 
         Assume the description includes visible ingredients, portion hints, and preparation (e.g., “with olive oil”, “large serving”). If no portion is provided, guess reasonably.
 
-        Format your output like this:
-        [protein_pct = , fat_pct = , carbs_pct = , sugar_risk = , refined_carb = ]
+        Answer with only a JSON object with exactly these fields, like this:
+        {RESPONSE_EXAMPLE}
 
         Food description: {caption}
     """
-    try:
-        response = openai.ChatCompletion.create(
-            model="gpt-3.5-turbo",
-            messages=[
-                {"role": "system", "content": "You are a nutrition expert."},
-                {"role": "user", "content": prompt}
-            ],
-            temperature=0.2,
-        )
-        result = response['choices'][0]['message']['content'].strip()
-        result = result.replace("[", "").replace("]", "")
-
-        def extract_pct(label):
-            match = re.search(rf"{label}\s*=\s*(\d+)", result)
-            return int(match.group(1)) if match else -1 
-
-        def extract_binary(label):
-            match = re.search(rf"{label}\s*=\s*(1|0)", result)
-            return int(match.group(1)) if match else -1
-
-        # Extract nutrition values
-        nutrition = {
-            "protein_pct": extract_pct("protein_pct"),
-            "fat_pct": extract_pct("fat_pct"),
-            "carbs_pct": extract_pct("carbs_pct"),
-            "sugar_risk": extract_binary("sugar_risk"),
-            "refined_carb": extract_binary("refined_carb")
-        }
-
-        # === Update Prometheus Metric ===
-        if nutrition["carbs_pct"] != -1:
-            LAST_PREDICTED_CARBS.set(nutrition["carbs_pct"])
-
-        return {
-            "nutrition": nutrition,
-            "result": result
-        }
+    messages = [
+        {"role": "system", "content": "You are a nutrition expert."},
+        {"role": "user", "content": prompt}
+    ]
+
+    # Malformed answers are sent back with the validation error, a bounded number of times
+    for attempt in range(NUTRITION_REPAIR_ATTEMPTS + 1):
+        with stage_metrics.stage("upstream"):
+            result = await llm.chat(messages, temperature=0.2, response_format={"type": "json_object"})
+        result = result.strip()
+        try:
+            with stage_metrics.stage("parse"):
+                nutrition = parse_nutrition(result)
+            break
+        except InvalidNutrition as e:
+            INVALID_RESPONSES.labels(e.reason).inc()
+            if attempt == NUTRITION_REPAIR_ATTEMPTS:
+                raise InvalidNutrition(f"Invalid nutrition response: {str(e)}", e.reason)
+            messages = messages + [
+                {"role": "assistant", "content": result},
+                {"role": "user", "content": REPAIR_PROMPT.format(error=str(e), example=RESPONSE_EXAMPLE)}
+            ]
+
+    # === Update Prometheus Metric ===
+    LAST_PREDICTED_CARBS.set(nutrition["carbs_pct"])
+
+    return {
+        "nutrition": nutrition,
+        "result": result,
+        "source": "llm"
+    }
 
+@app.post("/predict-nutrition")
+async def predict_nutrition(payload: FoodDescription):
+    caption = payload.caption
+
+    # Plain ingredient lists are answered from the composition table
+    response = local_nutrition(caption)
+    if response is not None:
+        return response
+
+    try:
+        return await inflight.do(canonical_caption(caption), lambda: llm_nutrition(caption))
     except Exception as e:
         return {"error": str(e)}
 
+async def predict_batch_group(group, results):
+    """Estimate one group of (index, caption) with a single prompt; fill `results` in place.
+
+    Captions whose answer is missing or invalid are retried with one call each.
+    """
+    BATCH_CAPTIONS.observe(len(group))
+    try:
+        with stage_metrics.stage("upstream"):
+            text = await llm.chat(
+                [
+                    {"role": "system", "content": "You are a nutrition expert."},
+                    {"role": "user", "content": build_batch_prompt(group)}
+                ],
+                temperature=0.2,
+            )
+    except LLMError as e:
+        for index, _ in group:
+            results[index] = {"error": str(e)}
+        return
+
+    try:
+        with stage_metrics.stage("parse"):
+            parsed = parse_batch_response(text, [index for index, _ in group])
+    except InvalidNutrition as e:
+        INVALID_RESPONSES.labels(e.reason).inc()
+        parsed = {}
+    for index, nutrition in parsed.items():
+        PREDICTION_SOURCE.labels("llm_batch").inc()
+        results[index] = {"nutrition": nutrition, "source": "llm_batch"}
+
+    async def fallback(index, caption):
+        try:
+            results[index] = await inflight.do(canonical_caption(caption), lambda: llm_nutrition(caption))
+        except Exception as e:
+            results[index] = {"error": str(e)}
+
+    failed = [(index, caption) for index, caption in group if index not in parsed]
+    BATCH_FALLBACKS.inc(len(failed))
+    await asyncio.gather(*(fallback(index, caption) for index, caption in failed))
+
+@app.post("/predict-nutrition-batch")
+async def predict_nutrition_batch(payload: FoodDescriptionBatch):
+    """Nutrition for many captions: local table first, then multi-caption LLM prompts.
+
+    Results are returned in the order of `captions`; each is a prediction
+    (with its `source`) or an `error`.
+    """
+    captions = payload.captions
+    results = [None] * len(captions)
+    pending = []
+    for index, caption in enumerate(captions):
+        results[index] = local_nutrition(caption)
+        if results[index] is None:
+            pending.append((index, caption))
+
+    groups = split_by_token_budget(pending, BATCH_TOKEN_BUDGET, BATCH_MAX_CAPTIONS)
+    await asyncio.gather(*(predict_batch_group(group, results) for group in groups))
+
+    return {"results": [{"caption": caption, **result} for caption, result in zip(captions, results)]}
+
 @app.get("/health")
 def health_check():
     return {"status": "ok"}
\ No newline at end of file
@@ -0,0 +1,83 @@
+# Packing several captions into one LLM prompt with a JSON-array answer, and
+# mapping the answer back to the captions.
+
+import json
+
+from nutrition_schema import InvalidNutrition, decode_json, normalize_nutrition
+
+# Rough token count for budgeting (about 4 characters per token for English)
+CHARS_PER_TOKEN = 4
+# Tokens one answer object takes ({"id": 12, "protein_pct": 30, ...})
+ANSWER_TOKENS_PER_ITEM = 40
+
+BATCH_INSTRUCTIONS = """
+You are a nutrition expert. For each food description in the JSON array below, estimate the approximate macronutrient distribution of the meal:
+
+- protein_pct = percentage of total macronutrients that is protein (0-100)
+- fat_pct = percentage of total macronutrients that is fat (0-100)
+- carbs_pct = percentage of total macronutrients that is carbohydrates (0-100)
+- sugar_risk = 1 if the food likely contains added sugar or naturally high sugar, else 0
+- refined_carb = 1 if the food includes refined carbs (e.g., white pasta, white bread), else 0
+
+Assume each description includes visible ingredients, portion hints, and preparation. If no portion is provided, guess reasonably.
+
+Answer with only a JSON array holding one object per description, in any order, each with the description's "id":
+[{"id": 0, "protein_pct": 0, "fat_pct": 0, "carbs_pct": 0, "sugar_risk": 0, "refined_carb": 0}]
+
+Descriptions:
+"""
+
+def estimate_tokens(text):
+    return len(text) // CHARS_PER_TOKEN + 1
+
+def split_by_token_budget(captions, token_budget, max_items):
+    """Group (id, caption) pairs so each prompt plus its answer fits `token_budget` tokens.
+
+    A caption too long for any batch still gets a group of its own.
+    """
+    base = estimate_tokens(BATCH_INSTRUCTIONS)
+    groups, current, used = [], [], base
+    for item_id, caption in captions:
+        cost = estimate_tokens(json.dumps({"id": item_id, "caption": caption})) + ANSWER_TOKENS_PER_ITEM
+        if current and (used + cost > token_budget or len(current) >= max_items):
+            groups.append(current)
+            current, used = [], base
+        current.append((item_id, caption))
+        used += cost
+    if current:
+        groups.append(current)
+    return groups
+
+def build_batch_prompt(items):
+    descriptions = [{"id": item_id, "caption": caption} for item_id, caption in items]
+    return BATCH_INSTRUCTIONS + json.dumps(descriptions, ensure_ascii=False, indent=0)
+
+def parse_batch_response(text, ids):
+    """Map of id -> normalised nutrition dict for the valid answers among `ids`.
+
+    Code fences and text around the array are ignored; raises InvalidNutrition
+    when there is no JSON array at all. Ids that are missing, duplicated or
+    whose object does not validate are left out, so the caller can retry
+    just those.
+    """
+    answers = decode_json(text, "[")
+    if not isinstance(answers, list):
+        raise InvalidNutrition("Expected a JSON array", "schema")
+
+    wanted = set(ids)
+    parsed, seen = {}, set()
+    for obj in answers:
+        if not isinstance(obj, dict):
+            continue
+        item_id = obj.get("id")
+        if item_id not in wanted:
+            continue
+        if item_id in seen:
+            parsed.pop(item_id, None)   # conflicting answers for one id: retry it alone
+            continue
+        seen.add(item_id)
+        try:
+            parsed[item_id] = normalize_nutrition(obj)
+        except InvalidNutrition:
+            continue
+    return parsed
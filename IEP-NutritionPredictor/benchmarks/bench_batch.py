@@ -0,0 +1,92 @@
+# Captions per second through /predict-nutrition (one LLM call per caption) and
+# /predict-nutrition-batch (many captions per prompt) against a local stub model
+# whose latency grows with the number of captions it answers.
+# RUN: python benchmarks/bench_batch.py [--captions 200] [--base-latency 0.5] [--per-caption 0.02] [--json results.json]
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import time
+
+SERVICE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(SERVICE_DIR)
+sys.path.append(os.path.join(SERVICE_DIR, "tests"))
+
+from httpx import ASGITransport, AsyncClient
+
+import app as service
+from fake_llm import FakeLLM
+
+def stub_latency(base, per_caption):
+    """Fixed overhead plus generation time proportional to the captions answered."""
+    def latency(payload):
+        prompt = payload["messages"][-1]["content"]
+        n = len(json.loads(prompt.split("Descriptions:", 1)[1])) if "Descriptions:" in prompt else 1
+        return base + per_caption * n
+    return latency
+
+async def run_single(captions, concurrency):
+    transport = ASGITransport(app=service.app)
+    async with AsyncClient(transport=transport, base_url="http://test", timeout=None) as ac:
+        queue = list(captions)
+
+        async def worker():
+            while queue:
+                caption = queue.pop()
+                response = await ac.post("/predict-nutrition", json={"caption": caption})
+                assert "nutrition" in response.json()
+
+        start = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        return time.perf_counter() - start
+
+async def run_batch(captions):
+    transport = ASGITransport(app=service.app)
+    async with AsyncClient(transport=transport, base_url="http://test", timeout=None) as ac:
+        start = time.perf_counter()
+        response = await ac.post("/predict-nutrition-batch", json={"captions": captions})
+        elapsed = time.perf_counter() - start
+    assert all("nutrition" in r for r in response.json()["results"])
+    return elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark single vs batched nutrition prompts")
+    parser.add_argument("--captions", type=int, default=200)
+    parser.add_argument("--base-latency", type=float, default=0.5, help="Stub model seconds per call")
+    parser.add_argument("--per-caption", type=float, default=0.02, help="Stub model seconds per caption answered")
+    parser.add_argument("--json", help="Write results to this file")
+    args = parser.parse_args()
+
+    # Captions the local composition table cannot answer, so every one needs the model
+    captions = [f"Chef's special number {i} from the market stall" for i in range(args.captions)]
+    fake = FakeLLM(latency=stub_latency(args.base_latency, args.per_caption)).start()
+    service.llm.url = fake.url
+    results = []
+    try:
+        for name, run in (
+            ("single", lambda: run_single(captions, service.OPENAI_MAX_CONCURRENCY)),
+            ("batch", lambda: run_batch(captions)),
+        ):
+            calls_before = len(fake.requests)
+            service.llm._loop = None
+            seconds = asyncio.run(run())
+            calls = len(fake.requests) - calls_before
+            results.append({"path": name, "captions": len(captions), "seconds": seconds,
+                            "captions_per_second": len(captions) / seconds, "llm_calls": calls})
+    finally:
+        fake.stop()
+
+    print(f"stub model: {args.base_latency * 1e3:.0f} ms + {args.per_caption * 1e3:.0f} ms per caption, "
+          f"{service.OPENAI_MAX_CONCURRENCY} concurrent calls, batches of up to {service.BATCH_MAX_CAPTIONS}")
+    print(f"{'path':8s} {'captions':>9s} {'seconds':>8s} {'captions/s':>11s} {'LLM calls':>10s}")
+    for r in results:
+        print(f"{r['path']:8s} {r['captions']:9d} {r['seconds']:8.2f} {r['captions_per_second']:11.1f} {r['llm_calls']:10d}")
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+if __name__ == "__main__":
+    main()
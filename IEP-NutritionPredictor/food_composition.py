@@ -0,0 +1,212 @@
+# Local nutrition estimate for captions made of known ingredients: a food
+# composition table with exact and trigram-fuzzy name lookup, so plain
+# ingredient lists do not need an LLM call.
+
+import csv
+import os
+import re
+from functools import lru_cache
+
+from nutrition_schema import round_to_100
+
+# Table shipped with the service (per 100 g values and a typical portion)
+FOOD_COMPOSITION_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "food_composition.csv")
+
+# Preparation and quantity words that do not change which food an item is
+STOP_WORDS = {
+    "a", "an", "the", "of", "some", "fresh", "plain", "raw", "cooked", "grilled", "steamed",
+    "roasted", "roast", "baked", "boiled", "fried", "sauteed", "mashed", "sliced", "chopped",
+    "diced", "drizzled", "topped", "served", "small", "large", "medium", "big", "serving",
+    "portion", "piece", "pieces", "slice", "slices", "bowl", "plate", "cup", "side", "homemade",
+}
+# Generic labels the food analyzer returns that are not ingredients; they neither
+# count towards coverage nor against it
+IGNORED_LABELS = {
+    "food", "dish", "meal", "dinner", "lunch", "breakfast", "delicious", "healthy", "cuisine",
+    "snack", "epicure", "nutrition", "no person", "table", "dessert", "refreshment",
+}
+
+# "A dish containing rice (91.0%), ..." captions built by the controller
+CAPTION_PREFIX = re.compile(r"^\s*a dish containing\b", re.IGNORECASE)
+LABEL_PATTERN = re.compile(r"([^,()]+?)\s*\((\d+(?:\.\d+)?)%\)")
+ITEM_SEPARATOR = re.compile(r",|;|\.|&|\band\b|\bwith\b|\bplus\b|\bon\b|\bin\b")
+
+# Items that decide the binary flags must carry at least this share of confidence
+MIN_FLAG_WEIGHT = 0.2
+# Sugar in one portion of an item above which the meal counts as high in sugar
+SUGAR_RISK_GRAMS = 8.0
+# Fewer macronutrient grams than this (black coffee, water) is left to the LLM
+MIN_MACRO_GRAMS = 2.0
+
+def normalize_name(name):
+    words = re.sub(r"[^a-z ]+", " ", name.lower()).split()
+    return " ".join(w for w in words if w not in STOP_WORDS)
+
+def trigrams(name):
+    padded = f"  {name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+class FoodEntry:
+    def __init__(self, name, portion_g, protein_g, fat_g, carbs_g, sugar_g, refined):
+        self.name = name
+        self.portion_g = portion_g
+        self.protein_g = protein_g
+        self.fat_g = fat_g
+        self.carbs_g = carbs_g
+        self.sugar_g = sugar_g
+        self.refined = refined
+
+class CompositionTable:
+    """Food composition entries indexed by normalised name, alias and trigram.
+
+    `lookup` maps an ingredient phrase to the entries it is made of: an exact
+    match on the normalised name, else the entry whose name or alias has the
+    highest trigram Dice similarity (at least `min_similarity`) and, for
+    phrases of several words, also covers `min_phrase_cover` of the phrase's
+    trigrams. Otherwise the phrase is segmented into words and known
+    multi-word names ("sweet potato"), and every segment must match on its
+    own; "egg fried rice" is egg and rice, while "chicken nuggets" matches
+    nothing rather than plain chicken. Results are memoised, so repeated
+    labels cost a dictionary hit.
+    """
+
+    def __init__(self, entries, min_similarity=0.6, min_phrase_cover=0.8):
+        self.min_similarity = min_similarity
+        self.min_phrase_cover = min_phrase_cover
+        self._names = {}      # normalised name or alias -> entry
+        self._trigrams = {}   # trigram -> normalised names containing it
+        self._max_words = 1   # longest name or alias, in words
+        for entry, aliases in entries:
+            for name in [entry.name] + aliases:
+                key = normalize_name(name)
+                if not key or key in self._names:
+                    continue
+                self._names[key] = entry
+                self._max_words = max(self._max_words, len(key.split()))
+                for gram in trigrams(key):
+                    self._trigrams.setdefault(gram, []).append(key)
+        self.lookup = lru_cache(maxsize=4096)(self._lookup)
+
+    @classmethod
+    def load(cls, path=FOOD_COMPOSITION_PATH, min_similarity=0.6):
+        entries = []
+        with open(path, newline="") as f:
+            for row in csv.DictReader(f):
+                entry = FoodEntry(
+                    row["name"], float(row["portion_g"]), float(row["protein_g"]), float(row["fat_g"]),
+                    float(row["carbs_g"]), float(row["sugar_g"]), row["refined"] == "1"
+                )
+                entries.append((entry, [a for a in row["aliases"].split("|") if a]))
+        return cls(entries, min_similarity)
+
+    def __len__(self):
+        return len(self._names)
+
+    def _match(self, key):
+        """Entry for one normalised phrase, exact or fuzzy, or None."""
+        if key in self._names:
+            return self._names[key]
+
+        grams = trigrams(key)
+        shared = {}
+        for gram in grams:
+            for candidate in self._trigrams.get(gram, ()):
+                shared[candidate] = shared.get(candidate, 0) + 1
+        # A single word may be misspelt; a phrase must be (nearly) all one food
+        min_cover = self.min_phrase_cover if " " in key else 0.0
+        best, best_score = None, self.min_similarity
+        for candidate, count in shared.items():
+            score = 2 * count / (len(grams) + len(trigrams(candidate)))
+            if score >= best_score and count / len(grams) >= min_cover:
+                best, best_score = candidate, score
+        return self._names[best] if best is not None else None
+
+    def _lookup(self, name):
+        """Entries an ingredient phrase is made of, or None when any part is unknown."""
+        key = normalize_name(name)
+        if not key:
+            return None
+        entry = self._match(key)
+        if entry is not None:
+            return (entry,)
+
+        words = key.split()
+        if len(words) == 1:
+            return None
+        # Longest known names first, then single (possibly misspelt) words
+        entries, i = [], 0
+        while i < len(words):
+            for j in range(min(len(words), i + self._max_words), i, -1):
+                span = " ".join(words[i:j])
+                entry = self._names.get(span) if j - i > 1 else self._match(span)
+                if entry is not None:
+                    break
+            else:
+                return None
+            entries.append(entry)
+            i = j
+        return tuple(entries)
+
+def parse_caption(caption):
+    """(ingredient, weight) items of a caption.
+
+    Controller captions ("A dish containing rice (91.0%), ... Additional
+    description: ...") give labels weighted by confidence; free text is split
+    on commas and conjunctions with weight 1 per item. Generic labels such as
+    "dish" are dropped.
+    """
+    labels_part, _, description = CAPTION_PREFIX.sub("", caption).partition("Additional description:")
+    items = [(name.strip(), float(pct) / 100) for name, pct in LABEL_PATTERN.findall(labels_part)]
+    if not items:
+        description = CAPTION_PREFIX.sub("", caption)
+    items += [(part.strip(), 1.0) for part in ITEM_SEPARATOR.split(description.lower()) if part.strip()]
+    return [(name, weight) for name, weight in items
+            if weight > 0 and normalize_name(name) and name.lower() not in IGNORED_LABELS]
+
+def estimate_nutrition(caption, table, min_coverage):
+    """Nutrition dict computed from the table, plus its coverage.
+
+    Coverage is the share of item weight whose ingredient is in the table.
+    Below `min_coverage` (or with almost no macronutrients) the nutrition is
+    None and the caller should ask the LLM. Each matched item contributes one
+    typical portion scaled by its weight, shared evenly between the foods of
+    a multi-food item; percentages are by grams of protein, fat and
+    carbohydrate.
+    """
+    items = parse_caption(caption)
+    total_weight = sum(weight for _, weight in items)
+    if total_weight == 0:
+        return None, 0.0
+
+    matched = [(table.lookup(name), weight) for name, weight in items]
+    matched = [(entries, weight) for entries, weight in matched if entries is not None]
+    coverage = sum(weight for _, weight in matched) / total_weight
+    if coverage < min_coverage:
+        return None, coverage
+
+    protein = fat = carbs = 0.0
+    sugar_risk = refined_carb = 0
+    for entries, weight in matched:
+        for entry in entries:
+            grams = weight / len(entries) * entry.portion_g / 100
+            protein += grams * entry.protein_g
+            fat += grams * entry.fat_g
+            carbs += grams * entry.carbs_g
+        if weight < MIN_FLAG_WEIGHT:
+            continue
+        for entry in entries:
+            if entry.sugar_g * entry.portion_g / 100 >= SUGAR_RISK_GRAMS:
+                sugar_risk = 1
+            if entry.refined:
+                refined_carb = 1
+    if protein + fat + carbs < MIN_MACRO_GRAMS:
+        return None, coverage
+
+    protein_pct, fat_pct, carbs_pct = round_to_100([protein, fat, carbs])
+    return {
+        "protein_pct": protein_pct,
+        "fat_pct": fat_pct,
+        "carbs_pct": carbs_pct,
+        "sugar_risk": sugar_risk,
+        "refined_carb": refined_carb,
+    }, coverage
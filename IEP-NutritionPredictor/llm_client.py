@@ -0,0 +1,130 @@
+# Shared async client for the OpenAI chat completions API: keep-alive
+# connections, a cap on concurrent calls, request timeouts and retries with
+# jittered backoff on rate limits.
+
+import asyncio
+import random
+import time
+
+import httpx
+from prometheus_client import Counter, Histogram
+
+# === Monitoring Metrics ===
+LLM_QUEUE_WAIT = Histogram(
+    "nutrition_predictor_llm_queue_wait_seconds",
+    "Time a caption waited for a free LLM concurrency slot",
+    buckets=(0.001, 0.01, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+)
+LLM_REQUEST_LATENCY = Histogram(
+    "nutrition_predictor_llm_request_seconds",
+    "Round-trip time of one chat completion request",
+    buckets=(0.25, 0.5, 1.0, 2.0, 4.0, 8.0, 16.0, 30.0, 60.0)
+)
+LLM_RETRIES = Counter(
+    "nutrition_predictor_llm_retries_total",
+    "Chat completion requests retried after a rate limit or server error",
+    ["status"]
+)
+
+# Statuses worth retrying after a pause
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class LLMError(Exception):
+    """Chat completion that did not produce a message."""
+
+    def __init__(self, message, status_code=None):
+        super().__init__(message)
+        self.status_code = status_code
+
+class LLMClient:
+    """Async chat completions client shared by all requests of the service.
+
+    One `httpx.AsyncClient` per event loop reuses connections. At most
+    `max_concurrency` completions are in flight; other captions wait for a
+    slot. Rate limits (429) and server errors are retried up to `max_retries`
+    times, honouring `Retry-After` when present and otherwise sleeping a
+    random time up to an exponentially growing cap (full jitter). A slot is
+    not held while backing off.
+    """
+
+    def __init__(self, url, api_key, model="gpt-3.5-turbo", max_concurrency=8, timeout=30.0,
+                 max_retries=3, backoff_base=0.5, backoff_max=20.0):
+        self.url = url
+        self.api_key = api_key
+        self.model = model
+        self.max_concurrency = max_concurrency
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self._loop = None
+        self._client = None
+        self._semaphore = None
+
+    def _bind(self):
+        """Client and semaphore for the running event loop (created on first use)."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop = loop
+            self._client = httpx.AsyncClient(
+                timeout=httpx.Timeout(self.timeout),
+                limits=httpx.Limits(
+                    max_connections=self.max_concurrency,
+                    max_keepalive_connections=self.max_concurrency
+                ),
+                headers={"Authorization": f"Bearer {self.api_key}"}
+            )
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._client, self._semaphore
+
+    async def aclose(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            self._loop = None
+
+    def _backoff(self, attempt, response):
+        retry_after = response.headers.get("Retry-After")
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), self.backoff_max)
+            except ValueError:
+                pass
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** attempt))
+
+    async def chat(self, messages, temperature=0.2, response_format=None):
+        """Content of the first choice of a chat completion.
+
+        `response_format` is passed through, e.g. {"type": "json_object"} for JSON mode.
+        """
+        client, semaphore = self._bind()
+        payload = {"model": self.model, "messages": messages, "temperature": temperature}
+        if response_format is not None:
+            payload["response_format"] = response_format
+        for attempt in range(self.max_retries + 1):
+            wait_start = time.perf_counter()
+            async with semaphore:
+                LLM_QUEUE_WAIT.observe(time.perf_counter() - wait_start)
+                start = time.perf_counter()
+                try:
+                    response = await client.post(self.url, json=payload)
+                except httpx.TimeoutException:
+                    raise LLMError(f"LLM request timed out after {self.timeout}s", 504)
+                except httpx.HTTPError as e:
+                    raise LLMError(f"LLM request failed: {str(e)}", 502)
+                finally:
+                    LLM_REQUEST_LATENCY.observe(time.perf_counter() - start)
+
+            if response.status_code in RETRY_STATUSES and attempt < self.max_retries:
+                LLM_RETRIES.labels(str(response.status_code)).inc()
+                await asyncio.sleep(self._backoff(attempt, response))
+                continue
+            break
+
+        if response.status_code != 200:
+            raise LLMError(f"LLM request failed with status {response.status_code}: {response.text}",
+                           response.status_code)
+        try:
+            return response.json()["choices"][0]["message"]["content"]
+        except (ValueError, KeyError, IndexError):
+            raise LLMError("Malformed LLM response", 502)
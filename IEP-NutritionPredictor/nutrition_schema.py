@@ -0,0 +1,105 @@
+# JSON response contract for nutrition estimates: the schema the LLM is asked
+# to follow, a validator compiled from it once at import, and normalisation of
+# the percentages to sum to 100.
+
+import json
+import re
+
+NUTRITION_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "protein_pct": {"type": "number", "minimum": 0, "maximum": 100},
+        "fat_pct": {"type": "number", "minimum": 0, "maximum": 100},
+        "carbs_pct": {"type": "number", "minimum": 0, "maximum": 100},
+        "sugar_risk": {"type": "integer", "enum": [0, 1]},
+        "refined_carb": {"type": "integer", "enum": [0, 1]},
+    },
+    "required": ["protein_pct", "fat_pct", "carbs_pct", "sugar_risk", "refined_carb"],
+}
+
+PERCENT_FIELDS = ("protein_pct", "fat_pct", "carbs_pct")
+
+class InvalidNutrition(ValueError):
+    """LLM output that does not satisfy the nutrition contract; `reason` is not_json or schema."""
+
+    def __init__(self, message, reason):
+        super().__init__(message)
+        self.reason = reason
+
+def _compile_property(name, rules):
+    """Check function for one property of the (small) schema subset used here."""
+    kind = rules["type"]
+    low, high = rules.get("minimum"), rules.get("maximum")
+    allowed = set(rules["enum"]) if "enum" in rules else None
+
+    def check(value):
+        # JSON booleans are ints in Python; accept them only for 0/1 flags
+        if isinstance(value, bool):
+            if allowed is None:
+                raise InvalidNutrition(f"{name} must be a number, got {value!r}", "schema")
+            value = int(value)
+        if not isinstance(value, (int, float)) or value != value:
+            raise InvalidNutrition(f"{name} must be a number, got {value!r}", "schema")
+        if kind == "integer":
+            if not float(value).is_integer():
+                raise InvalidNutrition(f"{name} must be an integer, got {value!r}", "schema")
+            value = int(value)
+        if allowed is not None and value not in allowed:
+            raise InvalidNutrition(f"{name} must be one of {sorted(allowed)}, got {value!r}", "schema")
+        if (low is not None and value < low) or (high is not None and value > high):
+            raise InvalidNutrition(f"{name} must be between {low} and {high}, got {value!r}", "schema")
+        return value
+
+    return check
+
+def compile_validator(schema):
+    """Validator for `schema`: maps a decoded object to its checked fields or raises InvalidNutrition."""
+    checks = [(name, _compile_property(name, rules)) for name, rules in schema["properties"].items()]
+    required = schema["required"]
+
+    def validate(obj):
+        if not isinstance(obj, dict):
+            raise InvalidNutrition(f"Expected a JSON object, got {type(obj).__name__}", "schema")
+        missing = [name for name in required if name not in obj]
+        if missing:
+            raise InvalidNutrition(f"Missing fields: {', '.join(missing)}", "schema")
+        return {name: check(obj[name]) for name, check in checks}
+
+    return validate
+
+validate_fields = compile_validator(NUTRITION_SCHEMA)
+
+def round_to_100(values):
+    """Integer percentages of `values` that sum to exactly 100 (largest remainder)."""
+    total = sum(values)
+    shares = [100 * v / total for v in values]
+    rounded = [int(s) for s in shares]
+    by_remainder = sorted(range(len(shares)), key=lambda i: shares[i] - rounded[i], reverse=True)
+    for i in by_remainder[:100 - sum(rounded)]:
+        rounded[i] += 1
+    return rounded
+
+def normalize_nutrition(obj):
+    """Validated nutrition dict with integer percentages rescaled to sum to 100."""
+    nutrition = validate_fields(obj)
+    values = [nutrition[field] for field in PERCENT_FIELDS]
+    if sum(values) <= 0:
+        raise InvalidNutrition("Percentages sum to 0", "schema")
+    nutrition.update(zip(PERCENT_FIELDS, round_to_100(values)))
+    return nutrition
+
+def decode_json(text, opening="{"):
+    """First JSON value starting with `opening` in `text`, ignoring code fences and prose around it."""
+    closing = "}" if opening == "{" else "]"
+    text = re.sub(r"```(?:json)?", "", text)
+    start, end = text.find(opening), text.rfind(closing)
+    if start == -1 or end < start:
+        raise InvalidNutrition("No JSON found in the response", "not_json")
+    try:
+        return json.loads(text[start:end + 1])
+    except ValueError as e:
+        raise InvalidNutrition(f"Response is not valid JSON: {str(e)}", "not_json")
+
+def parse_nutrition(text):
+    """Normalised nutrition dict from an LLM answer; raises InvalidNutrition."""
+    return normalize_nutrition(decode_json(text))
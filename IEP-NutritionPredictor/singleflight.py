@@ -0,0 +1,68 @@
+# Single-flight coalescing: concurrent requests for the same key share one
+# upstream call and its result.
+
+import asyncio
+
+from prometheus_client import Counter, Gauge
+
+# === Monitoring Metrics ===
+SINGLEFLIGHT_WAITERS = Gauge(
+    "nutrition_predictor_singleflight_waiters",
+    "Requests currently waiting on an in-flight LLM call (including the one that started it)"
+)
+SINGLEFLIGHT_SHARED = Counter(
+    "nutrition_predictor_singleflight_shared_total",
+    "Requests answered by joining an identical in-flight LLM call"
+)
+
+def canonical_caption(caption):
+    """Key under which captions count as identical: case, spacing and trailing dots ignored."""
+    return " ".join(caption.lower().split()).strip(" .")
+
+class _Call:
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+class SingleFlight:
+    """Runs at most one `fn()` per key at a time and hands its outcome to every caller.
+
+    The shared call runs as its own task, so a caller that is cancelled or
+    times out (e.g. via `asyncio.wait_for`) stops waiting without cancelling
+    the call for the others. When the last caller leaves before the call is
+    done, the call is cancelled and forgotten, and the next caller starts a
+    fresh one. Results and exceptions are shared as they are; nothing is
+    cached once the call completes.
+    """
+
+    def __init__(self):
+        self._calls = {}
+
+    def __len__(self):
+        return len(self._calls)
+
+    def _forget(self, key, call):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+
+    async def do(self, key, fn):
+        call = self._calls.get(key)
+        if call is None:
+            call = _Call(asyncio.ensure_future(fn()))
+            self._calls[key] = call
+            call.task.add_done_callback(lambda task: self._forget(key, call))
+            # Mark the outcome as retrieved even if every caller has left
+            call.task.add_done_callback(lambda task: task.cancelled() or task.exception())
+        else:
+            SINGLEFLIGHT_SHARED.inc()
+
+        call.waiters += 1
+        SINGLEFLIGHT_WAITERS.inc()
+        try:
+            return await asyncio.shield(call.task)
+        finally:
+            call.waiters -= 1
+            SINGLEFLIGHT_WAITERS.dec()
+            if call.waiters == 0 and not call.task.done():
+                self._forget(key, call)
+                call.task.cancel()
@@ -0,0 +1,62 @@
+# Per-endpoint and per-stage latency histograms. The same module is copied into
+# every service; each creates one StageMetrics with its own metric prefix.
+
+import contextvars
+import time
+from contextlib import contextmanager, nullcontext
+
+from prometheus_client import Histogram
+
+# From sub-millisecond parsing up to slow upstream model calls
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+# Endpoint of the request being handled; copied into worker threads and tasks
+current_endpoint = contextvars.ContextVar("current_endpoint", default="other")
+
+class StageMetrics:
+    """Request latency by endpoint/method/status and stage latency by endpoint/stage.
+
+    `begin(request)` labels the current context with the request's route path
+    (unknown paths become "other" to bound label cardinality) and is called
+    by the service's HTTP middleware, which then records the request with
+    `observe_request`. `stage(name)` times a block and attributes it to the
+    endpoint in context, including code running in `asyncio.to_thread` or
+    the threadpool. With a `tracing.Tracing`, each stage is also a span of
+    the current trace.
+    """
+
+    def __init__(self, prefix, tracing=None):
+        self.tracing = tracing
+        self.requests = Histogram(
+            f"{prefix}_http_request_duration_seconds",
+            "HTTP request latency by endpoint",
+            ["endpoint", "method", "status"],
+            buckets=LATENCY_BUCKETS
+        )
+        self.stages = Histogram(
+            f"{prefix}_stage_duration_seconds",
+            "Latency of one stage of request handling",
+            ["endpoint", "stage"],
+            buckets=LATENCY_BUCKETS
+        )
+        self._routes = None
+
+    def begin(self, request):
+        if self._routes is None:
+            self._routes = {route.path for route in request.app.routes}
+        path = request.url.path
+        endpoint = path if path in self._routes else "other"
+        current_endpoint.set(endpoint)
+        return endpoint
+
+    def observe_request(self, endpoint, method, status, seconds):
+        self.requests.labels(endpoint, method, str(status)).observe(seconds)
+
+    @contextmanager
+    def stage(self, name):
+        start = time.perf_counter()
+        try:
+            with self.tracing.span(name) if self.tracing else nullcontext():
+                yield
+        finally:
+            self.stages.labels(current_endpoint.get(), name).observe(time.perf_counter() - start)
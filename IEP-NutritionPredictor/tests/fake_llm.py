@@ -0,0 +1,92 @@
+# Local stand-in for the OpenAI chat completions endpoint, used by the tests
+# instead of the real API.
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_NUTRITION = {"protein_pct": 20, "fat_pct": 30, "carbs_pct": 50, "sugar_risk": 0, "refined_carb": 1}
+DEFAULT_REPLY = json.dumps(DEFAULT_NUTRITION)
+
+def default_reply(payload):
+    """DEFAULT_REPLY for single captions; a JSON array with one answer per id for batch prompts."""
+    prompt = payload["messages"][-1]["content"]
+    if "Descriptions:" not in prompt:
+        return DEFAULT_REPLY
+    descriptions = json.loads(prompt.split("Descriptions:", 1)[1])
+    return json.dumps([dict(DEFAULT_NUTRITION, id=d["id"]) for d in descriptions])
+
+class FakeLLM:
+    """Threaded HTTP server that answers chat completion requests.
+
+    Every request payload is recorded and answered after `latency` seconds
+    with `reply`; both may be fixed values or functions of the payload.
+    Statuses queued with `fail_next` are returned (with an optional
+    `Retry-After`) before normal answers resume.
+    """
+
+    def __init__(self, reply=default_reply, latency=0.0):
+        self.reply = reply
+        self.latency = latency
+        self.requests = []
+        self.max_in_flight = 0
+        self._in_flight = 0
+        self._failures = []
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", 0), self._handler())
+        self._server.daemon_threads = True
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        host, port = self._server.server_address
+        return f"http://{host}:{port}/v1/chat/completions"
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def fail_next(self, status, times=1, retry_after=None):
+        with self._lock:
+            self._failures.extend([(status, retry_after)] * times)
+
+    def _handler(self):
+        fake = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                payload = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+                with fake._lock:
+                    fake.requests.append(payload)
+                    status, retry_after = fake._failures.pop(0) if fake._failures else (200, None)
+                    fake._in_flight += 1
+                    fake.max_in_flight = max(fake.max_in_flight, fake._in_flight)
+                time.sleep(fake.latency(payload) if callable(fake.latency) else fake.latency)
+                with fake._lock:
+                    fake._in_flight -= 1
+                if status != 200:
+                    body = {"error": {"message": "Injected failure", "code": status}}
+                else:
+                    content = fake.reply(payload) if callable(fake.reply) else fake.reply
+                    body = {"choices": [{"index": 0, "message": {"role": "assistant", "content": content}}]}
+                data = json.dumps(body).encode()
+                try:
+                    self.send_response(status)
+                    self.send_header("Content-Type", "application/json")
+                    self.send_header("Content-Length", str(len(data)))
+                    if retry_after is not None:
+                        self.send_header("Retry-After", str(retry_after))
+                    self.end_headers()
+                    self.wfile.write(data)
+                except (BrokenPipeError, ConnectionResetError):
+                    pass  # client gave up (timeout test)
+
+            def log_message(self, *args):
+                pass
+
+        return Handler
@@ -1,9 +1,18 @@
 import pytest
 from httpx import AsyncClient, ASGITransport
-import sys, os
+import sys, os, json
 
 sys.path.append(os.path.dirname(os.path.dirname(__file__)))
 from app import app
+from fake_llm import FakeLLM
+from food_composition import estimate_nutrition
+
+@pytest.fixture
+def fake_llm(monkeypatch):
+    fake = FakeLLM().start()
+    monkeypatch.setattr(sys.modules["app"].llm, "url", fake.url)
+    yield fake
+    fake.stop()
 
 @pytest.mark.asyncio
 async def test_health_check():
@@ -29,3 +38,266 @@ async def test_predict_nutrition():
     assert "nutrition" in json_data
     for key in ["protein_pct", "fat_pct", "carbs_pct", "sugar_risk", "refined_carb"]:
         assert key in json_data["nutrition"]
+
+@pytest.mark.asyncio
+async def test_known_ingredients_are_served_locally(fake_llm):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        res = await ac.post("/predict-nutrition", json={"caption": "A dish containing rice (91.0%), chiken (64.0%), broccoli (22.0%)"})
+
+    json_data = res.json()
+    assert json_data["source"] == "local"
+    nutrition = json_data["nutrition"]
+    assert nutrition["protein_pct"] + nutrition["fat_pct"] + nutrition["carbs_pct"] == 100
+    assert nutrition["carbs_pct"] > nutrition["fat_pct"]
+    assert nutrition["refined_carb"] == 1 and nutrition["sugar_risk"] == 0
+    assert fake_llm.requests == []
+
+@pytest.mark.parametrize("caption, foods, flags", [
+    ("egg fried rice", ["egg", "rice"], (0, 1)),
+    ("carrot cake", ["carrot", "cake"], (1, 1)),
+    ("sweet potato fries", ["sweet potato", "french fries"], (0, 1)),
+])
+def test_multi_food_phrases_are_split(caption, foods, flags):
+    table = sys.modules["app"].composition_table
+    assert [entry.name for entry in table.lookup(caption)] == foods
+
+    nutrition, coverage = estimate_nutrition(caption, table, min_coverage=0.8)
+    assert coverage == 1.0
+    assert (nutrition["sugar_risk"], nutrition["refined_carb"]) == flags
+    # Neither food alone: egg fried rice is mostly carbohydrate, not egg protein
+    assert nutrition["carbs_pct"] > nutrition["protein_pct"]
+
+@pytest.mark.asyncio
+async def test_partly_known_phrases_fall_back_to_llm(fake_llm):
+    table = sys.modules["app"].composition_table
+    assert table.lookup("chicken nuggets") is None
+    assert estimate_nutrition("A dish containing chicken nuggets (95.0%)", table, min_coverage=0.8) == (None, 0.0)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        res = await ac.post("/predict-nutrition", json={"caption": "chicken nuggets"})
+    assert res.json()["source"] == "llm"
+    assert len(fake_llm.requests) == 1
+
+@pytest.mark.asyncio
+async def test_unknown_dishes_fall_back_to_llm(fake_llm):
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        res = await ac.post("/predict-nutrition", json={"caption": "Grandma's secret Sunday stew"})
+
+    assert res.json()["source"] == "llm"
+    assert res.json()["nutrition"]["carbs_pct"] == 50
+    assert len(fake_llm.requests) == 1
+    assert "Grandma's secret Sunday stew" in fake_llm.requests[0]["messages"][1]["content"]
+
+@pytest.mark.asyncio
+async def test_llm_rate_limits_are_retried(fake_llm, monkeypatch):
+    llm = sys.modules["app"].llm
+    monkeypatch.setattr(llm, "backoff_base", 0.01)
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        fake_llm.fail_next(429)
+        fake_llm.fail_next(429, retry_after=0)
+        res = await ac.post("/predict-nutrition", json={"caption": "Grandma's secret Sunday stew"})
+        assert res.json()["nutrition"]["carbs_pct"] == 50
+        assert len(fake_llm.requests) == 3
+
+        fake_llm.fail_next(429, times=llm.max_retries + 1)
+        res = await ac.post("/predict-nutrition", json={"caption": "Grandma's secret Sunday stew"})
+        assert "429" in res.json()["error"]
+
+@pytest.mark.asyncio
+async def test_llm_concurrency_is_capped_and_timed_out(fake_llm, monkeypatch):
+    import asyncio
+
+    llm = sys.modules["app"].llm
+    monkeypatch.setattr(llm, "max_concurrency", 2)
+    monkeypatch.setattr(llm, "_loop", None)  # rebuild client and semaphore with the new limits
+    fake_llm.latency = 0.2
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        responses = await asyncio.gather(*(
+            ac.post("/predict-nutrition", json={"caption": f"Mystery stew number {i}"}) for i in range(6)
+        ))
+        assert all(r.json()["source"] == "llm" for r in responses)
+        assert fake_llm.max_in_flight == 2
+
+        monkeypatch.setattr(llm, "timeout", 0.05)
+        monkeypatch.setattr(llm, "_loop", None)
+        res = await ac.post("/predict-nutrition", json={"caption": "Grandma's secret Sunday stew"})
+        assert "timed out" in res.json()["error"]
+
+@pytest.mark.asyncio
+async def test_predict_nutrition_batch(fake_llm, monkeypatch):
+    import json
+
+    monkeypatch.setattr(sys.modules["app"], "BATCH_MAX_CAPTIONS", 3)
+    captions = [f"Mystery stew number {i}" for i in range(5)] + ["banana"]
+
+    # Answer every batch except for its first caption, which must be retried alone
+    def reply(payload):
+        prompt = payload["messages"][-1]["content"]
+        if "Descriptions:" not in prompt:
+            return '{"protein_pct": 10, "fat_pct": 10, "carbs_pct": 80, "sugar_risk": 1, "refined_carb": 0}'
+        ids = [d["id"] for d in json.loads(prompt.split("Descriptions:", 1)[1])]
+        answers = [{"id": i, "protein_pct": 20, "fat_pct": 30, "carbs_pct": 50, "sugar_risk": 0, "refined_carb": 1} for i in ids[1:]]
+        answers.append({"id": ids[0], "protein_pct": "lots"})
+        return "```json\n" + json.dumps(answers) + "\n```"
+    fake_llm.reply = reply
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        res = await ac.post("/predict-nutrition-batch", json={"captions": captions})
+
+    results = res.json()["results"]
+    assert [r["caption"] for r in results] == captions
+    assert [r["source"] for r in results] == ["llm", "llm_batch", "llm_batch", "llm", "llm_batch", "local"]
+    assert results[1]["nutrition"]["carbs_pct"] == 50
+    assert results[0]["nutrition"]["carbs_pct"] == 80
+    # Two batch prompts of at most 3 captions, then one call per failed caption
+    assert len(fake_llm.requests) == 4
+
+@pytest.mark.asyncio
+async def test_identical_captions_share_one_llm_call(fake_llm):
+    import asyncio
+
+    fake_llm.latency = 0.2
+    captions = ["Grandma's secret Sunday stew", "grandma's  secret sunday stew.", "Grandma's secret Sunday stew"]
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        responses = await asyncio.gather(*(ac.post("/predict-nutrition", json={"caption": c}) for c in captions))
+
+    assert all(r.json()["nutrition"]["carbs_pct"] == 50 for r in responses)
+    assert len(fake_llm.requests) == 1
+    assert len(sys.modules["app"].inflight) == 0
+
+@pytest.mark.asyncio
+async def test_single_flight_survives_cancelled_and_timed_out_waiters():
+    import asyncio
+    from singleflight import SingleFlight
+
+    flight = SingleFlight()
+    started = []
+
+    async def upstream():
+        started.append(1)
+        await asyncio.sleep(0.1)
+        return "result"
+
+    # One waiter times out and one is cancelled; the remaining one still gets the shared result
+    waiter = asyncio.ensure_future(flight.do("key", upstream))
+    cancelled = asyncio.ensure_future(flight.do("key", upstream))
+    await asyncio.sleep(0)
+    cancelled.cancel()
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(flight.do("key", upstream), timeout=0.01)
+    assert await waiter == "result"
+    assert len(started) == 1
+
+    # When every waiter leaves, the upstream call is cancelled and the next caller starts afresh
+    with pytest.raises(asyncio.TimeoutError):
+        await asyncio.wait_for(flight.do("key", upstream), timeout=0.01)
+    assert len(flight) == 0
+    assert await flight.do("key", upstream) == "result"
+    assert len(started) == 3
+
+@pytest.mark.asyncio
+async def test_malformed_llm_answers_are_repaired_or_rejected(fake_llm, monkeypatch):
+    monkeypatch.setattr(sys.modules["app"], "NUTRITION_REPAIR_ATTEMPTS", 1)
+
+    # Free-text answer first; the repair prompt gets percentages that need normalising
+    def reply(payload):
+        if len(payload["messages"]) == 2:
+            return "protein_pct = 30, fat_pct = 30, carbs_pct = 30, sugar_risk = 1"
+        return '{"protein_pct": 30, "fat_pct": 30.0, "carbs_pct": 30, "sugar_risk": true, "refined_carb": 0}'
+    fake_llm.reply = reply
+
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        res = await ac.post("/predict-nutrition", json={"caption": "Grandma's secret Sunday stew"})
+        nutrition = res.json()["nutrition"]
+        assert nutrition == {"protein_pct": 34, "fat_pct": 33, "carbs_pct": 33, "sugar_risk": 1, "refined_carb": 0}
+        assert len(fake_llm.requests) == 2
+        assert fake_llm.requests[1]["messages"][2]["role"] == "assistant"
+
+        # Still invalid after the repair attempt: an error, never -1 values
+        fake_llm.reply = '{"protein_pct": 30, "fat_pct": 30, "carbs_pct": 40, "sugar_risk": 2, "refined_carb": 0}'
+        res = await ac.post("/predict-nutrition", json={"caption": "Mystery pie from the fair"})
+        assert "nutrition" not in res.json()
+        assert "sugar_risk" in res.json()["error"]
+        assert len(fake_llm.requests) == 4
+
+def test_nutrition_validator():
+    from nutrition_schema import InvalidNutrition, parse_nutrition
+
+    assert parse_nutrition('```json\n{"protein_pct": 0, "fat_pct": 0, "carbs_pct": 5, "sugar_risk": 0, "refined_carb": 0}\n```') == \
+        {"protein_pct": 0, "fat_pct": 0, "carbs_pct": 100, "sugar_risk": 0, "refined_carb": 0}
+    for bad, reason in (
+        ("no json here", "not_json"),
+        ('{"protein_pct": 30, "fat_pct": 30}', "schema"),
+        ('{"protein_pct": -5, "fat_pct": 30, "carbs_pct": 75, "sugar_risk": 0, "refined_carb": 0}', "schema"),
+        ('{"protein_pct": "30", "fat_pct": 30, "carbs_pct": 40, "sugar_risk": 0, "refined_carb": 0}', "schema"),
+        ('{"protein_pct": 0, "fat_pct": 0, "carbs_pct": 0, "sugar_risk": 0, "refined_carb": 0}', "schema"),
+    ):
+        with pytest.raises(InvalidNutrition) as e:
+            parse_nutrition(bad)
+        assert e.value.reason == reason
+
+@pytest.fixture
+def traced():
+    tracing = sys.modules["app"].tracing
+    tracing.configure("memory", sample_ratio=1.0)
+    yield tracing.exporter
+    tracing.configure("none")
+
+@pytest.mark.asyncio
+async def test_trace_context_is_continued(fake_llm, traced):
+    trace_id, parent_id = "0af7651916cd43dd8448eb211c80319c", "b7ad6b7169203331"
+    transport = ASGITransport(app=app)
+    async with AsyncClient(transport=transport, base_url="http://test") as ac:
+        res = await ac.post(
+            "/predict-nutrition",
+            json={"caption": "Uncle's mystery casserole"},
+            headers={"traceparent": f"00-{trace_id}-{parent_id}-01"}
+        )
+        # Callers that did not sample the trace are not recorded either
+        await ac.post(
+            "/predict-nutrition",
+            json={"caption": "Uncle's other casserole"},
+            headers={"traceparent": f"00-{'1' * 32}-{parent_id}-00"}
+        )
+
+    assert res.json()["source"] == "llm"
+    spans = {span.name: span for span in traced.get_finished_spans()}
+    assert set(spans) == {"POST /predict-nutrition", "inference", "upstream", "parse"}
+    server = spans.pop("POST /predict-nutrition")
+    assert format(server.context.trace_id, "032x") == trace_id
+    assert format(server.parent.span_id, "016x") == parent_id
+    assert server.attributes["http.status_code"] == 200
+    for span in spans.values():
+        assert span.context.trace_id == server.context.trace_id
+        assert span.parent.span_id == server.context.span_id
+
+def test_tracing_exporters(tmp_path):
+    from tracing import Tracing
+
+    tracing = Tracing("test", exporter="file", sample_ratio=1.0, file_path=str(tmp_path / "spans.jsonl"))
+    with tracing.span("parse", rows=1):
+        headers = tracing.inject({"accept": "application/json"})
+    tracing.shutdown()
+    assert headers["traceparent"].startswith("00-")
+    span = json.loads((tmp_path / "spans.jsonl").read_text().splitlines()[0])
+    assert span["name"] == "parse" and span["attributes"] == {"rows": 1}
+
+    # Nothing sampled at ratio 0 and nothing recorded without an exporter
+    tracing = Tracing("test", exporter="memory", sample_ratio=0.0)
+    with tracing.span("parse"):
+        pass
+    assert tracing.exporter.get_finished_spans() == ()
+    assert Tracing("test", exporter="none").inject() == {}
+    with pytest.raises(ValueError):
+        Tracing("test", exporter="jaeger")
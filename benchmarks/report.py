@@ -0,0 +1,84 @@
+# Summaries of benchmark samples and comparison of a run against a baseline.
+
+import numpy as np
+
+PERCENTILES = (50, 95, 99)
+
+def summarize(samples, elapsed):
+    """Throughput, latency percentiles (ms) and error rate of a list of replay samples."""
+    if not samples:
+        return {"requests": 0, "errors": 0, "error_rate": 0.0, "throughput_rps": 0.0}
+    latencies = np.array([s["latency"] for s in samples]) * 1000
+    errors = sum(s["error"] for s in samples)
+    statuses = {}
+    for s in samples:
+        statuses[str(s["status"])] = statuses.get(str(s["status"]), 0) + 1
+    summary = {
+        "requests": len(samples),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4),
+        "throughput_rps": round((len(samples) - errors) / elapsed, 3),
+        "latency_ms": {f"p{p}": round(float(v), 1) for p, v in zip(PERCENTILES, np.percentile(latencies, PERCENTILES))},
+        "statuses": statuses,
+    }
+    summary["latency_ms"]["mean"] = round(float(latencies.mean()), 1)
+    summary["latency_ms"]["max"] = round(float(latencies.max()), 1)
+    return summary
+
+def summarize_step(samples, elapsed, rate):
+    """Report of one target rate: overall and per request kind, plus load-generator lag."""
+    kinds = sorted({s["kind"] for s in samples})
+    lags = [s["lag"] for s in samples]
+    return {
+        "target_rps": rate,
+        "seconds": round(elapsed, 3),
+        "max_send_lag_ms": round(max(lags) * 1000, 1) if lags else 0.0,
+        "overall": summarize(samples, elapsed),
+        "endpoints": {kind: summarize([s for s in samples if s["kind"] == kind], elapsed) for kind in kinds},
+    }
+
+def compare(report, baseline, latency_tolerance=0.2, error_tolerance=0.01):
+    """Regressions of `report` against `baseline`, matched by target rate and endpoint.
+
+    A p95/p99 latency more than `latency_tolerance` (relative) above the
+    baseline, an error rate more than `error_tolerance` (absolute) above it,
+    or throughput more than `latency_tolerance` below it counts as a
+    regression. Returns a list of human-readable messages.
+    """
+    baseline_steps = {step["target_rps"]: step for step in baseline.get("steps", [])}
+    regressions = []
+    for step in report["steps"]:
+        base_step = baseline_steps.get(step["target_rps"])
+        if base_step is None:
+            continue
+        scopes = [("overall", step["overall"], base_step["overall"])]
+        scopes += [
+            (kind, summary, base_step["endpoints"][kind])
+            for kind, summary in step["endpoints"].items() if kind in base_step["endpoints"]
+        ]
+        for name, current, base in scopes:
+            where = f"{step['target_rps']} rps {name}"
+            for p in ("p95", "p99"):
+                now, before = current.get("latency_ms", {}).get(p), base.get("latency_ms", {}).get(p)
+                if now is not None and before and now > before * (1 + latency_tolerance):
+                    regressions.append(f"{where}: {p} {before:.1f} -> {now:.1f} ms")
+            if current["error_rate"] > base["error_rate"] + error_tolerance:
+                regressions.append(f"{where}: error rate {base['error_rate']:.2%} -> {current['error_rate']:.2%}")
+            if base["throughput_rps"] and current["throughput_rps"] < base["throughput_rps"] * (1 - latency_tolerance):
+                regressions.append(
+                    f"{where}: throughput {base['throughput_rps']:.2f} -> {current['throughput_rps']:.2f} rps"
+                )
+    return regressions
+
+def format_step(step):
+    """Text table of one step for the console."""
+    lines = [f"--- {step['target_rps']} rps target, {step['seconds']:.1f}s, max send lag {step['max_send_lag_ms']} ms ---"]
+    lines.append(f"{'endpoint':<34}{'reqs':>6}{'err%':>8}{'rps':>8}{'p50':>9}{'p95':>9}{'p99':>9}")
+    rows = [("overall", step["overall"])] + list(step["endpoints"].items())
+    for name, s in rows:
+        latency = s.get("latency_ms", {})
+        lines.append(
+            f"{name:<34}{s['requests']:>6}{s['error_rate'] * 100:>7.1f}%{s['throughput_rps']:>8.2f}"
+            f"{latency.get('p50', 0):>9.1f}{latency.get('p95', 0):>9.1f}{latency.get('p99', 0):>9.1f}"
+        )
+    return "\n".join(lines)
@@ -0,0 +1,149 @@
+# End-to-end load test of the whole system: starts Postgres, fake Clarifai and
+# OpenAI servers and all five services locally, replays a request mix against
+# the controller at each target rate and reports throughput, p50/p95/p99
+# latency and error rates per endpoint as JSON, optionally against a baseline.
+# RUN: python benchmarks/run_e2e.py [--rates 2 5 10] [--duration 30] [--baseline benchmarks/e2e_baseline.json]
+#      python benchmarks/run_e2e.py --save-baseline benchmarks/e2e_baseline.json
+#      python benchmarks/run_e2e.py --no-db     (without Postgres: skips user accounts and DB writes)
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+
+import httpx
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+
+from report import compare, format_step, summarize_step
+from stack import ROOT, Stack
+from workload import DEFAULT_MIX, REQUEST_KINDS, Payloads, generate_schedule, load_schedule, replay, save_schedule
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="End-to-end load test of all five services")
+    parser.add_argument("--rates", type=float, nargs="+", default=[2, 5], help="Target request rates (requests/s), one step each")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load per rate")
+    parser.add_argument("--warmup", type=float, default=5, help="Seconds of unreported load before the first step")
+    parser.add_argument("--mix", default=None, help="JSON object (or file) of request kind -> weight")
+    parser.add_argument("--schedule", default=None, help="Replay a recorded schedule (JSON lines) instead of generating one")
+    parser.add_argument("--record", default=None, help="Write the generated schedules to this JSON-lines file")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--clarifai-latency", type=float, default=0.3, help="Fake Clarifai answer delay (s)")
+    parser.add_argument("--llm-latency", type=float, default=1.0, help="Fake OpenAI answer delay (s)")
+    parser.add_argument("--photos", type=int, default=50, help="Distinct meal photos in the mix")
+    parser.add_argument("--timeout", type=float, default=60, help="Client timeout per request (s)")
+    parser.add_argument("--no-db", action="store_true", help="Run without Postgres")
+    parser.add_argument("--env", action="append", default=[], metavar="KEY=VALUE", help="Extra environment for every service")
+    parser.add_argument("--out", default=os.path.join(ROOT, "benchmarks", "results", "e2e.json"), help="JSON report path")
+    parser.add_argument("--baseline", default=None, help="Report to compare against; exit 1 on regressions")
+    parser.add_argument("--save-baseline", default=None, help="Also write the report here as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative p95/p99 and throughput change")
+    return parser.parse_args(argv)
+
+def load_mix(value, with_db):
+    mix = dict(DEFAULT_MIX)
+    if value:
+        mix = json.load(open(value)) if os.path.exists(value) else json.loads(value)
+    unknown = set(mix) - set(REQUEST_KINDS)
+    if unknown:
+        raise SystemExit(f"Unknown request kinds in mix: {', '.join(sorted(unknown))}")
+    if not with_db:
+        mix = {kind: weight for kind, weight in mix.items() if not REQUEST_KINDS[kind][1]}
+    return mix
+
+def git_revision():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def create_user(controller_url):
+    """Sign up a fresh benchmark account; returns (user_id, username, password)."""
+    username, password = f"bench-{uuid.uuid4().hex[:8]}", "bench-password"
+    response = httpx.post(f"{controller_url}/signup", timeout=30,
+                          json={"username": username, "email": f"{username}@example.com", "password": password})
+    response.raise_for_status()
+    return response.json()["user_id"], username, password
+
+async def run_steps(stack, args, mix, payloads):
+    limits = httpx.Limits(max_connections=1000, max_keepalive_connections=100)
+    steps = []
+    async with httpx.AsyncClient(base_url=stack.controller_url, limits=limits) as client:
+        if args.schedule:
+            schedule = load_schedule(args.schedule)
+            plan = [(len(schedule) / schedule[-1][0] if schedule else 0.0, schedule)]
+        else:
+            plan = [
+                (rate, generate_schedule(mix, rate, args.duration, seed=args.seed + i))
+                for i, rate in enumerate(args.rates)
+            ]
+            if args.record:
+                save_schedule([(offset + i * args.duration, kind) for i, (_, schedule) in enumerate(plan)
+                               for offset, kind in schedule], args.record)
+
+        if args.warmup > 0 and plan[0][0] > 0:
+            print(f"Warming up for {args.warmup:.0f}s ...")
+            await replay(client, generate_schedule(mix, plan[0][0], args.warmup, seed=args.seed - 1),
+                         payloads, timeout=args.timeout)
+
+        for rate, schedule in plan:
+            stack.clarifai.requests.clear()
+            stack.clarifai.images.clear()
+            stack.llm.requests.clear()
+            samples, elapsed = await replay(client, schedule, payloads, timeout=args.timeout, seed=args.seed)
+            step = summarize_step(samples, elapsed, round(rate, 3))
+            # Upstream calls per request show what caching and batching save
+            step["upstream_calls"] = {"clarifai": len(stack.clarifai.requests), "openai": len(stack.llm.requests)}
+            print(format_step(step))
+            steps.append(step)
+    return steps
+
+def main(argv=None):
+    args = parse_args(argv)
+    mix = load_mix(args.mix, not args.no_db)
+    env = dict(item.split("=", 1) for item in args.env)
+
+    with tempfile.TemporaryDirectory(prefix="nutrition-bench-") as workdir:
+        print("Starting services ...")
+        started = time.perf_counter()
+        with Stack(workdir, clarifai_latency=args.clarifai_latency, llm_latency=args.llm_latency,
+                   with_db=not args.no_db, env=env) as stack:
+            print(f"Stack up in {time.perf_counter() - started:.1f}s")
+            user = None if args.no_db else create_user(stack.controller_url)
+            payloads = Payloads(n_photos=args.photos, user=user)
+            steps = asyncio.run(run_steps(stack, args, mix, payloads))
+
+    report = {
+        "config": {
+            "revision": git_revision(),
+            "rates": args.rates, "duration": args.duration, "schedule": args.schedule, "mix": mix,
+            "clarifai_latency": args.clarifai_latency, "llm_latency": args.llm_latency,
+            "database": not args.no_db, "env": env, "seed": args.seed,
+        },
+        "steps": steps,
+    }
+    for path in filter(None, [args.out, args.save_baseline]):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Report written to {path}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(report, json.load(f), latency_tolerance=args.tolerance)
+        if regressions:
+            print("Regressions against the baseline:")
+            for message in regressions:
+                print(f"  {message}")
+            return 1
+        print("No regressions against the baseline")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,232 @@
+# Local copy of the whole system for end-to-end benchmarks: a throwaway
+# Postgres, fake Clarifai and OpenAI servers with configurable latency, and
+# the five services as uvicorn subprocesses wired to them.
+
+import os
+import shutil
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(os.path.join(ROOT, "IEP-FoodAnalyzer", "tests"))
+sys.path.append(os.path.join(ROOT, "IEP-NutritionPredictor", "tests"))
+
+from fake_clarifai import FakeClarifai
+from fake_llm import FakeLLM
+
+# Service directory, name in URLs/env, started in this order (IEPs before the controller)
+SERVICES = [
+    ("IEP-FoodAnalyzer", "FOOD_ANALYZER_URL"),
+    ("IEP-NutritionPredictor", "NUTRITION_PREDICTOR_URL"),
+    ("IEP-MicrobiomAnalyzer", "MICROBIOM_ANALYZER_URL"),
+    ("IEP-GlucoseMonitor", "GLUCOSE_MONITOR_URL"),
+    ("EEP-NutritionController", None),
+]
+
+DB_USER = "bench"
+DB_PASSWORD = "bench"
+DB_NAME = "postgres"
+POSTGRES_IMAGE = "postgres:16-alpine"
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def postgres_bin(name):
+    """Path of a Postgres server binary, also looking in Debian's versioned directories."""
+    found = shutil.which(name)
+    if found:
+        return found
+    root = "/usr/lib/postgresql"
+    if os.path.isdir(root):
+        for version in sorted(os.listdir(root), reverse=True):
+            path = os.path.join(root, version, "bin", name)
+            if os.path.exists(path):
+                return path
+    return None
+
+class Postgres:
+    """Throwaway Postgres: a temporary cluster via initdb/pg_ctl, else a Docker container.
+
+    `env` holds the DB_* variables the controller reads.
+    """
+
+    def __init__(self, workdir):
+        self.workdir = workdir
+        self.port = free_port()
+        self.env = {
+            "DB_HOST": "127.0.0.1", "DB_PORT": str(self.port), "DB_NAME": DB_NAME,
+            "DB_USER": DB_USER, "DB_PASSWORD": DB_PASSWORD,
+        }
+        self._stop = None
+
+    def start(self):
+        if postgres_bin("initdb") and postgres_bin("pg_ctl"):
+            self._start_cluster()
+        elif shutil.which("docker"):
+            self._start_container()
+        else:
+            raise RuntimeError("No Postgres found: install the server (initdb/pg_ctl) or Docker, or pass --no-db")
+        self._wait_ready()
+        return self
+
+    def _start_cluster(self):
+        data = os.path.join(self.workdir, "pgdata")
+        pwfile = os.path.join(self.workdir, "pgpass")
+        with open(pwfile, "w") as f:
+            f.write(DB_PASSWORD)
+        subprocess.run(
+            [postgres_bin("initdb"), "-D", data, "-U", DB_USER, "--auth=md5", f"--pwfile={pwfile}"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        pg_ctl = postgres_bin("pg_ctl")
+        subprocess.run(
+            [pg_ctl, "-D", data, "-l", os.path.join(self.workdir, "postgres.log"), "-w", "start",
+             "-o", f"-p {self.port} -k {self.workdir} -c listen_addresses=127.0.0.1"],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        self._stop = [pg_ctl, "-D", data, "-m", "fast", "-w", "stop"]
+
+    def _start_container(self):
+        name = f"nutrition-bench-pg-{self.port}"
+        subprocess.run(
+            ["docker", "run", "-d", "--rm", "--name", name, "-p", f"127.0.0.1:{self.port}:5432",
+             "-e", f"POSTGRES_USER={DB_USER}", "-e", f"POSTGRES_PASSWORD={DB_PASSWORD}", POSTGRES_IMAGE],
+            check=True, stdout=subprocess.DEVNULL
+        )
+        self._stop = ["docker", "stop", name]
+
+    def _wait_ready(self, timeout=60):
+        import psycopg2
+
+        deadline = time.monotonic() + timeout
+        while True:
+            try:
+                psycopg2.connect(host="127.0.0.1", port=self.port, user=DB_USER,
+                                 password=DB_PASSWORD, dbname=DB_NAME).close()
+                return
+            except psycopg2.OperationalError:
+                if time.monotonic() > deadline:
+                    raise RuntimeError(f"Postgres did not accept connections within {timeout}s")
+                time.sleep(0.5)
+
+    def stop(self):
+        if self._stop is not None:
+            subprocess.run(self._stop, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+            self._stop = None
+
+class Stack:
+    """All five services plus their fakes, started together and stopped in reverse.
+
+    `clarifai_latency` and `llm_latency` are the fake APIs' answer delays in
+    seconds. Service logs are written to `<workdir>/logs`. `env` overrides
+    variables of every service, e.g. to compare configurations.
+    """
+
+    def __init__(self, workdir, clarifai_latency=0.3, llm_latency=1.0, with_db=True, env=None):
+        self.workdir = workdir
+        self.clarifai = FakeClarifai(latency=clarifai_latency)
+        self.llm = FakeLLM(latency=llm_latency)
+        self.postgres = Postgres(workdir) if with_db else None
+        self.extra_env = env or {}
+        self.urls = {}
+        self._processes = []
+
+    @property
+    def controller_url(self):
+        return self.urls["EEP-NutritionController"]
+
+    def _service_env(self):
+        env = dict(os.environ)
+        env.update({
+            "CLARIFAI_PAT": "bench", "CLARIFAI_USER_ID": "bench", "CLARIFAI_APP_ID": "bench",
+            "CLARIFAI_API_URL": self.clarifai.url,
+            "OPENAI_API_KEY": "bench", "OPENAI_API_URL": self.llm.url,
+            "FEATURE_STORE_PATH": os.path.join(self.workdir, "feature_store.db"),
+            "TRACING_EXPORTER": "none",
+            # No S3 access: the services fall back to their bundled data
+            "AWS_ACCESS_KEY_ID": "", "AWS_SECRET_ACCESS_KEY": "", "AWS_EC2_METADATA_DISABLED": "true",
+        })
+        if self.postgres is not None:
+            env.update(self.postgres.env)
+        for service, url_var in SERVICES:
+            if url_var and service in self.urls:
+                env[url_var] = self.urls[service]
+        env.update(self.extra_env)
+        return env
+
+    def start(self):
+        try:
+            self.clarifai.start()
+            self.llm.start()
+            if self.postgres is not None:
+                self.postgres.start()
+                self._create_tables()
+            logs = os.path.join(self.workdir, "logs")
+            os.makedirs(logs, exist_ok=True)
+            for service, _ in SERVICES:
+                self._start_service(service, logs)
+        except BaseException:
+            self.stop()
+            raise
+        return self
+
+    def _create_tables(self):
+        subprocess.run(
+            [sys.executable, "-c", "from Database.db import create_tables; create_tables()"],
+            cwd=os.path.join(ROOT, "EEP-NutritionController"), env=self._service_env(), check=True
+        )
+
+    def _start_service(self, service, logs, timeout=120):
+        port = free_port()
+        url = f"http://127.0.0.1:{port}"
+        log_path = os.path.join(logs, f"{service}.log")
+        log = open(log_path, "w")
+        process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "app:app", "--host", "127.0.0.1", "--port", str(port)],
+            cwd=os.path.join(ROOT, service), env=self._service_env(),
+            stdout=log, stderr=subprocess.STDOUT
+        )
+        self._processes.append((process, log))
+
+        deadline = time.monotonic() + timeout
+        while True:
+            if process.poll() is not None:
+                with open(log_path) as f:
+                    tail = "".join(f.readlines()[-20:])
+                raise RuntimeError(f"{service} exited during startup:\n{tail}")
+            try:
+                if httpx.get(f"{url}/metrics/", timeout=2).status_code == 200:
+                    break
+            except httpx.HTTPError:
+                pass
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"{service} did not start within {timeout}s (see {log_path})")
+            time.sleep(0.25)
+        self.urls[service] = url
+
+    def stop(self):
+        for process, log in reversed(self._processes):
+            process.terminate()
+            try:
+                process.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                process.kill()
+            log.close()
+        self._processes = []
+        if self.postgres is not None:
+            self.postgres.stop()
+        for fake in (self.clarifai, self.llm):
+            if fake._thread.is_alive():
+                fake.stop()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
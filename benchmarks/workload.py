@@ -0,0 +1,190 @@
+# Request mix for end-to-end benchmarks: the kinds of controller requests,
+# seeded schedules of them at a target rate, and open-loop replay.
+
+import asyncio
+import io
+import json
+import os
+import random
+import time
+
+import numpy as np
+from PIL import Image
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BIO_CSV = os.path.join(ROOT, "IEP-GlucoseMonitor", "tests", "test_bio.csv")
+MICRO_CSV = os.path.join(ROOT, "IEP-GlucoseMonitor", "tests", "test_microbe.csv")
+
+MEAL_CATEGORIES = ["Breakfast", "Lunch", "Dinner", "Snack"]
+DESCRIPTIONS = [
+    None,
+    "grilled chicken with white rice and broccoli",
+    "a bowl of oatmeal with banana and honey",
+    "pasta with tomato sauce and parmesan",
+    "Grandma's Sunday stew",
+    "salmon, quinoa and spinach salad with olive oil",
+]
+
+# Requests per kind in the generated mix (relative weights)
+DEFAULT_MIX = {
+    "analyze_meal": 4,
+    "predict_gut_health": 2,
+    "predict_glucose_from_all": 3,
+    "predict_gut_health_and_glucose": 1,
+    "signin": 1,
+}
+
+def make_photo(seed, width=320, height=240):
+    """Smooth random 'photo' (JPEG); distinct seeds give perceptually distinct images."""
+    rng = np.random.default_rng(seed)
+    coarse = rng.integers(0, 256, size=(6, 8, 3), dtype=np.uint8)
+    image = Image.fromarray(coarse).resize((width, height), Image.BICUBIC)
+    buffer = io.BytesIO()
+    image.save(buffer, format="JPEG", quality=85)
+    return buffer.getvalue()
+
+class Payloads:
+    """Request bodies shared by all requests of a run.
+
+    `n_photos` distinct meal photos are cycled, so the food analyzer's
+    near-duplicate cache sees a realistic share of repeats. `user` is the
+    (user_id, username, password) of the benchmark account, or None when
+    the run has no database.
+    """
+
+    def __init__(self, n_photos=50, user=None):
+        self.photos = [make_photo(seed) for seed in range(n_photos)]
+        with open(BIO_CSV, "rb") as f:
+            self.bio = f.read()
+        with open(MICRO_CSV, "rb") as f:
+            self.micro = f.read()
+        self.user = user
+
+    def user_form(self):
+        return {"user_id": str(self.user[0])} if self.user else {}
+
+def analyze_meal(payloads, rng):
+    description = rng.choice(DESCRIPTIONS)
+    return "/analyze-meal", {
+        "files": {"image": ("meal.jpg", rng.choice(payloads.photos), "image/jpeg")},
+        "data": {"description": description} if description else {},
+    }
+
+def predict_gut_health(payloads, rng):
+    return "/predict-gut-health", {
+        "files": {"file": ("micro.csv", payloads.micro, "text/csv")},
+        "data": payloads.user_form(),
+    }
+
+def predict_glucose_from_all(payloads, rng):
+    description = rng.choice(DESCRIPTIONS)
+    data = {"meal_category": rng.choice(MEAL_CATEGORIES), **payloads.user_form()}
+    if description:
+        data["description"] = description
+    return "/predict-glucose-from-all", {
+        "files": {
+            "image": ("meal.jpg", rng.choice(payloads.photos), "image/jpeg"),
+            "bio_file": ("bio.csv", payloads.bio, "text/csv"),
+            "micro_file": ("micro.csv", payloads.micro, "text/csv"),
+        },
+        "data": data,
+    }
+
+def predict_gut_health_and_glucose(payloads, rng):
+    return "/predict-gut-health-and-glucose", {
+        "files": {
+            "image": ("meal.jpg", rng.choice(payloads.photos), "image/jpeg"),
+            "micro_file": ("micro.csv", payloads.micro, "text/csv"),
+            "bio_file": ("bio.csv", payloads.bio, "text/csv"),
+        },
+        "data": {"meal_category": rng.choice(MEAL_CATEGORIES), **payloads.user_form()},
+    }
+
+def signin(payloads, rng):
+    _, username, password = payloads.user
+    return "/signin", {"json": {"username": username, "password": password}}
+
+# Request kind -> (builder, needs the database)
+REQUEST_KINDS = {
+    "analyze_meal": (analyze_meal, False),
+    "predict_gut_health": (predict_gut_health, False),
+    "predict_glucose_from_all": (predict_glucose_from_all, False),
+    "predict_gut_health_and_glucose": (predict_gut_health_and_glucose, False),
+    "signin": (signin, True),
+}
+
+def generate_schedule(mix, rate, duration, seed=0):
+    """[(offset_seconds, kind)] with Poisson arrivals at `rate`/s for `duration` seconds.
+
+    Kinds are drawn by the weights in `mix`; the same seed gives the same schedule.
+    """
+    rng = random.Random(seed)
+    kinds, weights = zip(*[(kind, weight) for kind, weight in mix.items() if weight > 0])
+    schedule, t = [], 0.0
+    while True:
+        t += rng.expovariate(rate)
+        if t >= duration:
+            return schedule
+        schedule.append((t, rng.choices(kinds, weights)[0]))
+
+def save_schedule(schedule, path):
+    with open(path, "w") as f:
+        for offset, kind in schedule:
+            f.write(json.dumps({"t": round(offset, 6), "kind": kind}) + "\n")
+
+def load_schedule(path):
+    """Schedule recorded by `save_schedule` (JSON lines with `t` and `kind`), sorted by time."""
+    schedule = []
+    with open(path) as f:
+        for line in f:
+            if line.strip():
+                entry = json.loads(line)
+                if entry["kind"] not in REQUEST_KINDS:
+                    raise ValueError(f"Unknown request kind {entry['kind']!r} in {path}")
+                schedule.append((float(entry["t"]), entry["kind"]))
+    return sorted(schedule)
+
+def is_error(response):
+    """Non-200 status, or a 200 whose JSON body reports an error (the controller's convention)."""
+    if response.status_code != 200:
+        return True
+    try:
+        body = response.json()
+    except ValueError:
+        return True
+    return isinstance(body, dict) and "error" in body
+
+async def replay(client, schedule, payloads, timeout=60.0, seed=0):
+    """Send every scheduled request at its offset without waiting for earlier ones (open loop).
+
+    Returns (samples, elapsed) where each sample is a dict with kind, the
+    send offset, latency in seconds, status and error flag. `lag` is how late
+    the request went out, which shows when the load generator itself cannot
+    keep up.
+    """
+    rng = random.Random(seed)
+    samples = []
+
+    async def send(kind, lag):
+        builder, _ = REQUEST_KINDS[kind]
+        path, kwargs = builder(payloads, rng)
+        start = time.perf_counter()
+        try:
+            response = await client.post(path, timeout=timeout, **kwargs)
+            status, error = response.status_code, is_error(response)
+        except Exception as e:
+            status, error = type(e).__name__, True
+        samples.append({
+            "kind": kind, "latency": time.perf_counter() - start,
+            "status": status, "error": error, "lag": lag,
+        })
+
+    tasks = []
+    start = time.perf_counter()
+    for offset, kind in schedule:
+        delay = offset - (time.perf_counter() - start)
+        if delay > 0:
+            await asyncio.sleep(delay)
+        tasks.append(asyncio.ensure_future(send(kind, max(0.0, -delay))))
+    await asyncio.gather(*tasks)
+    return samples, time.perf_counter() - start